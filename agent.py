@@ -1,15 +1,46 @@
-from llm import chat_with_gemini
+from llm import chat_with_gemini, stream_chat_with_gemini, stream_mode, ChatSession
+import llm
 import re
 import os
 import json
 import shutil
+import shlex
+import time
+import atexit
 import datetime
-from executor import run_command, get_system_info, list_directory
-from utils import write_file, read_file, ensure_dir, copy_file
+import threading
+from collections import deque
+import cache
+from executor import run_command_async, format_command_result, get_system_info, list_directory, format_size
+from utils import write_file, write_file_if_changed, write_files, ensure_dir, copy_file
+from reader import read_range, BinaryFileError, is_binary
+from manifest import get_manifest, delete_files, manifest_db
+from memo import command_cache
+from jobs import job_manager
+from scaffold import get_template, get_templates, materialize
+import workspace
+import telemetry
+import profiling
+import resilience
+import console
+import patching
+from history import HistoryStore, SearchIndex, compact_entry, import_legacy_history
 
-# Initialize conversation history
-conversation_history = []
-history_file = "conversation_history.json"
+# Conversation history: a bounded window of recent turns backed by an append-only log
+history_window = int(os.getenv("HISTORY_WINDOW", "100"))
+conversation_history = deque(maxlen=history_window)
+history_store = None
+history_index = None
+history_file = "conversation_history.json"  # Legacy format, imported on first load
+
+# Multi-turn chat sessions, enabled with !session on. The REPL uses the
+# "default" session; daemon clients pick theirs by name (see current_session_name)
+chat_sessions = {}
+session_context = threading.local()
+
+def current_session_name():
+    """Name of the chat session used by this thread's turns."""
+    return getattr(session_context, "name", "default")
 
 # Command aliases for more intuitive usage
 COMMAND_ALIASES = {
@@ -25,11 +56,20 @@ COMMAND_ALIASES = {
     "create": "!create",
     "delete": "!delete",
     "rm": "!delete",
+    "restore": "!restore",
     "deleteall": "!deleteall",
     "clean": "!deleteall",
     "history": "!history",
     "info": "!info",
     "system": "!info",
+    "cache": "!cache",
+    "session": "!session",
+    "context": "!context",
+    "stats": "!stats",
+    "profile": "!profile",
+    "model": "!model",
+    "jobs": "!jobs",
+    "parallel": "!parallel",
     
     # Additional aliases for flexibility
     "new": "!init",
@@ -66,56 +106,279 @@ Type 'help' for a list of available commands.
 
 def save_history(prompt, response, files=None):
     """Save conversation to history."""
-    global conversation_history
-    
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    entry = {
+    record = {
         "timestamp": timestamp,
         "prompt": prompt,
-        "response": response[:500] + ("..." if len(response) > 500 else ""),  # Truncate long responses
+        "response": response,
         "files_created": files or []
     }
     
-    conversation_history.append(entry)
+    if history_store is None:
+        load_history()
+    
+    conversation_history.append(compact_entry(record))
     
-    # Save to file
+    # Append to the log; earlier turns are never rewritten
     try:
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(conversation_history, f, indent=2)
+        with telemetry.span("history.save"):
+            number = history_store.append(record)
     except Exception as e:
         print(f"❌ Error saving history: {str(e)}")
+        return
+    
+    # Keep the search index in step with the log
+    try:
+        with telemetry.span("history.index"):
+            get_history_index().add(number, record)
+    except Exception as e:
+        print(f"❌ Error indexing history: {str(e)}")
+
+def get_history_index():
+    """The full-text index over the history log, opened (and caught up) on first use."""
+    global history_index
+    
+    if history_store is None:
+        load_history()
+    if history_index is None or history_index.store is not history_store:
+        history_index = SearchIndex(history_store)
+        atexit.register(history_index.close)
+    return history_index
 
 def load_history():
-    """Load conversation history from file."""
-    global conversation_history
+    """Open the history log and fill the in-memory window with its most recent turns."""
+    global history_store
     
-    if os.path.exists(history_file):
-        try:
-            with open(history_file, 'r', encoding='utf-8') as f:
-                conversation_history = json.load(f)
-        except Exception as e:
-            print(f"❌ Error loading history: {str(e)}")
-            conversation_history = []
-    else:
-        conversation_history = []
+    if history_store is not None:
+        return
+    
+    try:
+        history_store = HistoryStore()
+        atexit.register(history_store.close)
+        import_legacy_history(history_store, history_file)
+        conversation_history.clear()
+        conversation_history.extend(compact_entry(r) for r in history_store.tail(history_window))
+    except Exception as e:
+        print(f"❌ Error loading history: {str(e)}")
 
 def show_history(limit=10):
     """Display the conversation history."""
-    if not conversation_history:
-        return "No conversation history available."
+    if history_store is None:
+        load_history()
     
-    # Show the most recent conversations first, limited by the parameter
-    recent = conversation_history[-limit:] if limit else conversation_history
+    # Serve from the in-memory window when it covers the request, else read the log tail
+    if limit and limit <= len(conversation_history):
+        recent = list(conversation_history)[-limit:]
+    elif history_store is not None:
+        recent = [compact_entry(r) for r in history_store.tail(limit)]
+    else:
+        recent = list(conversation_history)
+    
+    if not recent:
+        return "No conversation history available."
     
     result = []
     for i, entry in enumerate(recent):
-        files_str = ", ".join(entry["files_created"]) if entry["files_created"] else "None"
-        result.append(f"{i+1}. [{entry['timestamp']}] 👤: {entry['prompt']}\n   🤖: {entry['response']}\n   📄 Files: {files_str}")
+        files_str = ", ".join(entry.files_created) if entry.files_created else "None"
+        result.append(f"{i+1}. [{entry.timestamp}] 👤: {entry.prompt}\n   🤖: {entry.response}\n   📄 Files: {files_str}")
+    
+    return "\n\n".join(result)
+
+def parse_history_search_args(arg_string):
+    """Parse the arguments of !history search into keyword arguments for SearchIndex.search."""
+    tokens = shlex.split(arg_string)
+    options = {"terms": []}
+    
+    def value(i):
+        if i + 1 >= len(tokens):
+            raise ValueError(f"Missing value for {tokens[i]}")
+        return tokens[i + 1]
+    
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ("--since", "--until"):
+            date = value(i)
+            if not re.match(r"^\d{4}-\d{2}-\d{2}", date):
+                raise ValueError(f"{token} expects a date like 2024-05-31")
+            options[token[2:]] = date
+            i += 1
+        elif token == "--file":
+            options["file"] = value(i)
+            i += 1
+        elif token in ("--llm", "--edits"):
+            # Only !edit turns are saved besides prompts; other commands never reach the history
+            options["kind"] = "llm" if token == "--llm" else "command"
+        elif token == "--best":
+            options["best"] = True
+        elif token == "--limit":
+            if not value(i).isdigit() or int(value(i)) < 1:
+                raise ValueError("--limit expects a positive number")
+            options["limit"] = int(value(i))
+            i += 1
+        elif token.startswith("-") and token != "-":
+            raise ValueError(f"Unknown option: {token}")
+        else:
+            options["terms"].append(token)
+        i += 1
+    
+    if not options["terms"] and not set(options) - {"terms", "best", "limit"}:
+        raise ValueError("Give search terms or a filter")
+    return options
+
+def search_history(arg_string):
+    """Find past turns by full-text search, reading only the matching records from the log."""
+    try:
+        options = parse_history_search_args(arg_string)
+    except ValueError as e:
+        return f"❌ {str(e)}. Use: !history search <terms> [--since DATE] [--until DATE] [--file PATH] [--llm | --edits] [--best] [--limit N]"
+    
+    try:
+        index = get_history_index()
+        with telemetry.span("history.search"):
+            numbers = index.search(**options)
+            records = history_store.read(numbers)
+    except Exception as e:
+        return f"❌ Error searching history: {str(e)}"
+    
+    if not numbers:
+        return "🔍 No matching turns."
+    
+    result = [f"🔍 {len(numbers)} matching turn(s)" + (" (best first)" if options.get("best") and options["terms"] else " (newest first)")]
+    for number, record in zip(numbers, records):
+        entry = compact_entry(record, max_response=200)
+        files_str = ", ".join(entry.files_created) if entry.files_created else "None"
+        result.append(f"#{number + 1} [{entry.timestamp}] 👤: {entry.prompt}\n   🤖: {entry.response}\n   📄 Files: {files_str}")
     
     return "\n\n".join(result)
 
-def save_code_blocks(text):
-    """Extract and save code blocks with proper file extensions."""
+# Map common language names to file extensions
+EXTENSION_MAP = {
+    "python": "py", "py": "py",
+    "javascript": "js", "js": "js",
+    "jsx": "jsx",
+    "typescript": "ts", "ts": "ts",
+    "tsx": "tsx",
+    "html": "html",
+    "css": "css",
+    "java": "java",
+    "cpp": "cpp", "c++": "cpp",
+    "c": "c",
+    "json": "json",
+    "bash": "sh", "shell": "sh",
+    "": "txt"  # Default to .txt if no language specified
+}
+
+# Opening fence of a code block: ``` followed by an optional language tag
+FENCE_OPEN_PATTERN = re.compile(r"```(\w*)\n")
+FENCE_PARTIAL_PATTERN = re.compile(r"\w*")
+
+def ask_save_options():
+    """Ask where generated code should be saved and whether to organize it."""
+    print("\n📂 Save generated code:")
+    print("   1. Default directory (generated/)")
+    print("   2. Custom directory")
+    target_choice = input("Select option [1]: ").strip()
+    
+    if target_choice == "2":
+        target_dir = input("Enter target directory: ").strip()
+        if not target_dir:
+            target_dir = "generated"
+    else:
+        target_dir = "generated"
+    
+    # Ask if we should create project structure
+    print("\n🏗️  Project structure:")
+    print("   y - Organize files in appropriate folders")
+    print("   n - Save all files in the target directory")
+    create_structure = input("Organize files? (y/n) [n]: ").lower().strip()
+    create_structure = create_structure == 'y'
+    
+    ensure_dir(target_dir)
+    return target_dir, create_structure
+
+def resolve_block_path(lang, content, index, target_dir, create_structure):
+    """Work out where the code block at position index should be saved."""
+    ext = EXTENSION_MAP.get(lang.lower(), "txt")
+    
+    # Try to extract file path from code block content or comments
+    file_path = None
+    
+    if create_structure:
+        # Look for file path indicators in content
+        path_match = re.search(r'(?:\/\/|#|\/\*)\s*(?:file|path):\s*([^\n\r]*)', content)
+        if path_match:
+            file_path = path_match.group(1).strip()
+        
+        # Check for common file patterns
+        elif lang.lower() in ["js", "javascript"] and "import React" in content and "export default" in content:
+            file_path = "components/Component" + str(index+1) + ".jsx"
+        elif "package.json" in content and '"dependencies"' in content:
+            file_path = "package.json"
+        elif lang.lower() in ["html"] and "<html" in content:
+            file_path = "public/index.html"
+        elif lang.lower() in ["css"] and "{" in content:
+            file_path = "styles/style.css"
+        elif lang.lower() in ["bash", "sh"] and ("npm" in content or "npx" in content):
+            file_path = "scripts/setup.sh"
+    
+    if file_path:
+        # Parent directories are created by the write pipeline
+        return os.path.join(target_dir, file_path)
+    
+    # Default filename if no structure detected
+    filename = f"file_{index+1}.{ext}"
+    return os.path.join(target_dir, filename)
+
+def report_saved(path, status):
+    """Print the outcome of writing one generated file."""
+    if status == "written":
+        print(f"💾 Saved: {path}")
+    elif status == "unchanged":
+        print(f"✔️  Unchanged: {path}")
+    else:
+        print(f"❌ Could not save {path}: {status}")
+
+def save_code_block(lang, content, index, target_dir, create_structure):
+    """Write a single code block to disk and return (path, status)."""
+    with telemetry.span("files.save", files=1):
+        path = resolve_block_path(lang, content, index, target_dir, create_structure)
+        
+        try:
+            ensure_dir(os.path.dirname(path))
+            status = write_file_if_changed(path, content.strip())
+        except Exception as e:
+            status = f"error: {str(e)}"
+    
+    report_saved(path, status)
+    return path, status
+
+def record_generated(origin, files, statuses):
+    """Add successfully saved files to the manifest; origin is (kind, description) or an id.
+    
+    Returns the origin id, so later files from the same turn can reuse it.
+    """
+    saved = {path: content for path, content in files.items() if not statuses[path].startswith("error")}
+    if not saved:
+        return origin
+    try:
+        manifest = get_manifest()
+        if isinstance(origin, tuple):
+            origin = manifest.add_origin(*origin)
+        manifest.record(origin, saved)
+    except Exception as e:
+        print(f"⚠️ Could not update the file manifest: {str(e)}")
+    return origin
+
+def save_code_blocks(text, target_dir=None, create_structure=False, prompt=None):
+    """Extract and save code blocks with proper file extensions.
+    
+    Args:
+        text: Model response to scan for fenced code blocks
+        target_dir: Save here without asking; if None the user is prompted
+        create_structure: Organize files into folders (only used with target_dir)
+        prompt: Prompt that produced text, recorded in the manifest
+    """
     os.makedirs("generated", exist_ok=True)
     
     # Improved regex to capture language/extension info
@@ -123,87 +386,99 @@ def save_code_blocks(text):
     saved_files = []
     
     if blocks:
-        print("\n📂 Save generated code:")
-        print("   1. Default directory (generated/)")
-        print("   2. Custom directory")
-        target_choice = input("Select option [1]: ").strip()
-        
-        if target_choice == "2":
-            target_dir = input("Enter target directory: ").strip()
-            if not target_dir:
-                target_dir = "generated"
+        if target_dir is None:
+            target_dir, create_structure = ask_save_options()
         else:
-            target_dir = "generated"
+            ensure_dir(target_dir)
         
-        # Ask if we should create project structure
-        print("\n🏗️  Project structure:")
-        print("   y - Organize files in appropriate folders")
-        print("   n - Save all files in the target directory")
-        create_structure = input("Organize files? (y/n) [n]: ").lower().strip()
-        create_structure = create_structure == 'y'
-        
-        ensure_dir(target_dir)
-        
-        for i, (lang, content) in enumerate(blocks):
-            # Map common language names to file extensions
-            extension_map = {
-                "python": "py", "py": "py",
-                "javascript": "js", "js": "js",
-                "jsx": "jsx",
-                "typescript": "ts", "ts": "ts",
-                "tsx": "tsx",
-                "html": "html",
-                "css": "css",
-                "java": "java",
-                "cpp": "cpp", "c++": "cpp",
-                "c": "c",
-                "json": "json",
-                "bash": "sh", "shell": "sh",
-                "": "txt"  # Default to .txt if no language specified
-            }
-            
-            ext = extension_map.get(lang.lower(), "txt")
-            
-            # Try to extract file path from code block content or comments
-            file_path = None
-            
-            if create_structure:
-                # Look for file path indicators in content
-                path_match = re.search(r'(?:\/\/|#|\/\*)\s*(?:file|path):\s*([^\n\r]*)', content)
-                if path_match:
-                    file_path = path_match.group(1).strip()
-                
-                # Check for common file patterns
-                elif lang.lower() in ["js", "javascript"] and "import React" in content and "export default" in content:
-                    file_path = "components/Component" + str(i+1) + ".jsx"
-                elif "package.json" in content and '"dependencies"' in content:
-                    file_path = "package.json"
-                elif lang.lower() in ["html"] and "<html" in content:
-                    file_path = "public/index.html"
-                elif lang.lower() in ["css"] and "{" in content:
-                    file_path = "styles/style.css"
-                elif lang.lower() in ["bash", "sh"] and ("npm" in content or "npx" in content):
-                    file_path = "scripts/setup.sh"
-            
-            if file_path:
-                # Make sure parent directory exists
-                full_path = os.path.join(target_dir, file_path)
-                parent_dir = os.path.dirname(full_path)
-                ensure_dir(parent_dir)
-                path = full_path
-            else:
-                # Default filename if no structure detected
-                filename = f"file_{i+1}.{ext}"
-                path = os.path.join(target_dir, filename)
+        # Timed after asking for save options, so user think time isn't counted
+        with telemetry.span("files.save", files=len(blocks)):
+            # Resolve every path first so the whole response is written as one batch
+            files = {}
+            for i, (lang, content) in enumerate(blocks):
+                path = resolve_block_path(lang, content, i, target_dir, create_structure)
+                files[path] = content.strip()
+                saved_files.append(path)
             
-            with open(path, 'w', encoding='utf-8') as f:
-                f.write(content.strip())
-            
-            saved_files.append(path)
-            print(f"💾 Saved: {path}")
+            results = write_files(files)
+        for path in files:
+            report_saved(path, results[path])
+        record_generated(("llm", prompt or "(unknown prompt)"), files, results)
     
     return saved_files
 
+def iter_code_blocks(chunks):
+    """Yield (lang, content) for each code block as soon as its closing fence arrives.
+    
+    Single-pass counterpart of the regex in save_code_blocks: only the open
+    block and a few bytes of lookahead are buffered, never the whole response.
+    """
+    buffer = ""
+    lang = None  # None while outside a code block
+    parts = []
+    
+    for chunk in chunks:
+        buffer += chunk
+        while True:
+            if lang is None:
+                start = buffer.find("```")
+                if start == -1:
+                    # Keep enough to recognise a fence split across chunks
+                    buffer = buffer[-2:]
+                    break
+                match = FENCE_OPEN_PATTERN.match(buffer, start)
+                if match is None:
+                    if FENCE_PARTIAL_PATTERN.fullmatch(buffer, start + 3):
+                        # Language tag may still be streaming in
+                        buffer = buffer[start:]
+                        break
+                    buffer = buffer[start + 1:]
+                    continue
+                lang = match.group(1)
+                buffer = buffer[match.end():]
+            else:
+                end = buffer.find("```")
+                if end == -1:
+                    if len(buffer) > 2:
+                        parts.append(buffer[:-2])
+                        buffer = buffer[-2:]
+                    break
+                parts.append(buffer[:end])
+                yield lang, "".join(parts)
+                buffer = buffer[end + 3:]
+                lang = None
+                parts = []
+
+def stream_reply(chunks, prompt=None):
+    """Print a streamed reply as it arrives and save code blocks as they complete.
+    
+    Returns:
+        tuple: (full response text for history, list of saved file paths)
+    """
+    parts = []
+    save_options = None
+    saved_files = []
+    origin = ("llm", prompt or "(unknown prompt)")
+    
+    def echo(chunks):
+        for chunk in chunks:
+            console.check_cancelled()
+            print(chunk, end="", flush=True)
+            parts.append(chunk)
+            yield chunk
+    
+    print("\n🤖 > ", end="", flush=True)
+    for i, (lang, content) in enumerate(iter_code_blocks(echo(chunks))):
+        if save_options is None:
+            os.makedirs("generated", exist_ok=True)
+            save_options = ask_save_options()
+        path, status = save_code_block(lang, content, i, *save_options)
+        origin = record_generated(origin, {path: content.strip()}, {path: status})
+        saved_files.append(path)
+    print()
+    
+    return "".join(parts), saved_files
+
 def is_safe_path(path):
     """Check if a file path is safe (no path traversal)."""
     # Normalize the path to prevent path traversal attacks
@@ -240,25 +515,69 @@ def delete_file(path):
     if not is_safe_path(path):
         return f"❌ Security error: Invalid file path: {path}"
     
+    if not os.path.exists(path):
+        return f"❌ File not found: {path}"
+    
+    deleted, errors = delete_files([path])
+    if errors:
+        return f"❌ Error deleting {path}: {errors[path]}"
+    return f"✅ Deleted: {path}"
+
+def restore_file(path):
+    """Put back the contents the agent last wrote to a file, from the manifest's blob store."""
+    if not is_safe_path(path):
+        return f"❌ Security error: Invalid file path: {path}"
+    
     try:
-        if os.path.exists(path):
-            os.remove(path)
-            return f"✅ Deleted: {path}"
-        else:
-            return f"❌ File not found: {path}"
-    except Exception as e:
-        return f"❌ Error deleting {path}: {str(e)}"
+        record, status = get_manifest().restore(path)
+    except OSError as e:
+        return f"❌ Error restoring {path}: {str(e)}"
+    if record is None:
+        return f"❌ {path} was not written by the agent, so there is nothing to restore"
+    if status == "unchanged":
+        return f"✔️  {path} already holds what the agent wrote ({record.written_at})"
+    if status != "restored":
+        return f"❌ Cannot restore {path}: {status}"
+    return f"✅ Restored {path} as written at {record.written_at} ({format_size(record.size)})"
 
-def list_generated_files():
-    """List all files in the generated directory."""
-    if not os.path.exists("generated"):
-        return "No generated files found."
+def list_generated_files(untracked=False, visited=None):
+    """List generated files from the manifest, grouped by the prompt that produced them.
     
-    files = os.listdir("generated")
-    if not files:
+    With untracked, generated/ is also walked for files the manifest doesn't
+    know (written by a shell command or by hand), which are listed after
+    them; visited, if given, collects the directories scanned.
+    """
+    manifest = get_manifest()
+    origins = manifest.origins(under="generated")
+    untracked = manifest.untracked("generated", visited) if untracked else []
+    if not origins and not untracked:
         return "No generated files found."
     
-    return "\n".join([f"{i+1}. {file}" for i, file in enumerate(files)])
+    by_origin = {}
+    for record in manifest.files(under="generated"):
+        by_origin.setdefault(record.origin_id, []).append(record)
+    
+    lines = []
+    number = 0
+    for origin in origins:
+        description = " ".join(origin.description.split())
+        if len(description) > 70:
+            description = description[:67] + "..."
+        lines.append(f"#{origin.id} {origin.created_at} [{origin.kind}] {description}")
+        for record in by_origin.get(origin.id, []):
+            number += 1
+            lines.append(f"  {number}. {record.path} ({format_size(record.size)})")
+    if untracked:
+        lines.append("Not written by the agent:")
+        for path in untracked:
+            number += 1
+            try:
+                size = format_size(os.path.getsize(path))
+            except OSError:
+                size = "?"
+            lines.append(f"  {number}. {path} ({size})")
+    lines.append(f"\nDelete a group with: !deleteall --prompt <#id>")
+    return "\n".join(lines)
 
 def create_custom_file(filename, content):
     """Create a file with custom name and content."""
@@ -271,36 +590,117 @@ def create_custom_file(filename, content):
     
     success = write_file(filename, content)
     if success:
+        record_generated(("create", f"!create {filename}"), {filename: content}, {filename: "written"})
         return f"✅ Created: {filename}"
     else:
         return f"❌ Failed to create: {filename}"
 
-def delete_all_files():
-    """Delete all files in the generated directory."""
+def edit_file(path, instruction):
+    """Change an existing file in place from search/replace hunks written by the model.
+    
+    Only the changed lines are generated, so small edits to large files cost a
+    fraction of the output tokens of a full rewrite. Hunks that can't be
+    matched exactly are matched ignoring whitespace, then by similarity; if
+    they still don't apply, the model is asked for the full file instead,
+    and a full file that lost much of the original is written only once
+    the user confirms. The new content is written atomically, and only once
+    every hunk applies.
+    """
+    if not is_safe_path(path):
+        return f"❌ Security error: Invalid file path: {path}"
+    if not os.path.exists(path) and not os.path.dirname(path):
+        path = os.path.join("generated", path)
+    if not os.path.isfile(path):
+        return f"❌ File not found: {path}"
+    if is_binary(path):
+        return f"❌ {path} looks like a binary file; it can't be edited"
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        original = f.read()
+    
     try:
-        if not os.path.exists("generated"):
-            return "No generated directory found."
-            
-        files = os.listdir("generated")
-        if not files:
-            return "No files to delete."
-            
-        deleted = []
-        for file in files:
-            file_path = os.path.join("generated", file)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-                deleted.append(file)
-                
-        if deleted:
-            return f"✅ Deleted {len(deleted)} files: {', '.join(deleted)}"
+        reply = chat_with_gemini(patching.build_edit_prompt(path, original, instruction))
+        console.check_cancelled()
+        
+        updated, method = None, None
+        hunks = patching.parse_hunks(reply)
+        if hunks:
+            try:
+                updated, kinds = patching.apply_hunks(original, hunks)
+                counts = {kind: kinds.count(kind) for kind in dict.fromkeys(kinds)}
+                method = f"{len(hunks)} hunk(s): " + ", ".join(f"{n} {kind}" for kind, n in counts.items())
+            except patching.PatchError as e:
+                print(f"⚠️ {str(e)}\n↩️  Asking for the full file instead")
         else:
-            return "No files were deleted."
+            # A code block in a hunk reply may be only part of the file; never write it as the whole
+            print("⚠️ No search/replace hunks in the reply\n↩️  Asking for the full file instead")
+        
+        if updated is None:
+            reply = chat_with_gemini(patching.build_full_file_prompt(path, original, instruction))
+            console.check_cancelled()
+            updated = patching.full_file_from_reply(reply)
+            if updated is None:
+                return f"❌ Could not get an edit for {path} from the model"
+            method = "full file fallback"
+            if patching.looks_truncated(original, updated):
+                answer = input(f"⚠️ The rewritten {path} has {len(updated.splitlines())} of "
+                               f"{len(original.splitlines())} lines. Write it anyway? [y/N]: ")
+                if answer.strip().lower() not in ("y", "yes"):
+                    return f"⛔ Edit of {path} not written; the full-file reply looked incomplete"
+    except console.TurnCancelled:
+        raise
+    except Exception as e:
+        return f"❌ Edit failed: {str(e)}"
+    
+    if method.startswith("full file") and original.endswith("\n") and not updated.endswith("\n"):
+        updated += "\n"
+    
+    with telemetry.span("files.save", files=1):
+        try:
+            status = write_file_if_changed(path, updated)
+        except Exception as e:
+            status = f"error: {str(e)}"
+    if status.startswith("error"):
+        return f"❌ Could not save {path}: {status}"
+    record_generated(("edit", f"!edit {path} {instruction}"), {path: updated}, {path: status})
+    save_history(f"!edit {path} {instruction}", reply, [path])
+    
+    if status == "unchanged":
+        return f"✔️  {path} unchanged ({method})"
+    diff, added, removed = patching.summarize_diff(original, updated, path)
+    return (f"{diff}\n\n✏️  Edited {path} with {method}: +{added} -{removed} lines "
+            f"(reply {format_size(len(reply.encode('utf-8')))} for a {format_size(len(original.encode('utf-8')))} file)")
+
+def delete_all_files(origin_id=None, untracked=False):
+    """Delete every generated file, including organized subfolders, or all files from one prompt.
+    
+    With untracked, files in generated/ that the manifest never saw are deleted too.
+    """
+    try:
+        manifest = get_manifest()
+        if origin_id is None:
+            paths = [record.path for record in manifest.files(under="generated")]
+            if untracked:
+                paths += manifest.untracked("generated")
+        else:
+            paths = [record.path for record in manifest.files(origin_id=origin_id)]
+        if not paths:
+            return "No files to delete."
+        
+        deleted, errors = delete_files(paths)
+        message = f"✅ Deleted {len(deleted)} files: {', '.join(deleted)}" if deleted else "No files were deleted."
+        if errors:
+            message += "\n" + "\n".join(f"❌ Could not delete {path}: {error}" for path, error in errors.items())
+        return message
     except Exception as e:
         return f"❌ Error deleting files: {str(e)}"
 
-def initialize_project(project_type, target_dir):
-    """Initialize a project structure based on type."""
+def initialize_project(project_type, target_dir, variables=None):
+    """Initialize a project structure from a registered template."""
+    template = get_template(project_type)
+    if template is None:
+        return f"❌ Unknown project type: {project_type}. Supported types: {', '.join(sorted(get_templates()))}"
+    
     if not target_dir:
         target_dir = "generated/project"
     
@@ -310,106 +710,602 @@ def initialize_project(project_type, target_dir):
         if overwrite != 'y':
             return "❌ Project initialization canceled."
     
-    ensure_dir(target_dir)
-    
     # Print initialization message
-    print(f"\n🚀 Initializing {project_type} project in '{target_dir}'...")
-    
-    if project_type.lower() == "nextjs":
-        # Create basic Next.js structure
-        dirs = [
-            "pages", 
-            "pages/api", 
-            "public", 
-            "styles", 
-            "components"
-        ]
-        files = {
-            "pages/index.js": "export default function Home() {\n  return <div>Hello Next.js</div>;\n}",
-            "pages/_app.js": "import '../styles/globals.css';\n\nexport default function MyApp({ Component, pageProps }) {\n  return <Component {...pageProps} />;\n}",
-            "styles/globals.css": "html, body {\n  padding: 0;\n  margin: 0;\n  font-family: -apple-system, sans-serif;\n}",
-            "package.json": '{\n  "name": "nextjs-app",\n  "version": "0.1.0",\n  "private": true,\n  "scripts": {\n    "dev": "next dev",\n    "build": "next build",\n    "start": "next start"\n  },\n  "dependencies": {\n    "next": "latest",\n    "react": "latest",\n    "react-dom": "latest"\n  }\n}'
-        }
-        
-        # Create directories
-        for dir_path in dirs:
-            full_path = os.path.join(target_dir, dir_path)
-            ensure_dir(full_path)
-            print(f"  📁 Created directory: {dir_path}")
-        
-        # Create files
-        for file_path, content in files.items():
-            full_path = os.path.join(target_dir, file_path)
-            with open(full_path, 'w', encoding='utf-8') as f:
-                f.write(content)
-            print(f"  📄 Created file: {file_path}")
-        
-        return f"✅ Next.js project created successfully in '{target_dir}'.\n\nTo run the project:\n  cd {target_dir}\n  npm install\n  npm run dev"
-    
-    elif project_type.lower() == "react":
-        # Create basic React structure
-        dirs = [
-            "public",
-            "src",
-            "src/components",
-            "src/styles"
-        ]
-        files = {
-            "public/index.html": '<!DOCTYPE html>\n<html lang="en">\n<head>\n  <meta charset="utf-8" />\n  <meta name="viewport" content="width=device-width, initial-scale=1" />\n  <title>React App</title>\n</head>\n<body>\n  <div id="root"></div>\n</body>\n</html>',
-            "src/index.js": 'import React from "react";\nimport ReactDOM from "react-dom";\nimport App from "./App";\n\nReactDOM.render(\n  <React.StrictMode>\n    <App />\n  </React.StrictMode>,\n  document.getElementById("root")\n);',
-            "src/App.js": 'import React from "react";\n\nfunction App() {\n  return (\n    <div className="App">\n      <h1>Hello React</h1>\n    </div>\n  );\n}\n\nexport default App;',
-            "package.json": '{\n  "name": "react-app",\n  "version": "0.1.0",\n  "private": true,\n  "dependencies": {\n    "react": "^18.2.0",\n    "react-dom": "^18.2.0"\n  },\n  "scripts": {\n    "start": "react-scripts start",\n    "build": "react-scripts build"\n  }\n}'
-        }
-        
-        # Create directories
-        for dir_path in dirs:
-            full_path = os.path.join(target_dir, dir_path)
-            ensure_dir(full_path)
-            print(f"  📁 Created directory: {dir_path}")
-        
-        # Create files
-        for file_path, content in files.items():
-            full_path = os.path.join(target_dir, file_path)
-            with open(full_path, 'w', encoding='utf-8') as f:
-                f.write(content)
+    print(f"\n🚀 Initializing {template.name} project in '{target_dir}'...")
+    
+    report = materialize(template, target_dir, variables)
+    
+    for dir_path in report["dirs"]:
+        print(f"  📁 Created directory: {dir_path}")
+    
+    for file_path, status in report["files"].items():
+        if status == "unchanged":
+            print(f"  ✔️  Unchanged: {file_path}")
+        elif status == "written":
             print(f"  📄 Created file: {file_path}")
-        
-        return f"✅ React project created successfully in '{target_dir}'.\n\nTo run the project:\n  cd {target_dir}\n  npm install\n  npm start"
+        else:
+            print(f"  ❌ Could not create {file_path}: {status}")
+    
+    created = [os.path.join(target_dir, path) for path, status in report["files"].items() if not status.startswith("error")]
+    try:
+        manifest = get_manifest()
+        manifest.record_paths(manifest.add_origin("init", f"!init {template.name} {target_dir}"), created)
+    except Exception as e:
+        print(f"⚠️ Could not update the file manifest: {str(e)}")
+    
+    timings = report["timings"]
+    print(f"  ⏱️  {len(report['files'])} files in {timings['total'] * 1000:.1f} ms "
+          f"(manifest {timings['compile'] * 1000:.1f} ms, write {timings['write'] * 1000:.1f} ms)")
+    
+    steps = "\n  ".join([f"cd {target_dir}"] + template.next_steps)
+    return f"✅ {template.title} project created successfully in '{target_dir}'.\n\nTo run the project:\n  {steps}"
+
+def session_command(action):
+    """Turn the multi-turn chat session on or off, reset it, or show its status."""
+    name = current_session_name()
+    chat_session = chat_sessions.get(name)
+    
+    if action == "on":
+        if chat_session is None:
+            chat_session = chat_sessions[name] = ChatSession()
+        return f"✅ Chat session on (token budget {chat_session.token_budget})."
+    elif action == "off":
+        chat_sessions.pop(name, None)
+        return "✅ Chat session off; prompts are sent without history."
+    elif action == "reset":
+        if chat_session is None:
+            return "No active chat session."
+        chat_session.reset()
+        return "✅ Chat session cleared."
+    elif action == "status":
+        if chat_session is None:
+            return "No active chat session. Use: !session on"
+        return json.dumps(chat_session.status(), indent=2)
+    return "❌ Invalid format. Use: !session on|off|reset|status"
+
+def stats_command(action=""):
+    """Show per-stage latency percentiles, reset them, or export them."""
+    if action == "reset":
+        telemetry.reset()
+        return "✅ Stats cleared."
+    elif action == "export":
+        path = telemetry.export()
+        if path is None:
+            return "❌ Set TELEMETRY_EXPORT=prometheus to export a textfile (JSONL spans are written as they happen)."
+        return f"✅ Metrics written to {path}"
+    elif action:
+        return "❌ Invalid format. Use: !stats [reset|export]"
+    
+    output = "📈 Stage latencies:\n" + telemetry.format_stats()
+    counters = resilience.get_stats()
+    breaker = counters.pop("breaker")
+    breakers = counters.pop("breakers")
+    output += "\n\n🛡️ Model calls: " + ", ".join(f"{k}={v}" for k, v in counters.items())
+    output += "\n   Circuit breakers: " + ", ".join(
+        [f"{model} {status['state']}" for model, status in sorted(breakers.items())] or [breaker["state"]])
+    return output
+
+def profile_command(args):
+    """Turn per-turn profiling on or off, or show its settings."""
+    words = args.split()
+    if words[0] == "on" and len(words) <= 2:
+        if len(words) == 2:
+            if words[1] not in ("cprofile", "sample"):
+                return "❌ Unknown profiler. Use: cprofile or sample"
+            profiling.profile_mode = words[1]
+        profiling.enabled = True
+        return f"✅ Profiling on ({profiling.profile_mode}); profiles are saved to {profiling.profile_dir}"
+    elif words == ["off"]:
+        profiling.enabled = False
+        return "✅ Profiling off."
+    elif words == ["status"]:
+        return json.dumps(profiling.status(), indent=2)
+    return "❌ Invalid format. Use: !profile on [cprofile|sample], !profile off or !profile status"
+
+def model_command(args):
+    """Show per-model stats, or change routing, the model override and draft mode."""
+    words = args.split()
+    if not words or words == ["stats"]:
+        mode = "on" if llm.routing_enabled else "off"
+        override = f", override {llm.router.override}" if llm.router.override else ""
+        draft = "on" if llm.draft_mode else "off"
+        return (f"🧭 Routing {mode} (fast {llm.fast_model}, large {llm.large_model}{override}; draft {draft})\n"
+                + llm.router.report())
+    if words[0] == "routing" and words[1:] in (["on"], ["off"]):
+        llm.routing_enabled = words[1] == "on"
+        return f"✅ Model routing {words[1]}."
+    if words[0] == "draft" and words[1:] in (["on"], ["off"]):
+        llm.draft_mode = words[1] == "on"
+        return f"✅ Draft mode {words[1]}" + ("" if llm.routing_enabled or words[1] == "off" else " (takes effect with !model routing on)")
+    if len(words) == 1:
+        if words[0] == "auto":
+            llm.router.override = None
+            return "✅ Model chosen per prompt by the router."
+        model = {"fast": llm.fast_model, "large": llm.large_model}.get(words[0], words[0])
+        llm.router.override = model
+        llm.routing_enabled = True
+        return f"✅ Using {model} for every prompt (!model auto to undo)."
+    return "❌ Invalid format. Use: !model [stats], !model fast|large|auto|<name>, !model routing on|off or !model draft on|off"
+
+def show_draft(text, model):
+    """Print a fast model's draft while the large model is still working on the answer."""
+    print(f"\n📝 Draft from {model} (a larger model is still working on this):\n{text}")
+
+def context_command(action):
+    """Turn workspace context injection on or off, or show/refresh the index."""
+    if action == "on":
+        workspace.context_enabled = True
+        stats = workspace.get_index().update()
+        return f"✅ Workspace context on ({stats['files']} files, {stats['chunks']} chunks indexed)."
+    elif action == "off":
+        workspace.context_enabled = False
+        return "✅ Workspace context off."
+    elif action in ("status", "reindex"):
+        index = workspace.get_index()
+        stats = index.update()
+        index.save()
+        stats["enabled"] = workspace.context_enabled
+        return json.dumps(stats, indent=2)
+    return "❌ Invalid format. Use: !context on|off|status|reindex"
+
+def run_llm_turn(prompt):
+    """Send a prompt to the model, print the reply and save its code blocks.
     
+    Returns:
+        tuple: (reply text, list of saved file paths)
+    """
+    original_prompt = prompt
+    if workspace.context_enabled:
+        try:
+            prompt = workspace.add_context(prompt)
+        except Exception as e:
+            print(f"⚠️ Could not add workspace context: {str(e)}")
+    
+    chat_session = chat_sessions.get(current_session_name())
+    if chat_session is not None:
+        if stream_mode:
+            reply, saved_files = stream_reply(chat_session.stream(prompt), original_prompt)
+        else:
+            reply = chat_session.send(prompt)
+            console.check_cancelled()
+            print(f"\n🤖 > {reply}")
+            saved_files = save_code_blocks(reply, prompt=original_prompt)
+        stats = chat_session.turn_stats[-1]
+        print(f"\n📊 Tokens: {stats['prompt_tokens']} prompt, {stats['response_tokens']} response "
+              f"({chat_session.history_tokens()}/{chat_session.token_budget} in session)")
+    elif stream_mode:
+        reply, saved_files = stream_reply(stream_chat_with_gemini(prompt), original_prompt)
     else:
-        return f"❌ Unknown project type: {project_type}. Supported types: nextjs, react"
+        reply = chat_with_gemini(prompt, on_draft=show_draft)
+        console.check_cancelled()
+        print(f"\n🤖 > {reply}")
+        saved_files = save_code_blocks(reply, prompt=original_prompt)
+    
+    call = llm.last_call()
+    if llm.routing_enabled and call:
+        print(f"\n🧭 {call['model']} ({call['reason']}) · {call['seconds']:.2f}s · ${call['cost']:.6f}")
+    return reply, saved_files
 
-def process_command(command):
-    """Process special commands with or without the ! prefix."""
-    # Check if command is an alias and convert to standard form
-    words = command.split()
+def parse_dir_args(arg_string):
+    """Parse the arguments of !dir into keyword arguments for list_directory."""
+    tokens = shlex.split(arg_string)
+    options = {}
+    paths = []
+    
+    def value(i):
+        if i + 1 >= len(tokens):
+            raise ValueError(f"Missing value for {tokens[i]}")
+        return tokens[i + 1]
+    
+    def number(i):
+        try:
+            n = int(value(i))
+        except ValueError:
+            raise ValueError(f"{tokens[i]} expects a number")
+        if n < 0 or (n == 0 and tokens[i] != "--depth"):
+            raise ValueError(f"{tokens[i]} expects a positive number")
+        return n
+    
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ("-r", "--recursive"):
+            options["depth"] = None
+        elif token == "--depth":
+            options["depth"] = number(i)
+            i += 1
+        elif token == "--glob":
+            options["pattern"] = value(i)
+            i += 1
+        elif token == "--ignore":
+            options.setdefault("ignore", []).append(value(i))
+            i += 1
+        elif token == "--no-gitignore":
+            options["use_gitignore"] = False
+        elif token == "--sort":
+            options["sort"] = value(i)
+            i += 1
+        elif token == "--reverse":
+            options["reverse"] = True
+        elif token == "--page":
+            options["page"] = number(i)
+            i += 1
+        elif token == "--page-size":
+            options["page_size"] = number(i)
+            i += 1
+        elif token.startswith("-") and token != "-":
+            raise ValueError(f"Unknown option: {token}")
+        else:
+            paths.append(token)
+        i += 1
+    
+    options["path"] = " ".join(paths) if paths else "."
+    return options
+
+def parse_read_args(arg_string):
+    """Parse the arguments of !read into (path, keyword arguments for read_range)."""
+    tokens = shlex.split(arg_string)
+    options = {}
+    paths = []
+    
+    def span(i, what):
+        # "A:B", "A:" or ":B"; A and B are non-negative integers
+        if i + 1 >= len(tokens):
+            raise ValueError(f"Missing value for {tokens[i]}")
+        start, sep, end = tokens[i + 1].partition(":")
+        try:
+            first = int(start) if start else None
+            last = int(end) if end else None
+        except ValueError:
+            first = last = -1
+        if not sep or (first is not None and first < 0) or (last is not None and last < 0):
+            raise ValueError(f"{tokens[i]} expects a range like 100:200 ({what})")
+        return first, last
+    
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ("--head", "--tail"):
+            if i + 1 >= len(tokens) or not tokens[i + 1].isdigit():
+                raise ValueError(f"{token} expects a number of lines")
+            options[token[2:]] = int(tokens[i + 1])
+            i += 1
+        elif token == "--lines":
+            first, last = span(i, "1-based, inclusive")
+            options["lines"] = (first or 1, last)
+            i += 1
+        elif token == "--bytes":
+            first, last = span(i, "byte offsets, end exclusive")
+            options["byte_range"] = (first or 0, last)
+            i += 1
+        elif token.startswith("-") and token != "-":
+            raise ValueError(f"Unknown option: {token}")
+        else:
+            paths.append(token)
+        i += 1
+    
+    if len(options) > 1:
+        raise ValueError("Use only one of --head, --tail, --lines and --bytes")
+    if not paths:
+        raise ValueError("Missing file name")
+    return " ".join(paths), options
+
+def read_target(arg_string):
+    """The file !read would show for these arguments, or None if they don't parse."""
+    try:
+        file_to_read, _ = parse_read_args(arg_string)
+    except ValueError:
+        return None
+    if not os.path.dirname(file_to_read):  # If no directory specified
+        file_to_read = os.path.join("generated", file_to_read)
+    return file_to_read
+
+def memoized(command, compute, dirs=(), files=()):
+    """Serve a read-only command from the result cache, or run compute() and cache what it returns.
+    
+    dirs and files are the inputs the result depends on; dirs may be a list
+    that compute() fills in as it goes.
+    """
+    key = (command, os.getcwd())
+    result = command_cache.get(key, command_name(command))
+    if result is None:
+        started = time.time_ns()
+        result = compute()
+        # Errors are cheap to recompute and often fixed by the next command
+        if not result.startswith(("❌", "Error")):
+            command_cache.put(key, result, dirs, files, started)
+    return result
+
+def cache_command(args):
+    """Show response and command result cache statistics, or clear both."""
+    if args == "clear":
+        removed = cache.clear()
+        dropped = command_cache.clear()
+        return f"✅ Cleared {removed} cached responses and {dropped} cached command results."
+    if args:
+        return "❌ Invalid format. Use: !cache [clear]"
+    return json.dumps({"responses": cache.get_stats(), "commands": command_cache.get_stats()}, indent=2)
+
+def read_command(arg_string):
+    """Show a file, or part of it, without loading large files into memory."""
+    try:
+        file_to_read, options = parse_read_args(arg_string)
+    except ValueError as e:
+        return f"❌ {str(e)}. Use: !read <filename> [--head N | --tail N | --lines A:B | --bytes A:B]"
+    
+    if not os.path.dirname(file_to_read):  # If no directory specified
+        file_to_read = os.path.join("generated", file_to_read)
+    if not os.path.isfile(file_to_read):
+        return f"❌ Could not read: {file_to_read}"
+    
+    try:
+        result = read_range(file_to_read, **options)
+    except BinaryFileError as e:
+        return f"🚫 {str(e)}"
+    except OSError as e:
+        return f"❌ Could not read {file_to_read}: {str(e)}"
+    
+    if result.first_line is not None:
+        where = f"lines {result.first_line}-{result.last_line}"
+        if result.total_lines is not None:
+            where += f" of {result.total_lines}"
+    elif options or result.end - result.start < result.size:
+        where = f"bytes {result.start}-{result.end} of {result.size}"
+    else:
+        where = None
+    header = f"📄 Contents of {file_to_read}" + (f" ({where})" if where else "") + ":"
+    
+    notes = []
+    if result.truncated:
+        notes.append(f"✂️ Output cut at {format_size(len(result.text.encode('utf-8')))}; "
+                     f"use --lines or --bytes to page through the rest")
+    elif not options and result.end < result.size:
+        notes.append(f"ℹ️ Showing the start of a {format_size(result.size)} file; "
+                     f"use --head, --tail, --lines or --bytes to see more")
+    footer = "\n\n" + "\n".join(notes) if notes else ""
+    return f"{header}\n\n{result.text}{footer}"
+
+def command_name(prompt):
+    """Return the canonical !command a prompt invokes, or None for an LLM prompt."""
+    words = prompt.split()
+    if not words:
+        return None
     first_word = words[0].lower()
+    if first_word.startswith("!"):
+        return first_word
+    return COMMAND_ALIASES.get(first_word)
+
+def expand_alias(command):
+    """Rewrite a command given without the ! prefix (e.g. "ls src") to its standard form."""
+    first_word = command.split()[0].lower()
+    if first_word in COMMAND_ALIASES:
+        return COMMAND_ALIASES[first_word] + command[len(first_word):]
+    return command
+
+async def arun_shell_command(cmd):
+    """Run a !run command; cancelling the awaiting task stops the whole process group."""
+    if cmd.endswith("&") and not cmd.endswith("&&"):
+        return start_jobs([cmd[:-1].strip()])[1]
+    if not is_safe_command(cmd):
+        return "❌ Security error: This command is not allowed for security reasons."
+    try:
+        # Output is printed live as the command runs; only the summary is returned
+        result = await run_command_async(cmd, on_output=lambda stream, line: print(line, flush=True))
+    except Exception as e:
+        return f"Failed to run command: {str(e)}"
+    return format_command_result(result)
+
+def run_shell_command(cmd):
+    import asyncio
+    
+    return asyncio.run(arun_shell_command(cmd))
+
+def start_jobs(commands):
+    """Start shell commands as background jobs; none start if any is refused.
     
+    Returns:
+        tuple: (started jobs, message to show)
+    """
+    commands = [cmd for cmd in commands if cmd]
+    if not commands:
+        return [], "❌ No command given"
+    for cmd in commands:
+        if not is_safe_command(cmd):
+            return [], f"❌ Security error: This command is not allowed for security reasons: {cmd}"
+    started = [job_manager.start(cmd) for cmd in commands]
+    lines = [f"🚀 Job %{job.id} started: {job.command}" for job in started]
+    lines.append(f"   Output: {os.path.dirname(started[0].spool_path)}/<id>.log · !jobs, !tail <id> -f, !wait, !kill <id>")
+    return started, "\n".join(lines)
+
+def parallel_command(args):
+    """Run commands separated by ;; concurrently and, unless the line ends with &, wait for all of them."""
+    background = args.endswith("&") and not args.endswith("&&")
+    if background:
+        args = args[:-1]
+    commands = [cmd.strip() for cmd in args.split(";;")]
+    if len(commands) < 2 or not all(commands):
+        return "❌ Invalid format. Use: !parallel <command> ;; <command> [;; ...] [&]"
+    group, message = start_jobs(commands)
+    if background or not group:
+        return message
+    
+    print(f"⏳ Running {len(group)} jobs (%{group[0].id}-%{group[-1].id}); Ctrl-C kills them")
+    start = time.monotonic()
+    try:
+        job_manager.wait(group)
+    except console.TurnCancelled:
+        for job in group:
+            job_manager.kill(job)
+        raise
+    
+    sections = []
+    for job in group:
+        section = job_manager.summary(job)
+        if job.state != "done" and job.spooled_bytes():
+            section += "\n" + indent_block(read_range(job.spool_path, tail=10).text)
+        sections.append(section)
+    failed = sum(1 for job in group if job.state != "done")
+    total = f"{'❌' if failed else '✅'} {len(group) - failed}/{len(group)} succeeded in {time.monotonic() - start:.1f}s"
+    return "\n".join(sections) + f"\n{total}"
+
+def indent_block(text, prefix="   │ "):
+    return "\n".join(prefix + line for line in text.rstrip("\n").split("\n"))
+
+def jobs_command():
+    """List background jobs with their state and spooled output size."""
+    if not job_manager.jobs:
+        return "No jobs. Start one with: !run <command> &  or  !parallel <a> ;; <b>"
+    return "\n".join(f"{job.describe()}  [{format_size(job.spooled_bytes())}]" for job in job_manager.jobs.values())
+
+def wait_command(args):
+    """Wait for the given jobs (default: every active one) and show how they finished."""
+    if args:
+        jobs = []
+        for spec in args.split():
+            job = job_manager.find(spec)
+            if isinstance(job, str):
+                return job
+            jobs.append(job)
+    else:
+        jobs = [job for job in job_manager.jobs.values() if job.active]
+        if not jobs:
+            return "No running jobs."
+    job_manager.wait(jobs)
+    return "\n".join(job_manager.summary(job) for job in jobs)
+
+def kill_command(args):
+    """Stop a job (or all of them) along with its whole process group."""
+    if args == "all":
+        killed = [job for job in job_manager.jobs.values() if job_manager.kill(job)]
+        return f"⛔ Killing {len(killed)} job(s)." if killed else "No running jobs."
+    job = job_manager.find(args)
+    if isinstance(job, str):
+        return job
+    if not job_manager.kill(job):
+        return f"Job %{job.id} already {job.state}."
+    return f"⛔ Killing job %{job.id}."
+
+def tail_command(args):
+    """Show the end of a job's output; with -f, keep printing it as it grows until the job ends."""
+    words = args.split()
+    follow = "-f" in words
+    lines = 20
+    if "-n" in words:
+        i = words.index("-n")
+        if i + 1 >= len(words) or not words[i + 1].isdigit():
+            return "❌ -n expects a number of lines"
+        lines = int(words[i + 1])
+        del words[i:i + 2]
+    specs = [word for word in words if word != "-f"]
+    if len(specs) != 1:
+        return "❌ Invalid format. Use: !tail <job id> [-n N] [-f]"
+    job = job_manager.find(specs[0])
+    if isinstance(job, str):
+        return job
+    
+    text, offset = "", 0
+    if os.path.exists(job.spool_path):
+        result = read_range(job.spool_path, tail=lines)
+        text, offset = result.text, result.end
+    if not follow:
+        return f"{job.describe()}\n{text.rstrip() or '(no output yet)'}"
+    print(text, end="", flush=True)
+    return tail_follow(job, offset)
+
+def tail_follow(job, offset):
+    """Print a job's spool from offset as it grows; Ctrl-C stops following, not the job."""
+    while True:
+        finished = not job.active
+        try:
+            with open(job.spool_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        if data:
+            # Only print whole lines, so a multi-byte character is never split
+            end = len(data) if finished else data.rfind(b"\n") + 1
+            print(data[:end].decode("utf-8", errors="replace"), end="", flush=True)
+            offset += end
+        if finished:
+            return job_manager.summary(job)
+        console.check_cancelled()
+        time.sleep(0.2)
+
+def process_command(command):
+    """Process special commands with or without the ! prefix."""
     # Handle commands without ! prefix using aliases
-    if first_word in COMMAND_ALIASES:
-        command = COMMAND_ALIASES[first_word] + command[len(first_word):]
+    command = expand_alias(command)
     
     # History commands
     if command == "!help" or command == "!h" or command == "help":
         return """Available commands:
 📁 File Management:
-  !list (or list) - List all generated files
+  !list (or list) - List generated files, grouped by the prompt that produced them
+  !list --untracked - Also scan generated/ for files the agent didn't write
   !delete <filename> (or delete, rm) - Delete a file
-  !deleteall (or deleteall, clean) - Delete all generated files
-  !read <filename> (or read, cat) - Read a file's contents
+  !restore <filename> (or restore) - Undo changes made to a generated file since the agent wrote it
+  !deleteall (or deleteall, clean) - Delete all generated files, including subfolders
+  !deleteall --untracked - Also delete files in generated/ the agent didn't write
+  !deleteall --prompt <#id> - Delete every file produced by one prompt (ids from !list)
+  !read <filename> [options] (or read, cat) - Read a file's contents
+      --head N | --tail N  First or last N lines
+      --lines A:B          Lines A to B (1-based, either end optional)
+      --bytes A:B          Byte range; binary files are never dumped
   !create <filename>:<content> (or create, write) - Create a custom file
-  !dir [path] (or dir, ls) - List files in a directory
+  !edit <filename> <instructions> - Change a file in place; the model returns only the changed lines
+  !dir [path] [options] (or dir, ls) - List files in a directory
+      -r | --depth N       Include subdirectories (all, or N levels)
+      --glob PAT           Only files matching PAT (e.g. "*.py")
+      --ignore PAT         Skip entries matching PAT (repeatable); .gitignore is honoured unless --no-gitignore
+      --sort name|size|mtime [--reverse]
+      --page N [--page-size N]
 
 🏗️ Project Management:
-  !init <project_type> [target_dir] (or init, new, setup) - Initialize project structure
-  Types: nextjs, react
+  !init <project_type> [target_dir] [name=value ...] (or init, new, setup) - Initialize project structure
+  Types: any template in templates/ or AGENT_TEMPLATE_PATH (built in: nextjs, react)
 
 🔧 System Commands:
   !run <command> (or run, execute) - Run a shell command
+  !run <command> & - Run a shell command as a background job
+  !parallel <cmd> ;; <cmd> [;; ...] [&] (or parallel) - Run commands concurrently, waiting for all unless & is given
+  !jobs (or jobs) - List background jobs
+  !wait [id ...] - Wait for jobs (default: all running) and show how they finished
+  !kill <id>|all - Stop a job and its process group
+  !tail <id> [-n N] [-f] - Show a job's output; -f follows it until the job ends
   !info (or info, system) - Show system information
+  !cache [clear] (or cache) - Show response and command result cache statistics, or clear both caches
 
 📝 History:
   !history [limit] (or history) - Show conversation history
+  !history search <terms> [--since DATE] [--until DATE] [--file PATH] [--llm | --edits] [--best] [--limit N] - Search past turns
+
+📈 Performance:
+  !stats (or stats) - Latency percentiles per stage (LLM, saving, history, commands)
+  !stats reset - Clear the collected stats
+  !stats export - Write the configured Prometheus textfile now
+  !profile on|off|status (or profile) - Profile each command and LLM turn
+  !profile on sample - Use the sampling profiler (collapsed stacks) instead of cProfile
+
+🧭 Models:
+  !model (or model) - Routing status and per-model calls, latency, errors, tokens and cost
+  !model fast|large|<name> - Use one model for every prompt; !model auto goes back to routing
+  !model routing on|off - Route each prompt to the fast or large model
+  !model draft on|off - Show a fast draft while the large model answers hard prompts
+
+🔎 Workspace Context:
+  !context on|off|status|reindex (or context) - Add relevant workspace excerpts to prompts
+
+💬 Chat Session:
+  !session on|off|reset|status (or session) - Multi-turn chat with a token-budgeted context window
+
+⏯️ Tasks:
+  Ctrl-C - Cancel the running request or command (the agent keeps running)
+  !bg <prompt or !command> - Queue it as a background task; its output is kept for later
+  !tasks - List background tasks
+  !collect [id] - Show the output of finished background tasks
+  !cancel <id> - Cancel a background task
+  While a request runs, !dir, !read, !list, !history, !info, !stats, !cache, !jobs and !tail still work
 
 ❓ Help:
   !help (or help, h) - Show this help message
@@ -419,6 +1315,9 @@ def process_command(command):
 
 Type 'exit' to quit the agent"""
     
+    elif command.startswith("!history search ") or command == "!history search":
+        return search_history(command[16:])
+    
     elif command == "!history" or command.startswith("!history "):
         limit_str = command[9:].strip() if command.startswith("!history ") else ""
         try:
@@ -434,25 +1333,48 @@ Type 'exit' to quit the agent"""
             file_to_delete = os.path.join("generated", file_to_delete)
         return delete_file(file_to_delete)
     
+    elif command.startswith("!restore "):
+        file_to_restore = command[9:].strip()
+        if not os.path.dirname(file_to_restore):  # If no directory specified
+            file_to_restore = os.path.join("generated", file_to_restore)
+        return restore_file(file_to_restore)
+    
     elif command == "!deleteall":
         return delete_all_files()
     
+    elif command.startswith("!deleteall "):
+        args = command[11:].split()
+        if args == ["--untracked"]:
+            return delete_all_files(untracked=True)
+        if len(args) != 2 or args[0] != "--prompt" or not args[1].lstrip("#").isdigit():
+            return "❌ Invalid format. Use: !deleteall [--untracked] or !deleteall --prompt <#id from !list>"
+        return delete_all_files(int(args[1].lstrip("#")))
+    
     elif command == "!list":
-        return list_generated_files()
+        return memoized(command, list_generated_files, files=[manifest_db, manifest_db + "-wal"])
+    
+    elif command == "!list --untracked":
+        visited = []
+        return memoized(command, lambda: list_generated_files(True, visited), dirs=visited,
+                        files=[manifest_db, manifest_db + "-wal"])
     
     elif command.startswith("!dir ") or command == "!dir":
-        path = command[5:].strip() if command != "!dir" else "."
-        return list_directory(path)
+        try:
+            options = parse_dir_args(command[5:])
+        except ValueError as e:
+            return f"❌ {str(e)}\nUse: !dir [path] [-r | --depth N] [--glob PAT] [--ignore PAT] [--no-gitignore] [--sort name|size|mtime] [--reverse] [--page N] [--page-size N]"
+        visited = []
+        return memoized(command, lambda: list_directory(**options, visited=visited), dirs=visited)
     
     elif command.startswith("!read "):
-        file_to_read = command[6:].strip()
-        if not os.path.dirname(file_to_read):  # If no directory specified
-            file_to_read = os.path.join("generated", file_to_read)
-        content = read_file(file_to_read)
-        if content is not None:
-            return f"📄 Contents of {file_to_read}:\n\n{content}"
-        else:
-            return f"❌ Could not read: {file_to_read}"
+        target = read_target(command[6:].strip())
+        return memoized(command, lambda: read_command(command[6:].strip()), files=[target] if target else [])
+    
+    elif command.startswith("!edit "):
+        parts = command[6:].strip().split(None, 1)
+        if len(parts) < 2:
+            return "❌ Invalid format. Use: !edit <filename> <instructions>"
+        return edit_file(parts[0], parts[1])
     
     elif command.startswith("!create "):
         # Format: !create filename:content
@@ -465,17 +1387,17 @@ Type 'exit' to quit the agent"""
     elif command.startswith("!init ") or command == "!init":
         if command == "!init":
             # Interactive mode
+            templates = sorted(get_templates().values(), key=lambda t: t.name)
             print("\n🏗️  Initialize new project:")
-            print("   1. Next.js project")
-            print("   2. React project")
-            print("   3. Cancel")
+            for i, template in enumerate(templates):
+                description = f" - {template.description}" if template.description else ""
+                print(f"   {i+1}. {template.title} project{description}")
+            print(f"   {len(templates)+1}. Cancel")
             
-            choice = input("Select project type [3]: ").strip()
+            choice = input(f"Select project type [{len(templates)+1}]: ").strip()
             
-            if choice == "1":
-                project_type = "nextjs"
-            elif choice == "2":
-                project_type = "react"
+            if choice.isdigit() and 1 <= int(choice) <= len(templates):
+                project_type = templates[int(choice) - 1].name
             else:
                 return "Project initialization canceled."
                 
@@ -485,22 +1407,56 @@ Type 'exit' to quit the agent"""
                 
             return initialize_project(project_type, target_dir)
         else:
-            # Command mode: !init project_type [target_dir]
-            parts = command[6:].strip().split(" ", 1)
+            # Command mode: !init project_type [target_dir] [name=value ...]
+            try:
+                parts = shlex.split(command[6:])
+            except ValueError as e:
+                return f"❌ {str(e)}"
             project_type = parts[0]
-            target_dir = parts[1] if len(parts) > 1 else ""
-            return initialize_project(project_type, target_dir)
+            variables = dict(part.split("=", 1) for part in parts[1:] if "=" in part)
+            target_dir = " ".join(part for part in parts[1:] if "=" not in part)
+            return initialize_project(project_type, target_dir, variables)
     
     # System commands
     elif command.startswith("!run "):
-        cmd = command[5:].strip()
-        if not is_safe_command(cmd):
-            return "❌ Security error: This command is not allowed for security reasons."
-        return run_command(cmd)
+        return run_shell_command(command[5:].strip())
+    
+    elif command.startswith("!parallel ") or command == "!parallel":
+        return parallel_command(command[10:].strip())
+    
+    elif command == "!jobs":
+        return jobs_command()
+    
+    elif command == "!wait" or command.startswith("!wait "):
+        return wait_command(command[6:].strip())
+    
+    elif command.startswith("!kill ") or command == "!kill":
+        return kill_command(command[6:].strip())
+    
+    elif command.startswith("!tail ") or command == "!tail":
+        return tail_command(command[6:].strip())
     
     elif command == "!info":
-        info = get_system_info()
-        return json.dumps(info, indent=2)
+        # Nothing in it changes while the agent runs (the path is part of the cache key)
+        return memoized(command, lambda: json.dumps(get_system_info(), indent=2))
+    
+    elif command == "!session" or command.startswith("!session "):
+        return session_command(command[9:].strip() or "status")
+    
+    elif command == "!profile" or command.startswith("!profile "):
+        return profile_command(command[9:].strip() or "status")
+    
+    elif command == "!stats" or command.startswith("!stats "):
+        return stats_command(command[7:].strip())
+    
+    elif command == "!model" or command.startswith("!model "):
+        return model_command(command[7:].strip())
+    
+    elif command == "!context" or command.startswith("!context "):
+        return context_command(command[9:].strip() or "status")
+    
+    elif command == "!cache" or command.startswith("!cache "):
+        return cache_command(command[7:].strip())
     
     return None  # Not a special command
 
@@ -509,7 +1465,7 @@ def check_environment():
     issues = []
     
     # Check for API key
-    if not os.getenv("GOOGLE_API_KEY"):
+    if os.getenv("LLM_BACKEND", "gemini").lower() == "gemini" and not os.getenv("GOOGLE_API_KEY"):
         issues.append("⚠️ GOOGLE_API_KEY not found in environment variables")
     
     # Create necessary directories
@@ -520,7 +1476,58 @@ def check_environment():
     
     return issues
 
-def main():
+def handle_prompt(prompt):
+    """Handle one line of user input: run a command, or an LLM turn saved to history.
+    
+    Shared by the REPL and the daemon. LLM replies are printed as they arrive.
+    
+    Returns:
+        tuple: (command output to show, or None after an LLM turn; saved file paths)
+    """
+    if not prompt.strip():
+        return None, []
+    
+    # Like a shell, mention background jobs that finished since the last prompt
+    for job in job_manager.take_finished():
+        print(f"🔔 {job.describe()}")
+    
+    # Check for special commands; profiling is a single flag check when off
+    if profiling.enabled and command_name(prompt):
+        result = profiling.call(command_name(prompt), process_command, prompt)
+    else:
+        result = process_command(prompt)
+    if result:
+        return result, []
+    
+    # Normal LLM interaction
+    try:
+        if profiling.enabled:
+            reply, saved_files = profiling.call("llm-turn", run_llm_turn, prompt)
+        else:
+            reply, saved_files = run_llm_turn(prompt)
+        
+        # Save to history
+        save_history(prompt, reply, saved_files)
+        return None, saved_files
+    except console.TurnCancelled:
+        raise
+    except Exception as e:
+        error_msg = f"Error communicating with AI: {str(e)}"
+        print(f"\n❌ {error_msg}")
+        save_history(prompt, error_msg, [])
+        return None, []
+
+def main(argv=None):
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Gemini terminal agent")
+    parser.add_argument("--profile", nargs="?", const=profiling.profile_mode, choices=["cprofile", "sample"],
+                        help="Profile every command and LLM turn (default profiler: cprofile)")
+    args = parser.parse_args(argv)
+    if args.profile:
+        profiling.enabled = True
+        profiling.profile_mode = args.profile
+    
     # Display welcome message
     display_welcome()
     
@@ -535,34 +1542,11 @@ def main():
     # Ensure generated directory exists
     ensure_dir("generated")
     
-    # Load conversation history
-    load_history()
+    # Conversation history is opened lazily by the first save_history/show_history
     
-    while True:
-        prompt = input("👤 > ")
-        
-        if prompt.lower() == "exit":
-            print("Goodbye! 👋")
-            break
-        
-        # Check for special commands
-        result = process_command(prompt)
-        if result:
-            print(f"\n🤖 > {result}")
-            continue
-        
-        # Normal LLM interaction
-        try:
-            reply = chat_with_gemini(prompt)
-            print(f"\n🤖 > {reply}")
-            saved_files = save_code_blocks(reply)
-            
-            # Save to history
-            save_history(prompt, reply, saved_files)
-        except Exception as e:
-            error_msg = f"Error communicating with AI: {str(e)}"
-            print(f"\n❌ {error_msg}")
-            save_history(prompt, error_msg, [])
+    import asyncio
+    import repl
+    asyncio.run(repl.run())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,309 @@
+import os
+import time
+import random
+import hashlib
+import threading
+from collections import namedtuple
+
+# Token counts reported by a backend for one request; None when unknown
+Usage = namedtuple("Usage", ["prompt_tokens", "response_tokens"])
+Reply = namedtuple("Reply", ["text", "usage"])
+
+class Backend:
+    """Interface between llm.py and a model provider.
+
+    generate() and chat() make one request each and raise on failure, so
+    llm.py can wrap them with caching, retries and telemetry. stream() must
+    send the request before returning; the returned StreamReply then only
+    yields text already on its way.
+    """
+
+    name = "base"
+    model = ""
+
+    def generate(self, prompt, config):
+        """Return a Reply for a single prompt."""
+        raise NotImplementedError
+
+    def stream(self, prompt, config):
+        """Return a StreamReply yielding the response text in chunks."""
+        raise NotImplementedError
+
+    def chat(self, history, prompt, config, stream=False):
+        """Send prompt after history ([{"role", "parts"}]); Reply or StreamReply."""
+        raise NotImplementedError
+
+    def count_tokens(self, text):
+        raise NotImplementedError
+
+    async def agenerate(self, prompt, config):
+        """Async generate; runs the blocking call in a worker thread unless overridden."""
+        import asyncio
+        return await asyncio.to_thread(self.generate, prompt, config)
+
+    def with_model(self, model):
+        """A backend like this one that talks to another model of the same provider."""
+        import copy
+        other = copy.copy(self)
+        other.model = model
+        return other
+
+class StreamReply:
+    """Iterable of text chunks; usage is filled in once the stream is exhausted."""
+
+    def __init__(self, chunks, usage_fn=None):
+        self._chunks = chunks
+        self._usage_fn = usage_fn
+        self.usage = Usage(None, None)
+
+    def __iter__(self):
+        yield from self._chunks
+        if self._usage_fn:
+            self.usage = self._usage_fn()
+
+def _gemini_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    return Usage(getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None))
+
+def _gemini_chunks(response):
+    for chunk in response:
+        # Chunks without candidates (e.g. safety metadata) carry no text
+        try:
+            text = chunk.text
+        except ValueError:
+            continue
+        if text:
+            yield text
+
+class GeminiBackend(Backend):
+    """google.generativeai, imported and configured on first use."""
+
+    name = "gemini"
+    _genai = None
+
+    def __init__(self, model=None, api_key=None):
+        self.model = model or os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash")
+        self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
+
+    def genai(self):
+        """Import and configure the Gemini SDK on first use.
+
+        Importing google.generativeai dominates agent start-up, and most
+        commands (!dir, !read, !history, ...) never talk to the model.
+        """
+        if GeminiBackend._genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            GeminiBackend._genai = genai
+        return GeminiBackend._genai
+
+    def _model(self):
+        return self.genai().GenerativeModel(self.model)
+
+    def generate(self, prompt, config):
+        response = self._model().generate_content(prompt, generation_config=config)
+        return Reply(response.text, _gemini_usage(response))
+
+    def stream(self, prompt, config):
+        response = self._model().generate_content(prompt, generation_config=config, stream=True)
+        return StreamReply(_gemini_chunks(response), lambda: _gemini_usage(response))
+
+    def chat(self, history, prompt, config, stream=False):
+        # A fresh chat per request, so retried or hedged requests never share state
+        chat = self._model().start_chat(history=history)
+        response = chat.send_message(prompt, generation_config=config, stream=stream)
+        if stream:
+            return StreamReply(_gemini_chunks(response), lambda: _gemini_usage(response))
+        return Reply(response.text, _gemini_usage(response))
+
+    def count_tokens(self, text):
+        return self._model().count_tokens(text).total_tokens
+
+class FakeBackendError(Exception):
+    """Injected failure; `code` is an HTTP status so retry logic treats it like the real thing."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+FAKE_REPLY = (
+    "Here is a deterministic reply to your request ({digest}).\n\n"
+    "```python\n"
+    "def answer_{digest}():\n"
+    "    return {words!r}\n"
+    "```\n"
+)
+
+class FakeBackend(Backend):
+    """Deterministic local stand-in for the model, for offline tests and load tests.
+
+    Latency is the time to first token plus response tokens divided by
+    throughput. Each request draws its latency and any injected error from a
+    generator seeded with (seed, prompt, attempt number), so a run is
+    reproducible and retries of a prompt see fresh outcomes.
+
+    Args:
+        latency: Mean time to first token in seconds
+        distribution: "fixed", "uniform" (0..2x mean), "exponential" or
+            "lognormal" (heavy tail, sigma=1)
+        tokens_per_second: Streaming throughput; 0 means instant
+        error_rate: Fraction of requests failing with a 503
+        rate_limit_rate: Fraction of requests failing with a 429
+        reply: Format string for the reply text ({prompt}, {digest}, {words})
+        seed: Seed for the per-request generators
+        model_latency: {model: mean latency} used by with_model(), so model
+            routing can be exercised offline
+    """
+
+    name = "fake"
+
+    def __init__(self, latency=0.05, distribution="exponential", tokens_per_second=200.0,
+                 error_rate=0.0, rate_limit_rate=0.0, reply=None, seed=0, model="fake-model", model_latency=None):
+        self.latency = latency
+        self.distribution = distribution
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.reply = reply or FAKE_REPLY
+        self.seed = seed
+        self.model = model
+        self.model_latency = model_latency or {}
+        self.requests = 0
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0.05")),
+            distribution=os.getenv("FAKE_LLM_DISTRIBUTION", "exponential"),
+            tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "200")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.getenv("FAKE_LLM_RATE_LIMIT_RATE", "0")),
+            seed=int(os.getenv("FAKE_LLM_SEED", "0")),
+            # e.g. "gemini-1.5-flash=0.3,gemini-1.5-pro=1.5"
+            model_latency={
+                name.strip(): float(value)
+                for name, _, value in (item.partition("=") for item in os.getenv("FAKE_LLM_MODEL_LATENCY", "").split(","))
+                if name.strip() and value
+            }
+        )
+
+    def with_model(self, model):
+        other = super().with_model(model)
+        other.latency = self.model_latency.get(model, self.latency)
+        return other
+
+    def _plan(self, prompt):
+        """Decide latency, failure and reply text for the next request for prompt."""
+        with self._lock:
+            self.requests += 1
+            attempt = self._attempts.get(prompt, 0)
+            self._attempts[prompt] = attempt + 1
+        rng = random.Random(f"{self.seed}:{attempt}:{prompt}")
+
+        if self.distribution == "fixed":
+            first_token = self.latency
+        elif self.distribution == "uniform":
+            first_token = rng.uniform(0, 2 * self.latency)
+        elif self.distribution == "lognormal":
+            # Dividing by e^(sigma^2 / 2) keeps the mean at self.latency
+            first_token = rng.lognormvariate(0, 1) * self.latency / 1.6487
+        else:
+            first_token = rng.expovariate(1 / self.latency) if self.latency else 0.0
+
+        roll = rng.random()
+        error = None
+        if roll < self.error_rate:
+            error = FakeBackendError(503, "Service unavailable (injected)")
+        elif roll < self.error_rate + self.rate_limit_rate:
+            error = FakeBackendError(429, "Resource exhausted (injected)")
+
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        words = " ".join(prompt.split()[:12])
+        text = self.reply.format(prompt=prompt, digest=digest, words=words)
+        return first_token, error, text
+
+    def _chunks(self, text):
+        """Split text into word-sized tokens, keeping whitespace."""
+        tokens = []
+        start = 0
+        for i, ch in enumerate(text):
+            if ch.isspace() and i > start:
+                tokens.append(text[start:i + 1])
+                start = i + 1
+        if start < len(text):
+            tokens.append(text[start:])
+        return tokens
+
+    def _usage(self, prompt, tokens):
+        return Usage(len(prompt.split()), len(tokens))
+
+    def _stream_delay(self, tokens):
+        return len(tokens) / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def generate(self, prompt, config):
+        first_token, error, text = self._plan(prompt)
+        tokens = self._chunks(text)
+        time.sleep(first_token)
+        if error:
+            raise error
+        time.sleep(self._stream_delay(tokens))
+        return Reply(text, self._usage(prompt, tokens))
+
+    def stream(self, prompt, config):
+        first_token, error, text = self._plan(prompt)
+        tokens = self._chunks(text)
+        time.sleep(first_token)
+        if error:
+            raise error
+
+        def chunks():
+            delay = 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+            for token in tokens:
+                if delay:
+                    time.sleep(delay)
+                yield token
+
+        return StreamReply(chunks(), lambda: self._usage(prompt, tokens))
+
+    def chat(self, history, prompt, config, stream=False):
+        if stream:
+            return self.stream(prompt, config)
+        return self.generate(prompt, config)
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+    async def agenerate(self, prompt, config):
+        import asyncio
+
+        first_token, error, text = self._plan(prompt)
+        tokens = self._chunks(text)
+        await asyncio.sleep(first_token)
+        if error:
+            raise error
+        await asyncio.sleep(self._stream_delay(tokens))
+        return Reply(text, self._usage(prompt, tokens))
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "fake": FakeBackend.from_env
+}
+
+_backend = None
+
+def get_backend():
+    """Return the active backend, created from LLM_BACKEND (default: gemini) on first use."""
+    global _backend
+    if _backend is None:
+        name = os.getenv("LLM_BACKEND", "gemini").lower()
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown LLM_BACKEND {name!r}; choose from {', '.join(sorted(BACKENDS))}")
+        _backend = BACKENDS[name]()
+    return _backend
+
+def set_backend(backend):
+    """Replace the active backend, e.g. with a FakeBackend in tests and benchmarks."""
+    global _backend
+    _backend = backend
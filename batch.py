@@ -0,0 +1,147 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from llm import chat_with_gemini
+from agent import save_code_blocks
+
+def read_prompts(stream):
+    """Yield (request_id, prompt) pairs from a JSONL stream.
+
+    Each line needs a "prompt" field, or "title"/"body" fields as used by
+    requests.jsonl. The id comes from "id" or "request_id", falling back to
+    the line number.
+    """
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            print(f"⚠️ Skipping line {line_no}: invalid JSON ({str(e)})", file=sys.stderr)
+            continue
+
+        request_id = str(record.get("id") or record.get("request_id") or f"line-{line_no}")
+        prompt = record.get("prompt")
+        if not prompt:
+            prompt = "\n\n".join(part for part in (record.get("title"), record.get("body")) if part)
+        if not prompt:
+            print(f"⚠️ Skipping line {line_no}: no prompt", file=sys.stderr)
+            continue
+
+        yield request_id, prompt
+
+def load_checkpoint(path):
+    """Return the set of request ids already completed according to the checkpoint file."""
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return {line.strip() for line in f if line.strip()}
+
+def run_one(request_id, prompt, target_dir, organize):
+    """Send one prompt to Gemini and save its code blocks under target_dir/<request_id>."""
+    start = time.monotonic()
+    result = {"id": request_id, "prompt": prompt}
+    try:
+        reply = chat_with_gemini(prompt)
+        output_dir = os.path.join(target_dir, re.sub(r"[^\w.-]", "_", request_id))
+        result["response"] = reply
+        result["files_created"] = save_code_blocks(reply, target_dir=output_dir, create_structure=organize, prompt=prompt)
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+    result["duration"] = round(time.monotonic() - start, 3)
+    return result
+
+def run_batch(prompts, output, concurrency=4, checkpoint=None, target_dir="generated/batch", organize=False):
+    """Run prompts through Gemini with at most `concurrency` requests in flight.
+
+    Results are written to output as JSONL in completion order. Successful ids
+    are appended to the checkpoint file so a rerun skips them.
+
+    Returns:
+        dict: Counts of ok, error and skipped requests
+    """
+    done = load_checkpoint(checkpoint)
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    checkpoint_file = open(checkpoint, 'a', encoding='utf-8') if checkpoint else None
+
+    def emit(futures):
+        for future in futures:
+            result = future.result()
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            counts[result["status"]] += 1
+            if checkpoint_file and result["status"] == "ok":
+                checkpoint_file.write(result["id"] + "\n")
+                checkpoint_file.flush()
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            pending = set()
+            for request_id, prompt in prompts:
+                if request_id in done:
+                    counts["skipped"] += 1
+                    continue
+                # Bound the number of queued prompts so input is streamed, not slurped
+                if len(pending) >= concurrency:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    emit(finished)
+                pending.add(pool.submit(run_one, request_id, prompt, target_dir, organize))
+
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                emit(finished)
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run prompts from a JSONL file through Gemini non-interactively.")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL file of prompts, or - for stdin")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Maximum requests in flight (default: 4)")
+    parser.add_argument("-o", "--output", default="-", help="Write JSONL results here instead of stdout")
+    parser.add_argument("--checkpoint", help="File recording completed ids; reruns skip them")
+    parser.add_argument("--target-dir", default="generated/batch", help="Directory for saved code blocks")
+    parser.add_argument("--organize", action="store_true", help="Organize saved files into folders")
+    args = parser.parse_args(argv)
+
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    source = sys.stdin if args.input == "-" else open(args.input, 'r', encoding='utf-8')
+    output = sys.stdout if args.output == "-" else open(args.output, 'a', encoding='utf-8')
+
+    start = time.monotonic()
+    try:
+        # Keep stdout clean for results; progress messages from saving go to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            counts = run_batch(
+                read_prompts(source),
+                output,
+                concurrency=args.concurrency,
+                checkpoint=args.checkpoint,
+                target_dir=args.target_dir,
+                organize=args.organize
+            )
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+    elapsed = time.monotonic() - start
+    print(f"✅ Batch finished in {elapsed:.1f}s: {counts['ok']} ok, {counts['error']} failed, "
+          f"{counts['skipped']} skipped", file=sys.stderr)
+    return 1 if counts["error"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""Load test of the agent's turn pipeline against the local fake backend.
+
+Each request runs the same pipeline as batch mode (model call through the
+cache and retry layers, then saving code blocks), with --concurrency
+requests in flight from a thread pool or, with --async, one event loop.
+No network access is needed.
+
+Usage:
+    python benchmarks/loadtest.py --requests 500 --concurrency 32
+    python benchmarks/loadtest.py --error-rate 0.1 --repeat 0.5 --cacheable
+    python benchmarks/loadtest.py --async --max-p99 0.5 --min-throughput 100   # fail on regression
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm
+import cache
+import batch
+import backends
+import resilience
+from agent import save_code_blocks
+
+def make_prompts(count, repeat, seed):
+    """count prompts, of which roughly a `repeat` fraction reuse earlier ones."""
+    rng = random.Random(seed)
+    prompts = []
+    for i in range(count):
+        if prompts and rng.random() < repeat:
+            prompts.append(rng.choice(prompts))
+        else:
+            prompts.append(f"Write a helper function number {i} that formats a report")
+    return prompts
+
+def run_threads(prompts, concurrency, target_dir):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def one(item):
+        index, prompt = item
+        start = time.perf_counter()
+        result = batch.run_one(f"req-{index}", prompt, target_dir, False)
+        return result["status"], time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, enumerate(prompts)))
+
+def run_async(prompts, concurrency, target_dir):
+    import asyncio
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(index, prompt):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    reply = await llm.achat_with_gemini(prompt)
+                    output_dir = os.path.join(target_dir, f"req-{index}")
+                    await asyncio.to_thread(save_code_blocks, reply, output_dir)
+                    status = "ok"
+                except Exception:
+                    status = "error"
+                return status, time.perf_counter() - start
+
+        return await asyncio.gather(*(one(i, p) for i, p in enumerate(prompts)))
+
+    return asyncio.run(main())
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive the turn pipeline concurrently against a fake backend.")
+    parser.add_argument("--requests", type=int, default=200, help="Total requests (default: 200)")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="Requests in flight (default: 16)")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use asyncio instead of threads")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean time to first token in seconds")
+    parser.add_argument("--distribution", default="exponential", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--tokens-per-second", type=float, default=500.0, help="Fake token throughput")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of injected 503s")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of injected 429s")
+    parser.add_argument("--repeat", type=float, default=0.0, help="Fraction of prompts that repeat earlier ones")
+    parser.add_argument("--cacheable", action="store_true", help="Use temperature 0 so responses are cached")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--max-p99", type=float, help="Exit 1 if p99 latency (s) exceeds this")
+    parser.add_argument("--min-throughput", type=float, help="Exit 1 if requests/s falls below this")
+    args = parser.parse_args(argv)
+
+    fake = backends.FakeBackend(
+        latency=args.latency,
+        distribution=args.distribution,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed
+    )
+    backends.set_backend(fake)
+    # Backoff scaled to the fake latency so the report reflects retries, not sleeps
+    resilience.backoff_base = args.latency
+    llm.temperature = 0.0 if args.cacheable else 0.7
+    prompts = make_prompts(args.requests, args.repeat, args.seed)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # The manifest, its blobs and the response cache all land in the temporary directory
+        os.chdir(workdir)
+        cache.cache_dir = os.path.join(workdir, "cache")
+        target_dir = os.path.join(workdir, "out")
+        runner = run_async if args.use_async else run_threads
+
+        start = time.perf_counter()
+        # Saving prints one line per file; keep the report readable
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                results = runner(prompts, args.concurrency, target_dir)
+            finally:
+                sys.stdout = stdout
+                os.chdir(cwd)
+        elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for _, latency in results)
+    report = {
+        "mode": "async" if args.use_async else "threads",
+        "requests": len(results),
+        "concurrency": args.concurrency,
+        "errors": sum(1 for status, _ in results if status != "ok"),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 1),
+        "p50_s": round(statistics.median(latencies), 4),
+        "p95_s": round(percentile(latencies, 95), 4),
+        "p99_s": round(percentile(latencies, 99), 4),
+        "backend_requests": fake.requests,
+        "cache": {k: cache.cache_stats[k] for k in ("hits", "misses", "stores")},
+        "resilience": {k: v for k, v in resilience.resilience_stats.items() if k != "calls"}
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for name, value in report.items():
+            print(f"{name:>17}: {value}")
+
+    failed = False
+    if args.max_p99 is not None and report["p99_s"] > args.max_p99:
+        print(f"❌ p99 {report['p99_s']}s exceeds {args.max_p99}s")
+        failed = True
+    if args.min_throughput is not None and report["throughput_rps"] < args.min_throughput:
+        print(f"❌ Throughput {report['throughput_rps']} req/s below {args.min_throughput}")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
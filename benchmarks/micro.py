@@ -0,0 +1,258 @@
+"""Micro-benchmarks for the agent's local hot paths.
+
+Each benchmark builds a synthetic input once (responses with hundreds of
+code blocks, a multi-MB response, a 100k-turn history, a 50k-file tree) in
+a temporary directory, then times repeated calls. Nothing talks to the
+network. Throughput is reported as ops/sec and memory as the tracemalloc
+peak of a single op, measured in a separate untimed run.
+
+Usage:
+    python benchmarks/micro.py                      # run and compare with the baseline
+    python benchmarks/micro.py --save-baseline      # record the current numbers
+    python benchmarks/micro.py -k history -k dir    # only benchmarks matching these names
+    python benchmarks/micro.py --quick              # smaller inputs, for a fast smoke run
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from collections import namedtuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baselines", "micro.json")
+
+# setup(workdir, scale) returns the callable to time; scale is 1.0, or smaller with --quick
+Benchmark = namedtuple("Benchmark", ["name", "setup", "description"])
+
+def code_response(blocks, block_lines):
+    """A model reply with `blocks` fenced Python blocks of `block_lines` lines each."""
+    parts = ["Here is the implementation you asked for.\n"]
+    for b in range(blocks):
+        body = "".join(f"    value_{i} = compute({b}, {i})  # step {i}\n" for i in range(block_lines))
+        parts.append(f"\nBlock {b} explains one part.\n\n```python\ndef part_{b}():\n{body}    return value_0\n```\n")
+    return "".join(parts)
+
+def setup_save_many_blocks(workdir, scale):
+    import agent
+
+    text = code_response(int(300 * scale) or 1, 20)
+    counter = iter(range(10 ** 9))
+    # A fresh directory per op, so every op really writes its files
+    return lambda: agent.save_code_blocks(text, os.path.join(workdir, "many", str(next(counter))), prompt="bench")
+
+def setup_save_large_response(workdir, scale):
+    import agent
+
+    text = code_response(8, int(12000 * scale) or 1)   # ~4 MB
+    counter = iter(range(10 ** 9))
+    return lambda: agent.save_code_blocks(text, os.path.join(workdir, "large", str(next(counter))), prompt="bench")
+
+def setup_stream_code_blocks(workdir, scale):
+    import agent
+
+    text = code_response(int(300 * scale) or 1, 20)
+    chunks = [text[i:i + 64] for i in range(0, len(text), 64)]
+    return lambda: sum(1 for _ in agent.iter_code_blocks(chunks))
+
+def setup_process_command(workdir, scale):
+    import agent
+    import memo
+
+    # The working directory is workdir, so "ls small -r" lists a fixed 20-file directory
+    commands = ["!help", "help", "explain how the cache works", "!cache", "!session status", "ls small -r"] * 5
+    os.makedirs(os.path.join(workdir, "small"), exist_ok=True)
+    for i in range(20):
+        open(os.path.join(workdir, "small", f"f{i}.txt"), 'w').close()
+
+    def op():
+        # Time the commands themselves, not lookups in the result cache
+        enabled, memo.memo_enabled = memo.memo_enabled, False
+        try:
+            return [agent.process_command(command) for command in commands]
+        finally:
+            memo.memo_enabled = enabled
+    return op
+
+def setup_show_history(workdir, scale):
+    import agent
+    from history import HistoryStore
+
+    store = HistoryStore(os.path.join(workdir, "history"))
+    for i in range(int(100000 * scale) or 1):
+        store.append({
+            "timestamp": "2024-01-01 12:00:00",
+            "prompt": f"Prompt number {i} asking for a small change",
+            "response": f"Response {i} " + "text " * 40,
+            "files_created": [f"generated/file_{i % 7}.py"]
+        })
+    store.sync()
+    agent.history_store = store
+    agent.conversation_history.clear()
+    agent.conversation_history.extend(agent.compact_entry(r) for r in store.tail(agent.history_window))
+    # Within the in-memory window, then past it (read from the log)
+    return lambda: (agent.show_history(10), agent.show_history(agent.history_window + 400))
+
+def setup_list_directory(workdir, scale):
+    from executor import list_directory
+
+    tree = os.path.join(workdir, "tree")
+    files = int(50000 * scale) or 1
+    per_dir = 500
+    for d in range((files + per_dir - 1) // per_dir):
+        directory = os.path.join(tree, f"pkg_{d // 10}", f"mod_{d}")
+        os.makedirs(directory, exist_ok=True)
+        for f in range(min(per_dir, files - d * per_dir)):
+            open(os.path.join(directory, f"file_{f}.py"), 'w').close()
+    with open(os.path.join(tree, ".gitignore"), 'w') as f:
+        f.write("*.pyc\nbuild/\n")
+    return lambda: (list_directory(tree, depth=None, page=1),
+                    list_directory(tree, depth=None, pattern="file_1*.py", sort="name"))
+
+def setup_is_safe_path(workdir, scale):
+    import agent
+
+    paths = []
+    for i in range(int(10000 * scale) or 1):
+        paths.extend([f"generated/src/module_{i}.py", f"../outside_{i}.txt", f"generated/../../etc/{i}",
+                      f"~/file_{i}", os.path.join(workdir, f"abs_{i}.py")])
+    return lambda: sum(1 for path in paths if agent.is_safe_path(path))
+
+def setup_initialize_project(workdir, scale):
+    import agent
+
+    counter = iter(range(10 ** 9))
+    return lambda: agent.initialize_project("react", os.path.join(workdir, "projects", str(next(counter))))
+
+BENCHMARKS = [
+    Benchmark("save_code_blocks_300_blocks", setup_save_many_blocks, "Save a reply with 300 code blocks"),
+    Benchmark("save_code_blocks_4mb", setup_save_large_response, "Save a ~4 MB reply with 8 large blocks"),
+    Benchmark("iter_code_blocks_stream", setup_stream_code_blocks, "Split a streamed 300-block reply in 64-byte chunks"),
+    Benchmark("process_command_mix", setup_process_command, "Dispatch 30 mixed commands and prompts"),
+    Benchmark("show_history_100k", setup_show_history, "Show recent turns of a 100k-turn history"),
+    Benchmark("list_directory_50k", setup_list_directory, "Recursive listing of a 50k-file tree, plain and filtered"),
+    Benchmark("is_safe_path_50k", setup_is_safe_path, "Check 50k safe and unsafe paths"),
+    Benchmark("initialize_project_react", setup_initialize_project, "Materialize the react template"),
+]
+
+def run_benchmark(benchmark, workdir, scale, min_time, max_ops):
+    """Time repeated ops for at least min_time seconds, then measure one op's memory peak."""
+    op = benchmark.setup(workdir, scale)
+    op()  # Warm-up: imports, caches, first-touch page faults
+
+    durations = []
+    deadline = time.perf_counter() + min_time
+    while len(durations) < max_ops and (len(durations) < 3 or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        op()
+        durations.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    op()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    durations.sort()
+    median = durations[len(durations) // 2]
+    return {
+        "ops_per_sec": round(1 / median, 3) if median else None,
+        "median_ms": round(median * 1000, 3),
+        "runs": len(durations),
+        "peak_bytes": peak
+    }
+
+def compare(results, baseline, max_regression, max_memory_regression):
+    """Regression messages for benchmarks slower or hungrier than the baseline allows."""
+    failures = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base.get("ops_per_sec") and result["ops_per_sec"] < base["ops_per_sec"] / (1 + max_regression):
+            failures.append(f"{name}: {result['ops_per_sec']:.1f} ops/s vs baseline {base['ops_per_sec']:.1f}")
+        if base.get("peak_bytes") and result["peak_bytes"] > base["peak_bytes"] * (1 + max_memory_regression):
+            failures.append(f"{name}: peak {result['peak_bytes'] / 1e6:.1f} MB vs baseline {base['peak_bytes'] / 1e6:.1f} MB")
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the agent's local hot paths.")
+    parser.add_argument("-k", dest="filters", action="append", default=[], help="Only run benchmarks whose name contains this")
+    parser.add_argument("--quick", action="store_true", help="Use inputs 10x smaller")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds to repeat each benchmark (default: 1)")
+    parser.add_argument("--max-ops", type=int, default=1000, help="Cap on timed ops per benchmark")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write results as the new baseline")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="Fail if ops/sec drops by more than this fraction (default: 0.25)")
+    parser.add_argument("--max-memory-regression", type=float, default=0.5,
+                        help="Fail if a memory peak grows by more than this fraction (default: 0.5)")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    selected = [b for b in BENCHMARKS if not args.filters or any(f in b.name for f in args.filters)]
+    if not selected:
+        print(f"No benchmark matches {args.filters}; choose from: {', '.join(b.name for b in BENCHMARKS)}")
+        return 2
+    if args.quick and args.save_baseline:
+        print("❌ --quick numbers come from 10x smaller inputs and would fail every full run; save a baseline without it.")
+        return 2
+    scale = 0.1 if args.quick else 1.0
+
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # Manifest, caches and generated/ land in the temporary directory
+        os.chdir(workdir)
+        try:
+            for benchmark in selected:
+                # The code under test prints progress; keep the report readable
+                with open(os.devnull, 'w') as devnull:
+                    stdout, sys.stdout = sys.stdout, devnull
+                    try:
+                        results[benchmark.name] = run_benchmark(benchmark, workdir, scale, args.min_time, args.max_ops)
+                    finally:
+                        sys.stdout = stdout
+                if not args.json:
+                    r = results[benchmark.name]
+                    print(f"{benchmark.name:<28} {r['ops_per_sec']:>10.1f} ops/s {r['median_ms']:>10.2f} ms "
+                          f"{r['peak_bytes'] / 1e6:>8.1f} MB peak  ({r['runs']} runs)")
+        finally:
+            os.chdir(cwd)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        # Keep entries for benchmarks not run this time
+        baseline.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"✅ Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --save-baseline to create one.")
+        return 0
+    if scale != 1.0:
+        print("Quick run; not compared with the baseline.")
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    failures = compare(results, baseline, args.max_regression, args.max_memory_regression)
+    for failure in failures:
+        print(f"❌ Regressed: {failure}")
+    if not failures:
+        print("✅ No regressions")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
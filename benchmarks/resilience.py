@@ -0,0 +1,73 @@
+"""Tail-latency benchmark for resilience.py against a fake backend.
+
+backends.FakeBackend draws latencies from a heavy-tailed (lognormal)
+distribution and fails with a retryable 503 at a given rate, so retries,
+timeouts, hedging and the circuit breaker can be exercised without network
+access.
+
+Usage:
+    python benchmarks/resilience.py                       # compare plain, retry and hedge
+    python benchmarks/resilience.py --error-rate 0.2 --distribution exponential
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resilience
+from backends import FakeBackend
+
+def run(name, backend, calls, **options):
+    """Make `calls` resilient calls and return latency percentiles and error counts."""
+    circuit = resilience.CircuitBreaker(threshold=calls + 1)  # Keep it closed; we measure latency
+    latencies = []
+    errors = 0
+    for _ in range(calls):
+        start = time.perf_counter()
+        try:
+            resilience.call_with_resilience(lambda: backend.generate("benchmark", None), circuit=circuit, **options)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "mode": name,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": errors,
+        "requests": backend.requests
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure tail latency with retries and hedging.")
+    parser.add_argument("--calls", type=int, default=300, help="Calls per mode (default: 300)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mean latency in seconds")
+    parser.add_argument("--distribution", default="lognormal", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--error-rate", type=float, default=0.05, help="Fraction of 503 errors")
+    parser.add_argument("--timeout", type=float, default=1.0, help="Per-attempt deadline in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    # Backoff is scaled down so the numbers reflect the fake backend, not sleeps
+    resilience.backoff_base = args.latency
+    resilience.hedge_min_samples = 20
+
+    def backend():
+        return FakeBackend(latency=args.latency, distribution=args.distribution, tokens_per_second=0,
+                           error_rate=args.error_rate, seed=args.seed)
+
+    results = [
+        run("plain", backend(), args.calls, timeout=0, retries=0, hedge=False),
+        run("retry", backend(), args.calls, timeout=args.timeout, hedge=False),
+        run("retry+hedge", backend(), args.calls, timeout=args.timeout, hedge=True),
+    ]
+    print(f"{'mode':<12} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'requests':>9}")
+    for r in results:
+        print(f"{r['mode']:<12} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['errors']:>7} {r['requests']:>9}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""Start-up benchmark: import time of the agent and time until the first prompt.
+
+Usage:
+    python benchmarks/startup.py                  # measure and compare with the baseline
+    python benchmarks/startup.py --save-baseline  # record the current numbers as the baseline
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baselines", "startup.json")
+PROMPT_MARKER = "👤 > ".encode("utf-8")
+
+def _child_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["PYTHONIOENCODING"] = "utf-8"
+    return env
+
+def time_import(workdir):
+    """Seconds to import the agent module, net of bare interpreter start-up."""
+    def run(code):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=workdir, env=_child_env(), check=True)
+        return time.perf_counter() - start
+    return run("import agent") - run("pass")
+
+def time_first_prompt(workdir):
+    """Seconds from launching agent.py until the first input prompt is printed."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "agent.py")],
+        cwd=workdir,
+        env=_child_env(),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    seen = b""
+    while PROMPT_MARKER not in seen:
+        byte = proc.stdout.read(1)
+        if not byte:
+            raise RuntimeError("agent exited before showing a prompt")
+        seen = seen[-64:] + byte
+    elapsed = time.perf_counter() - start
+    proc.communicate(b"exit\n", timeout=10)
+    return elapsed
+
+def measure(runs):
+    """Return the median of each start-up metric over `runs` launches."""
+    with tempfile.TemporaryDirectory() as workdir:
+        imports = [time_import(workdir) for _ in range(runs)]
+        prompts = [time_first_prompt(workdir) for _ in range(runs)]
+    return {
+        "import_agent_s": round(statistics.median(imports), 4),
+        "first_prompt_s": round(statistics.median(prompts), 4),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure agent start-up time.")
+    parser.add_argument("--runs", type=int, default=5, help="Launches per metric (default: 5)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write results as the new baseline")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="Fail if a metric is this fraction slower than the baseline (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    results = measure(args.runs)
+    for name, value in results.items():
+        print(f"{name}: {value * 1000:.1f} ms")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --save-baseline to create one.")
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    failed = False
+    for name, value in results.items():
+        if name not in baseline:
+            continue
+        limit = baseline[name] * (1 + args.max_regression)
+        if value > limit:
+            print(f"❌ {name} regressed: {value * 1000:.1f} ms > {limit * 1000:.1f} ms allowed")
+            failed = True
+    if not failed:
+        print("✅ No start-up regressions")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
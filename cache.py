@@ -0,0 +1,151 @@
+import os
+import threading
+import json
+import time
+import hashlib
+
+# Cache configuration
+cache_dir = os.getenv("GEMINI_CACHE_DIR", os.path.join(".agent", "cache", "responses"))
+cache_enabled = os.getenv("GEMINI_CACHE", "true").lower() == "true"
+cache_nondeterministic = os.getenv("GEMINI_CACHE_NONDETERMINISTIC", "false").lower() == "true"
+max_cache_bytes = int(os.getenv("GEMINI_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+cache_ttl = int(os.getenv("GEMINI_CACHE_TTL", str(7 * 24 * 3600)))  # Seconds
+
+# Counters for the current process
+cache_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "bypassed": 0}
+
+# Running total of bytes on disk, computed on first store
+_total_bytes = None
+
+def make_key(prompt, model, config):
+    """Return the content address for a prompt, model and generation config."""
+    payload = json.dumps(
+        {"prompt": prompt, "model": model, "config": config},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def is_cacheable(config):
+    """Deterministic (temperature 0) configs are always cacheable, others only on opt-in."""
+    if not cache_enabled:
+        return False
+    return config.get("temperature", 1.0) == 0 or cache_nondeterministic
+
+def _entry_path(key):
+    return os.path.join(cache_dir, key[:2], key + ".json")
+
+def get(key):
+    """Return the cached response text for key, or None on a miss."""
+    path = _entry_path(key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        cache_stats["misses"] += 1
+        return None
+
+    if cache_ttl and time.time() - entry.get("created", 0) > cache_ttl:
+        _remove(path)
+        cache_stats["misses"] += 1
+        return None
+
+    # Bump mtime so eviction treats this entry as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    cache_stats["hits"] += 1
+    return entry["response"]
+
+def put(key, response, model):
+    """Store a response under key, evicting old entries if over the size limit."""
+    global _total_bytes
+
+    path = _entry_path(key)
+    data = json.dumps({"created": time.time(), "model": model, "response": response})
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"❌ Error writing response cache: {str(e)}")
+        return
+
+    cache_stats["stores"] += 1
+    if _total_bytes is None:
+        _total_bytes = sum(size for _, size, _ in _scan())
+    else:
+        _total_bytes += len(data.encode("utf-8"))
+
+    if _total_bytes > max_cache_bytes:
+        evict()
+
+def _scan():
+    """Yield (path, size, mtime) for every cache entry."""
+    if not os.path.isdir(cache_dir):
+        return
+    for bucket in os.scandir(cache_dir):
+        if not bucket.is_dir():
+            continue
+        for entry in os.scandir(bucket.path):
+            if entry.name.endswith(".json"):
+                st = entry.stat()
+                yield entry.path, st.st_size, st.st_mtime
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+def evict():
+    """Drop expired entries, then least recently used ones until under the size limit."""
+    global _total_bytes
+
+    now = time.time()
+    entries = []
+    for path, size, mtime in _scan():
+        if cache_ttl and now - mtime > cache_ttl and _remove(path):
+            cache_stats["evictions"] += 1
+        else:
+            entries.append((mtime, size, path))
+
+    total = sum(size for _, size, _ in entries)
+    # Evict down to 90% so we don't rescan on every subsequent store
+    target = max_cache_bytes * 0.9
+    for mtime, size, path in sorted(entries):
+        if total <= target:
+            break
+        if _remove(path):
+            total -= size
+            cache_stats["evictions"] += 1
+
+    _total_bytes = total
+
+def clear():
+    """Remove every cached response and return how many were deleted."""
+    global _total_bytes
+
+    removed = 0
+    for path, _, _ in list(_scan()):
+        if _remove(path):
+            removed += 1
+    _total_bytes = 0
+    return removed
+
+def get_stats():
+    """Return hit/miss counters plus on-disk usage."""
+    entries = list(_scan())
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    stats = dict(cache_stats)
+    stats["hit_rate"] = round(cache_stats["hits"] / lookups, 3) if lookups else 0.0
+    stats["entries"] = len(entries)
+    stats["bytes"] = sum(size for _, size, _ in entries)
+    stats["max_bytes"] = max_cache_bytes
+    stats["enabled"] = cache_enabled
+    return stats
@@ -0,0 +1,110 @@
+"""Thin client for the agent daemon (see daemon.py).
+
+Imports nothing but the standard library basics, so a command starts in a
+few milliseconds instead of paying for the agent and SDK imports each time.
+
+Usage:
+    python client.py "!dir src"                  # run one command or prompt
+    python client.py                             # interactive, like agent.py
+    python client.py --session work "explain x"  # use a named chat session
+    python client.py --tcp 127.0.0.1:8765 "!info"
+    python client.py --shutdown
+"""
+import os
+import sys
+import json
+import socket
+import argparse
+
+socket_path = os.getenv("AGENT_SOCKET", os.path.join(".agent", "agent.sock"))
+token_file = os.getenv("AGENT_DAEMON_TOKEN_FILE", os.path.join(".agent", "daemon.token"))
+
+class DaemonClient:
+    def __init__(self, path=None, tcp=None):
+        if tcp:
+            host, _, port = tcp.rpartition(":")
+            self.sock = socket.create_connection((host or "127.0.0.1", int(port)))
+            with open(token_file) as f:
+                self.token = f.read().strip()
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path or socket_path)
+            self.token = None
+        self.rfile = self.sock.makefile('rb')
+
+    def send(self, **message):
+        if self.token:
+            message["token"] = self.token
+        self.sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+    def request(self, op, text=None, session=None):
+        """Send a request, print its output as it streams in and return the final event."""
+        self.send(op=op, text=text, session=session)
+        for line in self.rfile:
+            event = json.loads(line)
+            if event["type"] == "output":
+                sys.stdout.write(event["text"])
+                sys.stdout.flush()
+            elif event["type"] == "input":
+                try:
+                    answer = input(event["prompt"])
+                except EOFError:
+                    answer = ""
+                self.sock.sendall((json.dumps({"type": "input", "text": answer}) + "\n").encode("utf-8"))
+            else:
+                return event
+        return {"type": "error", "message": "Daemon closed the connection"}
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+def show(event):
+    if event["type"] == "error":
+        print(f"\n❌ {event['message']}")
+        return False
+    if event.get("text"):
+        print(f"\n🤖 > {event['text']}")
+    return True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send commands and prompts to a running agent daemon.")
+    parser.add_argument("text", nargs="*", help="Command or prompt; interactive if omitted")
+    parser.add_argument("--session", default=os.getenv("AGENT_SESSION"),
+                        help="Chat session name (default: one per terminal)")
+    parser.add_argument("--socket", help=f"Unix socket path (default: {socket_path})")
+    parser.add_argument("--tcp", metavar="HOST:PORT", help="Connect over localhost TCP")
+    parser.add_argument("--shutdown", action="store_true", help="Stop the daemon")
+    args = parser.parse_args(argv)
+    # Commands from the same shell share a session; other terminals don't wait on it
+    session = args.session or f"tty-{os.getppid()}"
+
+    try:
+        client = DaemonClient(args.socket, args.tcp)
+    except OSError as e:
+        print(f"❌ Cannot reach the agent daemon ({e}). Start it with: python daemon.py")
+        return 2
+
+    try:
+        if args.shutdown:
+            return 0 if show(client.request("shutdown")) else 1
+        if args.text:
+            return 0 if show(client.request("run", " ".join(args.text), session)) else 1
+
+        while True:
+            try:
+                prompt = input("👤 > ")
+            except EOFError:
+                break
+            if prompt.lower() == "exit":
+                print("Goodbye! 👋")
+                break
+            show(client.request("run", prompt, session))
+        return 0
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Per-task terminal routing and cooperative cancellation.
+
+The async REPL and the daemon run commands and LLM turns in worker threads,
+several at a time. install() replaces sys.stdout and input() with versions
+that look up the current task's sink in a ContextVar, so each task's output
+and questions go to its own terminal, client or capture buffer. A sink has
+write(text) and input(prompt).
+
+Blocking model calls can't be interrupted from outside, so a cancelled task
+is stopped at the next check_cancelled() checkpoint instead, and its sink
+stops printing right away.
+"""
+import sys
+import builtins
+import threading
+import contextvars
+from contextlib import contextmanager
+
+_sink = contextvars.ContextVar("console_sink", default=None)
+_cancel = contextvars.ContextVar("console_cancel", default=None)
+real_stdout = sys.stdout
+real_input = builtins.input
+
+class TurnCancelled(Exception):
+    """Raised at a checkpoint once the task running it has been cancelled."""
+
+class RoutedStdout:
+    """sys.stdout replacement writing to the current task's sink, if it has one."""
+
+    def write(self, text):
+        sink = _sink.get()
+        if sink is None:
+            return real_stdout.write(text)
+        if text:
+            sink.write(text)
+        return len(text)
+
+    def flush(self):
+        sink = _sink.get()
+        if sink is None:
+            real_stdout.flush()
+        elif hasattr(sink, "flush"):
+            sink.flush()
+
+    def isatty(self):
+        return _sink.get() is None and real_stdout.isatty()
+
+    def __getattr__(self, name):
+        return getattr(real_stdout, name)
+
+def routed_input(prompt=""):
+    """input() answered by the current task's sink."""
+    sink = _sink.get()
+    if sink is None:
+        return real_input(prompt)
+    return sink.input(prompt)
+
+def install():
+    sys.stdout = RoutedStdout()
+    builtins.input = routed_input
+
+def uninstall():
+    sys.stdout = real_stdout
+    builtins.input = real_input
+
+@contextmanager
+def routed(sink, cancel_event=None):
+    """Send output and input() of the code in this block (and threads started with in_thread) to sink."""
+    sink_token = _sink.set(sink)
+    cancel_token = _cancel.set(cancel_event)
+    try:
+        yield
+    finally:
+        _sink.reset(sink_token)
+        _cancel.reset(cancel_token)
+
+def cancelled():
+    event = _cancel.get()
+    return event is not None and event.is_set()
+
+def check_cancelled():
+    """Checkpoint for long-running work: raise TurnCancelled if the task was cancelled."""
+    if cancelled():
+        raise TurnCancelled("Cancelled")
+
+async def in_thread(fn, *args):
+    """Run fn(*args) in a daemon thread with the caller's context and await its result.
+
+    Unlike asyncio.to_thread, an abandoned call (e.g. a cancelled model
+    request still waiting on the network) never holds up interpreter exit.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    context = contextvars.copy_context()
+
+    def settle(result, error):
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def target():
+        try:
+            result, error = context.run(fn, *args), None
+        except BaseException as e:
+            result, error = None, e
+        try:
+            loop.call_soon_threadsafe(settle, result, error)
+        except RuntimeError:
+            pass  # The loop is gone; nobody is waiting any more
+
+    threading.Thread(target=target, daemon=True).start()
+    return await future
@@ -0,0 +1,228 @@
+"""Long-running agent daemon serving clients over a local socket.
+
+The daemon imports the agent once and keeps the backend client, response
+cache, history log, line indexes and workspace index warm in memory. Each
+client connection is served on its own thread by the same handle_prompt()
+pipeline as the REPL.
+
+Protocol: newline-delimited JSON in both directions.
+
+    request  {"op": "run", "text": "!dir", "session": "work", "token": "..."}
+             {"op": "ping"} | {"op": "shutdown"}
+    events   {"type": "output", "text": "..."}      printed output, as it happens
+             {"type": "input", "prompt": "..."}     the command asks a question;
+                                                    reply {"type": "input", "text": "..."}
+             {"type": "result", "text": ..., "files": [...]}
+             {"type": "error", "message": "..."}
+
+Usage:
+    python daemon.py                         # Unix socket at .agent/agent.sock
+    python daemon.py --tcp 127.0.0.1:8765    # localhost TCP, token in .agent/daemon.token
+"""
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import secrets
+import argparse
+import threading
+import socketserver
+import console
+
+# Daemon configuration
+socket_path = os.getenv("AGENT_SOCKET", os.path.join(".agent", "agent.sock"))
+token_file = os.getenv("AGENT_DAEMON_TOKEN_FILE", os.path.join(".agent", "daemon.token"))
+
+class Connection:
+    """One client, and the console sink for the commands it runs: JSON events out, replies to input prompts in."""
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self._lock = threading.Lock()
+
+    def send(self, **event):
+        data = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def receive(self):
+        line = self.rfile.readline()
+        if not line:
+            raise EOFError("Client disconnected")
+        return json.loads(line)
+
+    def write(self, text):
+        try:
+            self.send(type="output", text=text)
+        except OSError:
+            pass  # The client went away; the turn still finishes and is saved
+
+    def input(self, prompt=""):
+        self.send(type="input", prompt=prompt)
+        reply = self.receive()
+        if reply.get("type") != "input":
+            raise EOFError("Expected an input reply")
+        return reply.get("text", "")
+
+_session_locks = {}
+_session_locks_guard = threading.Lock()
+
+def session_lock(name):
+    """Turns in one session run one at a time; different sessions run concurrently."""
+    with _session_locks_guard:
+        return _session_locks.setdefault(name, threading.Lock())
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        connection = Connection(self.rfile, self.wfile)
+        while True:
+            try:
+                request = connection.receive()
+            except EOFError:
+                return
+            except ValueError:
+                connection.send(type="error", message="Invalid JSON request")
+                return
+
+            if self.server.token and not secrets.compare_digest(str(request.get("token", "")), self.server.token):
+                connection.send(type="error", message="Invalid token")
+                return
+
+            op = request.get("op", "run")
+            if op == "ping":
+                connection.send(type="result", text="pong", files=[])
+            elif op == "shutdown":
+                connection.send(type="result", text="👋 Daemon shutting down", files=[])
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+            elif op == "run":
+                try:
+                    self.run(connection, str(request.get("text", "")), str(request.get("session") or "default"))
+                except (EOFError, OSError):
+                    return  # Lost the client mid-command
+            else:
+                connection.send(type="error", message=f"Unknown op {op!r}")
+
+    def run(self, connection, text, session):
+        import agent
+        from repl import TASK_COMMANDS
+
+        name = agent.command_name(text)
+        if name in TASK_COMMANDS:
+            # Background tasks live in the REPL's event loop; sent on, the model would get "!bg ..." as a prompt
+            connection.send(type="error", message=f"{name} is only available in the interactive REPL; "
+                                                  "use !run ... & for background jobs")
+            return
+        agent.session_context.name = session
+        try:
+            with session_lock(session), console.routed(connection):
+                result, files = agent.handle_prompt(text)
+            connection.send(type="result", text=result, files=files)
+        except (EOFError, OSError):
+            raise
+        except Exception as e:
+            connection.send(type="error", message=str(e))
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    token = None
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    token = None
+
+def _remove_stale_socket(path):
+    """Remove a socket left by a daemon that died; refuse if one is still listening."""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+    else:
+        raise RuntimeError(f"A daemon is already listening on {path}")
+    finally:
+        probe.close()
+
+def _write_token(path):
+    token = secrets.token_hex(16)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    return token
+
+def warm_up():
+    """Do the expensive one-time work up front instead of on the first request."""
+    import agent
+    import backends
+    import workspace
+
+    backend = backends.get_backend()
+    if isinstance(backend, backends.GeminiBackend):
+        backend.genai()
+    agent.ensure_dir("generated")
+    agent.load_history()
+    if workspace.context_enabled:
+        workspace.get_index()
+
+def make_server(tcp=None, path=None):
+    """Bind the Unix socket (mode 0600) or, with tcp="host:port", a token-protected TCP port."""
+    if tcp:
+        host, _, port = tcp.rpartition(":")
+        server = TCPServer((host or "127.0.0.1", int(port)), Handler)
+        server.token = _write_token(token_file)
+        return server
+
+    path = path or socket_path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    _remove_stale_socket(path)
+    old_umask = os.umask(0o177)
+    try:
+        server = UnixServer(path, Handler)
+    finally:
+        os.umask(old_umask)
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the agent to clients over a local socket.")
+    parser.add_argument("--socket", help=f"Unix socket path (default: {socket_path})")
+    parser.add_argument("--tcp", metavar="HOST:PORT", help="Listen on localhost TCP instead, with a token")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    warm_up()
+    try:
+        server = make_server(args.tcp, args.socket)
+    except (OSError, RuntimeError) as e:
+        print(f"❌ {e}")
+        return 1
+
+    console.install()
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+
+    address = f"{server.server_address[0]}:{server.server_address[1]} (token in {token_file})" if args.tcp else server.server_address
+    print(f"✅ Agent daemon ready in {time.perf_counter() - start:.2f}s, listening on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        console.uninstall()
+        if not args.tcp:
+            try:
+                os.remove(server.server_address)
+            except OSError:
+                pass
+    print("Goodbye! 👋")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
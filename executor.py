@@ -1,34 +1,225 @@
 import subprocess
 import os
+import time
+import signal
+import re
+import codecs
+import fnmatch
 import platform
+import itertools
+from collections import namedtuple
+import telemetry
+
+# Limits applied to every command unless overridden
+command_timeout = float(os.getenv("COMMAND_TIMEOUT", "300"))                      # Seconds, 0 disables
+max_output_bytes = int(os.getenv("COMMAND_MAX_OUTPUT", str(1024 * 1024)))         # Bytes kept across stdout+stderr
+kill_grace_period = 2.0   # Seconds between SIGTERM and SIGKILL
+READ_CHUNK = 64 * 1024
+
+CommandResult = namedtuple("CommandResult", [
+    "command",
+    "exit_code",
+    "stdout",
+    "stderr",
+    "duration",
+    "timed_out",
+    "output_limited",
+    "truncated_stdout",   # Bytes read but dropped once the output cap was hit
+    "truncated_stderr",
+])
+
+def _signal_group(proc, sig):
+    """Send sig to the command's whole process group (or just the process on Windows)."""
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, sig)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+async def _terminate(proc):
+    """Stop the process group politely, then forcefully after a grace period."""
+    import asyncio
+    
+    if proc.returncode is not None:
+        return
+    _signal_group(proc, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), kill_grace_period)
+    except asyncio.TimeoutError:
+        _signal_group(proc, getattr(signal, "SIGKILL", signal.SIGTERM))
+
+async def run_command_async(command, timeout=None, output_limit=None, on_output=None, keep_output=True):
+    """Run a shell command, streaming its output and enforcing time and size limits.
+
+    Args:
+        command: The command to execute
+        timeout: Wall-clock limit in seconds (defaults to COMMAND_TIMEOUT, 0 disables)
+        output_limit: Maximum bytes of stdout+stderr to keep (defaults to COMMAND_MAX_OUTPUT)
+        on_output: Optional callback(stream_name, line) called for each line as it arrives
+        keep_output: Keep the output in the result; with False only on_output sees it,
+            so a long-running command's output never piles up in memory
+
+    Returns:
+        CommandResult describing how the command finished
+    """
+    # asyncio costs ~40ms to import, so only pay for it when a command actually runs
+    import asyncio
+    
+    timeout = command_timeout if timeout is None else timeout
+    output_limit = max_output_bytes if output_limit is None else output_limit
+
+    if os.name == "posix":
+        group_kwargs = {"start_new_session": True}
+    else:
+        group_kwargs = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+
+    start = time.monotonic()
+    spawn = asyncio.ensure_future(asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        **group_kwargs
+    ))
+    try:
+        proc = await asyncio.shield(spawn)
+    except asyncio.CancelledError:
+        # Cancelled mid-spawn: the process may start anyway, so stop it once it has
+        try:
+            await _terminate(await spawn)
+        except Exception:
+            pass
+        raise
+
+    captured = {"stdout": [], "stderr": []}
+    truncated = {"stdout": 0, "stderr": 0}
+    kept = 0
+    limit_hit = asyncio.Event()
+
+    async def pump(stream, name):
+        nonlocal kept
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        partial = ""
+        while True:
+            data = await stream.read(READ_CHUNK)
+            if not data:
+                break
+
+            # Keep reading past the cap (so the pipe never blocks) but drop the bytes
+            room = max(output_limit - kept, 0)
+            if len(data) > room:
+                truncated[name] += len(data) - room
+                data = data[:room]
+                limit_hit.set()
+            if not data:
+                continue
+            kept += len(data)
+            if keep_output:
+                captured[name].append(data)
+
+            if on_output:
+                lines = (partial + decoder.decode(data)).split("\n")
+                partial = lines.pop()
+                for line in lines:
+                    on_output(name, line)
+                # Don't let a single newline-free line grow without bound
+                if len(partial) > READ_CHUNK:
+                    on_output(name, partial)
+                    partial = ""
+
+        if on_output:
+            partial += decoder.decode(b"", final=True)
+            if partial:
+                on_output(name, partial)
+
+    pumps = asyncio.ensure_future(asyncio.gather(pump(proc.stdout, "stdout"), pump(proc.stderr, "stderr")))
+    limit_waiter = asyncio.ensure_future(limit_hit.wait())
+    timed_out = False
+
+    try:
+        done, _ = await asyncio.wait(
+            {pumps, limit_waiter},
+            timeout=timeout or None,
+            return_when=asyncio.FIRST_COMPLETED
+        )
+        if pumps not in done:
+            timed_out = not limit_hit.is_set()
+            await _terminate(proc)
+            # Grandchildren that escaped the group may still hold the pipes open
+            try:
+                await asyncio.wait_for(asyncio.shield(pumps), kill_grace_period)
+            except asyncio.TimeoutError:
+                pumps.cancel()
+        exit_code = await proc.wait()
+    except asyncio.CancelledError:
+        await _terminate(proc)
+        pumps.cancel()
+        raise
+    finally:
+        limit_waiter.cancel()
+
+    duration = time.monotonic() - start
+    telemetry.observe(
+        "command.run", duration,
+        output_bytes=kept, failed=int(exit_code != 0), timed_out=int(timed_out)
+    )
+    return CommandResult(
+        command=command,
+        exit_code=exit_code,
+        stdout=b"".join(captured["stdout"]).decode("utf-8", errors="replace"),
+        stderr=b"".join(captured["stderr"]).decode("utf-8", errors="replace"),
+        duration=duration,
+        timed_out=timed_out,
+        output_limited=limit_hit.is_set(),
+        truncated_stdout=truncated["stdout"],
+        truncated_stderr=truncated["stderr"]
+    )
+
+def execute_command(command, timeout=None, output_limit=None, on_output=None):
+    """Synchronous wrapper around run_command_async returning a CommandResult."""
+    import asyncio
+    
+    return asyncio.run(run_command_async(command, timeout, output_limit, on_output))
+
+def format_command_result(result):
+    """Summarize how a command finished (exit code, duration and any limits hit)."""
+    if result.timed_out:
+        status = f"⏱️ Timed out after {result.duration:.1f}s (process group killed)"
+    elif result.output_limited:
+        status = f"✂️ Output limit reached after {result.duration:.1f}s (process group killed)"
+    elif result.exit_code == 0:
+        status = f"✅ Exit code 0 in {result.duration:.1f}s"
+    else:
+        status = f"❌ Exit code {result.exit_code} in {result.duration:.1f}s"
+
+    dropped = result.truncated_stdout + result.truncated_stderr
+    if dropped:
+        status += f"\n   {dropped} bytes of output dropped (stdout: {result.truncated_stdout}, stderr: {result.truncated_stderr})"
+    return status
 
 def run_command(command, capture_output=True):
     """Run a shell command and return the output.
-    
+
     Args:
         command: The command to execute
         capture_output: Whether to capture and return output
-    
+
     Returns:
         Command output or status message
     """
     try:
         if capture_output:
-            result = subprocess.run(
-                command, 
-                shell=True, 
-                check=True,
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE, 
-                text=True
-            )
+            result = execute_command(command)
+            if result.timed_out or result.output_limited:
+                return f"{result.stdout}\n{format_command_result(result)}"
+            if result.exit_code != 0:
+                return f"Error (exit code {result.exit_code}):\n{result.stderr}"
             return result.stdout
         else:
             # Just run without capturing (for interactive commands)
             subprocess.run(command, shell=True, check=False)
             return "Command executed."
-    except subprocess.CalledProcessError as e:
-        return f"Error (exit code {e.returncode}):\n{e.stderr}"
     except Exception as e:
         return f"Failed to run command: {str(e)}"
 
@@ -43,23 +234,174 @@ def get_system_info():
         "path": os.getcwd()
     }
 
-def list_directory(path="."):
-    """List files in the specified directory."""
+# One row of a directory listing; size is None for directories
+DirectoryEntry = namedtuple("DirectoryEntry", ["path", "is_dir", "size", "mtime", "depth"])
+
+def format_size(size):
+    """Format a byte count for display."""
+    size_str = f"{size} B"
+    if size > 1024:
+        size_str = f"{size / 1024:.1f} KB"
+    if size > 1024 * 1024:
+        size_str = f"{size / (1024 * 1024):.1f} MB"
+    return size_str
+
+def _read_gitignore(directory, base):
+    """Parse directory/.gitignore into rules relative to base ('' or 'sub/dir/')."""
+    rules = []
     try:
-        files = os.listdir(path)
+        with open(os.path.join(directory, ".gitignore"), 'r', encoding='utf-8', errors='replace') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return rules
+
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        # A slash anywhere but the end anchors the pattern to the .gitignore's directory
+        anchored = "/" in line
+        line = line.lstrip("/")
+        if line.startswith("**/"):
+            line, anchored = line[3:], "/" in line[3:]
+        if line:
+            rules.append((base, re.compile(fnmatch.translate(line)), negate, dir_only, anchored))
+    return rules
+
+def _is_gitignored(rel_path, name, is_dir, rules):
+    """Apply gitignore rules in order; the last matching rule wins."""
+    ignored = False
+    for base, regex, negate, dir_only, anchored in rules:
+        if dir_only and not is_dir:
+            continue
+        if anchored:
+            if not rel_path.startswith(base) or not regex.match(rel_path[len(base):]):
+                continue
+        elif not regex.match(name):
+            continue
+        ignored = not negate
+    return ignored
+
+def iter_directory(path=".", depth=0, pattern=None, ignore=None, use_gitignore=True, visited=None):
+    """Yield DirectoryEntry rows for path, walking subdirectories up to depth levels.
+
+    Built on os.scandir so each entry costs at most one stat (cached on the
+    DirEntry). Entries are yielded as they are found, directories before their
+    contents, so callers can show the first page without walking the tree.
+
+    Args:
+        path: Directory to list
+        depth: How many levels of subdirectories to descend into (None for no limit)
+        pattern: Only list files whose name or relative path matches this glob
+        ignore: Glob patterns for names or relative paths to skip entirely
+        use_gitignore: Skip entries matched by .gitignore files in the tree
+        visited: Optional list that each directory is appended to as it is scanned
+    """
+    ignore = [re.compile(fnmatch.translate(p)) for p in (ignore or [])]
+    rules = _read_gitignore(path, "") if use_gitignore else []
+    yield from _walk(path, "", 0, depth, pattern, ignore, use_gitignore, rules, visited)
+
+def _walk(dir_path, rel_dir, level, depth, pattern, ignore, use_gitignore, rules, visited):
+    if visited is not None:
+        visited.append(dir_path)
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            name = entry.name
+            rel_path = rel_dir + name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if is_dir and name == ".git":
+                continue
+            if any(regex.match(name) or regex.match(rel_path) for regex in ignore):
+                continue
+            if rules and _is_gitignored(rel_path, name, is_dir, rules):
+                continue
+
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+
+            if is_dir:
+                if pattern is None:
+                    yield DirectoryEntry(rel_path + "/", True, None, st.st_mtime, level)
+                # Don't follow directory symlinks; they can loop
+                if (depth is None or level < depth) and not entry.is_symlink():
+                    sub_rules = rules
+                    if use_gitignore:
+                        sub_rules = rules + _read_gitignore(entry.path, rel_path + "/")
+                    try:
+                        yield from _walk(entry.path, rel_path + "/", level + 1, depth,
+                                         pattern, ignore, use_gitignore, sub_rules, visited)
+                    except OSError:
+                        pass
+            elif pattern is None or fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern):
+                yield DirectoryEntry(rel_path, False, st.st_size, st.st_mtime, level)
+
+def list_directory(path=".", depth=0, pattern=None, ignore=None, use_gitignore=True,
+                   sort=None, reverse=False, page=1, page_size=200, visited=None):
+    """List files in the specified directory.
+
+    Args:
+        path: Directory to list
+        depth: Levels of subdirectories to include (None for no limit)
+        pattern: Glob that file names must match
+        ignore: Glob patterns to skip
+        use_gitignore: Honour .gitignore files
+        sort: None (directory order), "name", "size" or "mtime"
+        reverse: Reverse the sort order
+        page: 1-based page number
+        page_size: Entries per page
+        visited: Optional list that each directory scanned is appended to
+
+    Returns:
+        One page of the listing as text
+    """
+    try:
+        entries = iter_directory(path, depth, pattern, ignore, use_gitignore, visited)
+        if sort:
+            keys = {
+                "name": lambda e: e.path.lower(),
+                "size": lambda e: e.size or 0,
+                "mtime": lambda e: e.mtime,
+            }
+            if sort not in keys:
+                return f"Error listing directory: unknown sort key '{sort}' (use name, size or mtime)"
+            # Sorting needs every entry; unsorted listings stream straight from the walk
+            entries = iter(sorted(entries, key=keys[sort], reverse=reverse))
+
+        start = (page - 1) * page_size
+        # Fetch one extra entry to know whether another page exists
+        rows = list(itertools.islice(entries, start, start + page_size + 1))
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        # Recursive, unsorted, unfiltered listings read best as an indented tree
+        tree = depth != 0 and not sort and pattern is None
         result = []
-        for file in files:
-            full_path = os.path.join(path, file)
-            if os.path.isdir(full_path):
-                result.append(f"📁 {file}/")
+        for entry in rows:
+            name = entry.path.rstrip("/")
+            indent = ""
+            if tree:
+                name = name.rsplit("/", 1)[-1]
+                indent = "  " * entry.depth
+            if entry.is_dir:
+                result.append(f"{indent}📁 {name}/")
             else:
-                size = os.path.getsize(full_path)
-                size_str = f"{size} B"
-                if size > 1024:
-                    size_str = f"{size / 1024:.1f} KB"
-                if size > 1024 * 1024:
-                    size_str = f"{size / (1024 * 1024):.1f} MB"
-                result.append(f"📄 {file} ({size_str})")
+                result.append(f"{indent}📄 {name} ({format_size(entry.size)})")
+
+        if not result:
+            return "No entries found." if page == 1 else f"No entries on page {page}."
+        if has_more or page > 1:
+            more = f"; next: --page {page + 1}" if has_more else ""
+            result.append(f"\n-- Page {page}, entries {start + 1}-{start + len(rows)}{more} --")
         return "\n".join(result)
     except Exception as e:
         return f"Error listing directory: {str(e)}"
@@ -0,0 +1,339 @@
+import os
+import json
+import gzip
+import time
+import shutil
+import struct
+import threading
+from collections import namedtuple
+
+# History store configuration
+history_dir = os.getenv("HISTORY_DIR", os.path.join(".agent", "history"))
+segment_max_bytes = int(os.getenv("HISTORY_SEGMENT_BYTES", str(4 * 1024 * 1024)))
+compress_segments = os.getenv("HISTORY_COMPRESS", "true").lower() == "true"
+fsync_every = int(os.getenv("HISTORY_FSYNC_EVERY", "8"))            # Records per fsync
+fsync_interval = float(os.getenv("HISTORY_FSYNC_INTERVAL", "2.0"))  # Seconds between fsyncs
+
+# One fixed-width index record per turn: segment number, byte offset, record length
+INDEX_RECORD = struct.Struct("<IQI")
+INDEX_FILE = "history.idx"
+SEGMENT_PREFIX = "segment-"
+SEARCH_DB = "search.sqlite3"
+
+SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,        -- Turn number, i.e. position in the log's offset index
+    timestamp TEXT NOT NULL,
+    kind TEXT NOT NULL,            -- llm or command
+    files TEXT NOT NULL            -- Created files, one per line
+);
+CREATE INDEX IF NOT EXISTS turns_timestamp ON turns(timestamp);
+CREATE VIRTUAL TABLE IF NOT EXISTS turn_text USING fts5(prompt, response, files, content='');
+"""
+
+# Compact in-memory form of a turn; the full response lives only on disk
+HistoryEntry = namedtuple("HistoryEntry", ["timestamp", "prompt", "response", "files_created"])
+
+def compact_entry(record, max_response=500):
+    """Build a HistoryEntry from a stored record, truncating the response for display."""
+    response = record.get("response", "")
+    if len(response) > max_response:
+        response = response[:max_response] + "..."
+    return HistoryEntry(
+        record.get("timestamp", ""),
+        record.get("prompt", ""),
+        response,
+        tuple(record.get("files_created") or ())
+    )
+
+class HistoryStore:
+    """Append-only conversation log split into JSONL segments with an offset index.
+
+    Each turn is appended as one JSON line to the active segment and a
+    fixed-width record pointing at it is appended to the index, so reading the
+    last N turns costs N seeks regardless of how long the history is. Full
+    segments are rolled over and optionally gzip-compressed.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or history_dir
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._index_path = os.path.join(self.directory, INDEX_FILE)
+        self._index = open(self._index_path, 'ab+')
+        self._repair_index()
+
+        self._segment_no = self._last_segment_number()
+        self._segment = open(self._segment_path(self._segment_no, compressed=False), 'ab')
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        # The daemon saves turns from one thread per client
+        self._lock = threading.Lock()
+
+    def _repair_index(self):
+        """Drop a partially written trailing index record left by a crash."""
+        size = os.path.getsize(self._index_path)
+        if size % INDEX_RECORD.size:
+            self._index.truncate(size - size % INDEX_RECORD.size)
+
+    def _last_segment_number(self):
+        numbers = [
+            int(name[len(SEGMENT_PREFIX):].split(".")[0])
+            for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX)
+        ]
+        if not numbers:
+            return 1
+        last = max(numbers)
+        # A compressed segment is closed; never append to it
+        if not os.path.exists(self._segment_path(last, compressed=False)):
+            last += 1
+        return last
+
+    def _segment_path(self, number, compressed=None):
+        base = os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}.jsonl")
+        if compressed is None:
+            compressed = not os.path.exists(base) and os.path.exists(base + ".gz")
+        return base + ".gz" if compressed else base
+
+    def __len__(self):
+        return os.path.getsize(self._index_path) // INDEX_RECORD.size
+
+    def append(self, record):
+        """Append one turn to the log and return its turn number. Durability is batched, see sync()."""
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            number = len(self)
+            self._append(line)
+        return number
+
+    def _append(self, line):
+        if self._segment.tell() and self._segment.tell() + len(line) > segment_max_bytes:
+            self._roll_over()
+
+        offset = self._segment.tell()
+        self._segment.write(line)
+        self._segment.flush()
+        # Write the index record only after its data, so the index never points past the log
+        self._index.write(INDEX_RECORD.pack(self._segment_no, offset, len(line)))
+        self._index.flush()
+
+        self._pending += 1
+        if self._pending >= fsync_every or time.monotonic() - self._last_sync >= fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """Flush buffered records to stable storage."""
+        if not self._pending:
+            return
+        os.fsync(self._segment.fileno())
+        os.fsync(self._index.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _roll_over(self):
+        os.fsync(self._segment.fileno())
+        self._segment.close()
+
+        if compress_segments:
+            path = self._segment_path(self._segment_no, compressed=False)
+            with open(path, 'rb') as src, gzip.open(path + ".gz", 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+
+        self._segment_no += 1
+        self._segment = open(self._segment_path(self._segment_no, compressed=False), 'ab')
+
+    def _read_index(self, start, count):
+        with open(self._index_path, 'rb') as f:
+            f.seek(start * INDEX_RECORD.size)
+            data = f.read(count * INDEX_RECORD.size)
+        return [INDEX_RECORD.unpack_from(data, i) for i in range(0, len(data), INDEX_RECORD.size)]
+
+    def _read_records(self, locations):
+        """Read records for (segment, offset, length) locations, opening each segment once."""
+        records = []
+        handles = {}
+        try:
+            for segment_no, offset, length in locations:
+                f = handles.get(segment_no)
+                if f is None:
+                    path = self._segment_path(segment_no)
+                    f = gzip.open(path, 'rb') if path.endswith(".gz") else open(path, 'rb')
+                    handles[segment_no] = f
+                f.seek(offset)
+                records.append(json.loads(f.read(length)))
+        finally:
+            for f in handles.values():
+                f.close()
+        return records
+
+    def tail(self, limit):
+        """Return the last limit records (all of them if limit is 0), oldest first."""
+        total = len(self)
+        start = max(0, total - limit) if limit else 0
+        return self._read_records(self._read_index(start, total - start))
+
+    def read(self, numbers):
+        """Return the records with the given turn numbers, in that order."""
+        locations = []
+        with open(self._index_path, 'rb') as f:
+            for number in numbers:
+                f.seek(number * INDEX_RECORD.size)
+                locations.append(INDEX_RECORD.unpack(f.read(INDEX_RECORD.size)))
+        return self._read_records(locations)
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        """Iterate over the records from turn number start on, oldest first, one segment at a time."""
+        segment_no = None
+        batch = []
+        for location in self._read_index(start, max(0, len(self) - start)):
+            if batch and location[0] != segment_no:
+                yield from self._read_records(batch)
+                batch = []
+            segment_no = location[0]
+            batch.append(location)
+        if batch:
+            yield from self._read_records(batch)
+
+    def close(self):
+        with self._lock:
+            self.sync()
+            self._segment.close()
+        self._index.close()
+
+def turn_kind(prompt):
+    """"command" for turns started by a !command (only !edit saves one), "llm" for prompts."""
+    return "command" if prompt.lstrip().startswith("!") else "llm"
+
+def _match_query(terms):
+    """FTS5 query matching all terms; each is quoted, so only a trailing * keeps its meaning."""
+    parts = []
+    for term in terms:
+        prefix = term.endswith("*")
+        term = term.rstrip("*").replace('"', '""')
+        if term:
+            parts.append(f'"{term}"*' if prefix else f'"{term}"')
+    return " ".join(parts)
+
+class SearchIndex:
+    """SQLite FTS5 index over a HistoryStore, kept next to its segments.
+
+    Only the searchable text and filter columns are indexed; the full-text
+    table is contentless and hits are read back from the log by turn number,
+    so neither indexing nor searching loads the history into memory. The
+    index follows the log incrementally: add() indexes each new turn, and
+    opening it indexes any turns it is missing (older logs, a crash between
+    the two writes).
+    """
+
+    def __init__(self, store, path=None):
+        import sqlite3
+
+        self.store = store
+        self.path = path or os.path.join(store.directory, SEARCH_DB)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SEARCH_SCHEMA)
+        self._lock = threading.Lock()
+        self.next_turn = self._db.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM turns").fetchone()[0]
+        self.catch_up()
+
+    def _rows(self, number, record):
+        prompt = record.get("prompt", "")
+        files = "\n".join(record.get("files_created") or ())
+        return ((number, record.get("timestamp", ""), turn_kind(prompt), files),
+                (number, prompt, record.get("response", ""), files))
+
+    def add(self, number, record):
+        """Index one turn saved to the log as turn number; already indexed turns are skipped."""
+        turn, text = self._rows(number, record)
+        self._insert([turn], [text])
+
+    def catch_up(self, batch_size=1000):
+        """Index turns in the log that the index hasn't seen. Returns how many were added."""
+        added = 0
+        turns, texts = [], []
+        for number, record in enumerate(self.store.iter_from(self.next_turn), self.next_turn):
+            turn, text = self._rows(number, record)
+            turns.append(turn)
+            texts.append(text)
+            if len(turns) >= batch_size:
+                added += self._insert(turns, texts)
+                turns, texts = [], []
+        if turns:
+            added += self._insert(turns, texts)
+        return added
+
+    def _insert(self, turns, texts):
+        added = 0
+        with self._lock, self._db:
+            for turn, text in zip(turns, texts):
+                # Daemon sessions may save turns out of order; index each one exactly once
+                if self._db.execute("INSERT OR IGNORE INTO turns VALUES (?, ?, ?, ?)", turn).rowcount:
+                    self._db.execute("INSERT INTO turn_text (rowid, prompt, response, files) VALUES (?, ?, ?, ?)", text)
+                    added += 1
+            self.next_turn = max(self.next_turn, max(turn[0] for turn in turns) + 1)
+        return added
+
+    def search(self, terms=(), since=None, until=None, file=None, kind=None, limit=10, best=False):
+        """Turn numbers matching every term and filter, newest first, or best match first with best.
+
+        Newest first lets FTS5 stop after limit hits; ranking has to score
+        every match, which for a common term takes longer.
+
+        since and until are dates or timestamps ("2024-05-01", "2024-05-01 12:00"),
+        both inclusive; file matches part of any created file's path; kind is
+        "llm" or "command".
+        """
+        clauses, params = [], []
+        if since:
+            clauses.append("t.timestamp >= ?")
+            params.append(since)
+        if until:
+            # Inclusive: "2024-05-31" covers every timestamp on that day
+            clauses.append("t.timestamp <= ?")
+            params.append(until + "\uffff")
+        if file:
+            clauses.append("t.files LIKE ? ESCAPE '\\'")
+            params.append("%" + file.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if kind:
+            clauses.append("t.kind = ?")
+            params.append(kind)
+
+        query = _match_query(terms)
+        if query:
+            sql = "SELECT t.id FROM turn_text JOIN turns t ON t.id = turn_text.rowid WHERE turn_text MATCH ?"
+            params.insert(0, query)
+            order = "turn_text.rank" if best else "turn_text.rowid DESC"
+        else:
+            sql = "SELECT t.id FROM turns t WHERE 1"
+            order = "t.id DESC"
+        for clause in clauses:
+            sql += " AND " + clause
+        sql += f" ORDER BY {order} LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [row[0] for row in self._db.execute(sql, params)]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def import_legacy_history(store, legacy_file):
+    """Move a pre-segment conversation_history.json into the store, once."""
+    if not os.path.exists(legacy_file) or len(store):
+        return 0
+
+    with open(legacy_file, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    for entry in entries:
+        store.append(entry)
+    store.sync()
+
+    os.replace(legacy_file, legacy_file + ".migrated")
+    return len(entries)
@@ -0,0 +1,214 @@
+"""Background shell jobs for !run ... &, !parallel, !jobs, !wait, !kill and !tail.
+
+Jobs run on a private asyncio loop in a daemon thread, so they keep going
+whichever front end started them (REPL, daemon or batch) and whatever that
+front end is doing meanwhile. At most JOB_WORKERS run at once; the rest
+queue. Each job's output is spooled line by line to its own file under
+JOB_DIR rather than kept in memory, and can be followed while it grows.
+Job ids restart in every process, so each process spools into its own
+session directory; those of the last JOB_KEEP_SESSIONS sessions are kept.
+"""
+import os
+import time
+import threading
+
+import console
+from executor import run_command_async, format_command_result
+
+# Job configuration
+job_dir = os.getenv("JOB_DIR", os.path.join(".agent", "jobs"))
+max_workers = int(os.getenv("JOB_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))   # Jobs running at once
+job_timeout = float(os.getenv("JOB_TIMEOUT", "3600"))                         # Seconds, 0 disables
+job_max_output = int(os.getenv("JOB_MAX_OUTPUT", str(64 * 1024 * 1024)))      # Bytes spooled per job
+spool_keep_sessions = int(os.getenv("JOB_KEEP_SESSIONS", "5"))                  # Older sessions' spools are pruned
+POLL_INTERVAL = 0.1
+
+STATE_ICONS = {"queued": "🕓", "running": "⏳", "done": "✅", "failed": "❌", "killed": "⛔"}
+
+def _prune_sessions(keep):
+    """Delete the spool directories of all but the newest keep sessions, except live ones."""
+    import shutil
+
+    try:
+        sessions = [entry for entry in os.scandir(job_dir) if entry.is_dir()]
+    except OSError:
+        return
+    sessions.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in sessions[keep:]:
+        pid = entry.name.rsplit("-", 1)[-1]
+        if pid.isdigit() and _running(int(pid)):
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+class Job:
+    def __init__(self, job_id, command, spool_dir):
+        self.id = job_id
+        self.command = command
+        self.spool_path = os.path.join(spool_dir, f"{job_id}.log")
+        self.state = "queued"    # queued, running, done, failed or killed
+        self.result = None
+        self.started = None
+        self.finished = None
+        self.future = None
+        self.reported = False
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def spooled_bytes(self):
+        try:
+            return os.path.getsize(self.spool_path)
+        except OSError:
+            return 0
+
+    def describe(self):
+        elapsed = ""
+        if self.started:
+            elapsed = f" {(self.finished or time.monotonic()) - self.started:.1f}s"
+        status = self.state
+        if self.result is not None and self.state in ("done", "failed"):
+            status += f" (exit {self.result.exit_code})"
+        return f"{STATE_ICONS[self.state]} %{self.id} {status}{elapsed}  {self.command}"
+
+class JobManager:
+    def __init__(self):
+        self.jobs = {}
+        self.next_id = 1
+        self.loop = None
+        self.spool_dir = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        # asyncio costs ~40ms to import, so only pay for it once a job is started
+        import atexit
+        import asyncio
+
+        with self._lock:
+            if self.loop is not None:
+                return
+            # One directory per process, so concurrent or later sessions never share a %1.log
+            self.spool_dir = os.path.join(job_dir, time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}")
+            os.makedirs(self.spool_dir, exist_ok=True)
+            _prune_sessions(spool_keep_sessions)
+            ready = threading.Event()
+
+            def run_loop():
+                asyncio.set_event_loop(self.loop)
+                self._slots = asyncio.Semaphore(max_workers)
+                ready.set()
+                self.loop.run_forever()
+
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=run_loop, name="jobs", daemon=True).start()
+            ready.wait()
+            atexit.register(self.shutdown)
+
+    def start(self, command):
+        """Queue a shell command as a new job and return it."""
+        import asyncio
+
+        self._ensure_loop()
+        with self._lock:
+            job = Job(self.next_id, command, self.spool_dir)
+            self.next_id += 1
+            self.jobs[job.id] = job
+        job.future = asyncio.run_coroutine_threadsafe(self._run(job), self.loop)
+        return job
+
+    async def _run(self, job):
+        import asyncio
+
+        try:
+            async with self._slots:
+                job.state = "running"
+                job.started = time.monotonic()
+                with open(job.spool_path, 'w', encoding='utf-8', buffering=1) as spool:
+                    job.result = await run_command_async(
+                        job.command,
+                        timeout=job_timeout,
+                        output_limit=job_max_output,
+                        on_output=lambda stream, line: spool.write(line + "\n"),
+                        keep_output=False
+                    )
+            job.state = "done" if job.result.exit_code == 0 and not job.result.timed_out else "failed"
+        except asyncio.CancelledError:
+            job.state = "killed"
+        except Exception as e:
+            job.state = "failed"
+            with open(job.spool_path, 'a', encoding='utf-8') as spool:
+                spool.write(f"Failed to run command: {str(e)}\n")
+        finally:
+            job.finished = time.monotonic()
+            if job.started is None:
+                job.started = job.finished
+
+    def find(self, spec):
+        """Job for "%3" or "3", or an error message."""
+        try:
+            job = self.jobs.get(int(spec.strip().lstrip("%")))
+        except ValueError:
+            return "❌ Give a job id from !jobs, like %1"
+        return job or f"❌ No job %{spec.strip().lstrip('%')}"
+
+    def kill(self, job):
+        """Stop a job: a running one has its process group terminated, a queued one never starts."""
+        if not job.active:
+            return False
+        job.future.cancel()
+        return True
+
+    def wait(self, jobs, timeout=None):
+        """Block until jobs finish (False on timeout); a cancelled task (Ctrl-C) stops waiting via TurnCancelled."""
+        from concurrent.futures import wait
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for job in jobs:
+            # finished is set only once a killed job's process group is gone
+            while job.finished is None:
+                console.check_cancelled()
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                if job.future.done():
+                    time.sleep(POLL_INTERVAL / 4)
+                else:
+                    wait([job.future], POLL_INTERVAL)
+        return True
+
+    def take_finished(self):
+        """Jobs that finished since the last call, for "done" notices."""
+        finished = []
+        for job in list(self.jobs.values()):
+            if not job.active and not job.reported:
+                job.reported = True
+                finished.append(job)
+        return finished
+
+    def summary(self, job):
+        """describe() plus how the command finished."""
+        job.reported = True
+        if job.result is None:
+            return job.describe()
+        return f"{job.describe()}\n   {format_command_result(job.result)}"
+
+    def shutdown(self):
+        """Kill jobs still running when the agent exits; they run in their own sessions."""
+        futures = [job.future for job in self.jobs.values() if job.active]
+        for future in futures:
+            future.cancel()
+        deadline = time.monotonic() + 3
+        for job in self.jobs.values():
+            while job.finished is None and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+job_manager = JobManager()
@@ -1,58 +1,588 @@
 import os
+import re
 from dotenv import load_dotenv
-import google.generativeai as genai
+import time
+import threading
+from collections import deque, namedtuple
+import cache
+import telemetry
+from backends import get_backend
+from resilience import call_with_resilience, acall_with_resilience, breaker_for, CircuitOpenError
 
 # Load environment variables and configuration
 load_dotenv()
 
-# Get API key and configurations
-api_key = os.getenv("GOOGLE_API_KEY")
-model_name = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash")
+# Get configuration (API key and model name are read by the backend)
 debug_mode = os.getenv("DEBUG", "false").lower() == "true"
+stream_mode = os.getenv("GEMINI_STREAM", "false").lower() == "true"
+temperature = float(os.getenv("GEMINI_TEMPERATURE", "0.7"))
 
-# Configure the API
-genai.configure(api_key=api_key)
+# Requests go through the backend chosen by LLM_BACKEND (see backends.py);
+# the Gemini SDK itself is only imported on the first call
+
+# Model routing: send each request to a fast or a large model (see ModelRouter)
+routing_enabled = os.getenv("GEMINI_ROUTING", "false").lower() == "true"
+fast_model = os.getenv("GEMINI_FAST_MODEL", "gemini-1.5-flash")
+large_model = os.getenv("GEMINI_LARGE_MODEL", "gemini-1.5-pro")
+route_max_fast_chars = int(os.getenv("GEMINI_ROUTE_MAX_FAST_CHARS", "400"))   # Longer prompts go to the large model
+route_max_error_rate = float(os.getenv("GEMINI_ROUTE_MAX_ERROR_RATE", "0.5"))  # Above this a model is avoided
+route_min_samples = int(os.getenv("GEMINI_ROUTE_MIN_SAMPLES", "5"))            # Calls before live stats are trusted
+draft_mode = os.getenv("GEMINI_DRAFT", "false").lower() == "true"             # Fast draft, then the large model's answer
+
+# USD per million (prompt, response) tokens; list prices, override with
+# GEMINI_MODEL_PRICES="model=in/out,..."
+MODEL_PRICES = {
+    "gemini-1.5-flash-8b": (0.0375, 0.15),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gemini-2.0-flash": (0.10, 0.40),
+}
+for _item in os.getenv("GEMINI_MODEL_PRICES", "").split(","):
+    _name, _, _price = _item.partition("=")
+    if _name.strip() and "/" in _price:
+        MODEL_PRICES[_name.strip()] = tuple(float(p) for p in _price.split("/", 1))
+
+CODE_VERBS = {"write", "implement", "create", "generate", "build", "refactor", "rewrite", "fix", "debug",
+              "optimize", "optimise", "convert", "port", "scaffold", "add", "design"}
+CODE_NOUNS = {"code", "function", "functions", "class", "classes", "script", "module", "program", "app",
+              "api", "component", "test", "tests", "endpoint", "query", "parser", "cli", "server",
+              "schema", "method", "library", "bug", "project"}
+
+def has_code_intent(prompt):
+    """True if the prompt asks for code to be written or changed."""
+    if "```" in prompt:
+        return True
+    words = set(re.findall(r"[a-z]+", prompt.lower()))
+    return bool(words & CODE_VERBS) and bool(words & CODE_NOUNS)
+
+Route = namedtuple("Route", ["model", "reason", "upgrade"])  # upgrade: routed to the large model by the rules
+
+class ModelStats:
+    """Recent latency and outcomes of one model, plus lifetime token and cost totals."""
+    
+    def __init__(self, window=100):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)   # True for a failed call
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.cost = 0.0
+    
+    def percentile(self, pct):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+    
+    def error_rate(self):
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+class ModelRouter:
+    """Pick a model per request from rules and live per-model stats.
+    
+    Rules, in order: a user override wins; prompts with code-generation
+    intent or longer than route_max_fast_chars go to the large model; the
+    rest go to the fast model. A model whose recent error rate is above
+    route_max_error_rate, or whose circuit breaker is open, is avoided while
+    the other one is healthy, and a simple prompt goes to the large model if
+    that is currently the faster one.
+    """
+    
+    def __init__(self):
+        self.override = None
+        self.stats = {}
+        self._lock = threading.Lock()
+    
+    def _stats(self, model):
+        stats = self.stats.get(model)
+        if stats is None:
+            stats = self.stats[model] = ModelStats()
+        return stats
+    
+    def healthy(self, model):
+        status = breaker_for(model).status()
+        if status["state"] == "open" and status.get("retry_in", 0) > 0:
+            return False
+        stats = self.stats.get(model)
+        if stats is None or len(stats.outcomes) < route_min_samples:
+            return True
+        return stats.error_rate() <= route_max_error_rate
+    
+    def _median(self, model):
+        stats = self.stats.get(model)
+        if stats is None or len(stats.latencies) < route_min_samples:
+            return None
+        return stats.percentile(50)
+    
+    def choose(self, prompt):
+        if self.override:
+            return Route(self.override, "override", False)
+        
+        reasons = []
+        if has_code_intent(prompt):
+            reasons.append("code generation")
+        if len(prompt) > route_max_fast_chars:
+            reasons.append(f"prompt over {route_max_fast_chars} chars")
+        
+        if reasons:
+            if not self.healthy(large_model) and self.healthy(fast_model):
+                return Route(fast_model, f"{large_model} failing", False)
+            return Route(large_model, ", ".join(reasons), True)
+        
+        if not self.healthy(fast_model) and self.healthy(large_model):
+            return Route(large_model, f"{fast_model} failing", False)
+        fast, large = self._median(fast_model), self._median(large_model)
+        if fast is not None and large is not None and large < fast and self.healthy(large_model):
+            return Route(large_model, f"{large_model} currently faster", False)
+        return Route(fast_model, "short prompt", False)
+    
+    def record(self, model, seconds, usage=None, error=False):
+        """Account one call; returns its cost in USD."""
+        in_price, out_price = MODEL_PRICES.get(model, (0.0, 0.0))
+        prompt_tokens = (usage.prompt_tokens or 0) if usage else 0
+        response_tokens = (usage.response_tokens or 0) if usage else 0
+        cost = (prompt_tokens * in_price + response_tokens * out_price) / 1_000_000
+        with self._lock:
+            stats = self._stats(model)
+            stats.calls += 1
+            stats.errors += int(error)
+            stats.outcomes.append(error)
+            if not error:
+                stats.latencies.append(seconds)
+            stats.prompt_tokens += prompt_tokens
+            stats.response_tokens += response_tokens
+            stats.cost += cost
+        return cost
+    
+    def report(self):
+        """Per-model table of calls, latency percentiles, error rate, tokens and cost."""
+        with self._lock:
+            rows = [(model, stats, stats.percentile(50), stats.percentile(95)) for model, stats in self.stats.items()]
+        if not rows:
+            return "No model calls yet."
+        lines = [f"{'model':<24} {'calls':>6} {'p50 s':>7} {'p95 s':>7} {'errors':>7} {'tokens in/out':>15} {'cost $':>10}"]
+        for model, stats, p50, p95 in sorted(rows, key=lambda row: row[0]):
+            lines.append(
+                f"{model:<24} {stats.calls:>6} {p50 or 0:>7.2f} {p95 or 0:>7.2f} {stats.error_rate():>7.0%} "
+                f"{f'{stats.prompt_tokens}/{stats.response_tokens}':>15} {stats.cost:>10.6f}"
+            )
+        lines.append(f"{'total':<24} {sum(r[1].calls for r in rows):>6} {'':>7} {'':>7} {'':>7} {'':>15} "
+                     f"{sum(r[1].cost for r in rows):>10.6f}")
+        return "\n".join(lines)
+
+router = ModelRouter()
+_model_backends = {}
+_last_call = threading.local()
+
+def backend_for_model(model):
+    """The active backend, or a copy of it talking to another model."""
+    base = get_backend()
+    if model == base.model:
+        return base
+    cached = _model_backends.get(model)
+    if cached is None or cached[0] is not base:
+        cached = _model_backends[model] = (base, base.with_model(model))
+    return cached[1]
+
+def select_backend(prompt, model=None):
+    """Backend and Route for a request: model if given, the router's pick if routing is on."""
+    _last_call.info = None  # A cache hit leaves it empty
+    if model:
+        return backend_for_model(model), Route(model, "requested", False)
+    if routing_enabled:
+        route = router.choose(prompt)
+        return backend_for_model(route.model), route
+    backend = get_backend()
+    return backend, Route(backend.model, "default", False)
+
+def account(model, route, start, usage=None, error=None):
+    """Record a finished call for routing and cost reports, and as this thread's last call.
+    
+    error is the exception a failed call raised. A call refused by the model's
+    open circuit breaker never reached the model, so it isn't counted against it.
+    """
+    seconds = time.perf_counter() - start
+    cost = 0.0
+    if not isinstance(error, CircuitOpenError):
+        cost = router.record(model, seconds, usage, error is not None)
+    _last_call.info = {"model": model, "reason": route.reason, "seconds": seconds, "cost": cost,
+                       "error": error is not None}
+
+def last_call():
+    """Model, routing reason, latency and cost of this thread's most recent model call."""
+    return getattr(_last_call, "info", None)
+
+def record_usage(attrs, usage):
+    """Copy prompt/response token counts from a backend Usage into span attrs."""
+    if usage is None:
+        return
+    if usage.prompt_tokens is not None:
+        attrs["prompt_tokens"] = usage.prompt_tokens
+    if usage.response_tokens is not None:
+        attrs["response_tokens"] = usage.response_tokens
 
 def get_default_generation_config():
     """Get default generation configuration."""
     return {
-        "temperature": 0.7,        # Controls randomness (0.0-1.0)
+        "temperature": temperature, # Controls randomness (0.0-1.0), 0 is deterministic
         "top_p": 0.95,             # Nucleus sampling parameter
         "top_k": 40,               # Limits vocabulary to top K tokens
         "max_output_tokens": 8192, # Maximum response length
         "candidate_count": 1       # Number of responses to generate
     }
 
-def chat_with_gemini(prompt, generation_config=None):
+def _cache_key(prompt, config, use_cache, backend):
+    """Return the response cache key for this request, or None if it must not be cached."""
+    if not use_cache or not cache.is_cacheable(config):
+        cache.cache_stats["bypassed"] += 1
+        return None
+    return cache.make_key(prompt, f"{backend.name}:{backend.model}", config)
+
+def _cached(key):
+    """Cached response text for key, or None."""
+    if not key:
+        return None
+    cached = cache.get(key)
+    if cached is not None:
+        if debug_mode:
+            print(f"DEBUG: Cache hit {key[:12]}")
+        telemetry.observe("llm.cache_hit", 0.0)
+    return cached
+
+def _generate(backend, route, prompt, config, use_cache):
+    """One non-streaming request to backend, through the cache and retry layers."""
+    key = _cache_key(prompt, config, use_cache, backend)
+    cached = _cached(key)
+    if cached is not None:
+        return cached
+    
+    start = time.perf_counter()
+    try:
+        with telemetry.span("llm.generate") as attrs:
+            # Generate content with configuration, retrying transient failures
+            reply = call_with_resilience(lambda: backend.generate(prompt, config), circuit=breaker_for(backend.model))
+            record_usage(attrs, reply.usage)
+    except Exception as e:
+        account(backend.model, route, start, error=e)
+        raise
+    account(backend.model, route, start, reply.usage)
+    
+    if key:
+        cache.put(key, reply.text, backend.model)
+    return reply.text
+
+def _draft_then_upgrade(prompt, config, use_cache, route, on_draft):
+    """Show a fast model's draft while the large model works; return the large reply.
+    
+    If the large model fails, the draft is returned instead.
+    """
+    result = {}
+    
+    def upgrade():
+        try:
+            result["text"] = _generate(backend_for_model(route.model), route, prompt, config, use_cache)
+        except Exception as e:
+            result["error"] = e
+        result["call"] = last_call()
+    
+    worker = threading.Thread(target=upgrade, daemon=True)
+    worker.start()
+    draft_route = Route(fast_model, "draft", False)
+    draft = None
+    try:
+        draft = _generate(backend_for_model(fast_model), draft_route, prompt, config, use_cache)
+        on_draft(draft, fast_model)
+    except Exception as e:
+        if debug_mode:
+            print(f"DEBUG ERROR: Draft failed: {str(e)}")
+    worker.join()
+    if "error" in result and draft is not None:
+        return draft
+    _last_call.info = result["call"]
+    if "error" in result:
+        raise result["error"]
+    return result["text"]
+
+def chat_with_gemini(prompt, generation_config=None, use_cache=True, model=None, on_draft=None):
     """
     Generate a response from Gemini based on the prompt.
     
     Args:
         prompt (str): User input to send to the model
         generation_config (dict, optional): Override default generation parameters
+        use_cache (bool): Set to False to bypass the response cache
+        model (str, optional): Use this model instead of routing
+        on_draft (callable, optional): In draft mode, called with (text, model)
+            for the fast model's draft of a prompt routed to the large model
         
     Returns:
         str: The model's response text
     """
+    backend, route = select_backend(prompt, model)
     if debug_mode:
-        print(f"DEBUG: Using model {model_name}")
+        print(f"DEBUG: Using {backend.name} model {backend.model} ({route.reason})")
     
     # Use provided config or default
     config = generation_config or get_default_generation_config()
     
     try:
-        # Initialize the model
-        model = genai.GenerativeModel(model_name)
+        if on_draft and draft_mode and route.upgrade and fast_model != route.model:
+            return _draft_then_upgrade(prompt, config, use_cache, route, on_draft)
+        return _generate(backend, route, prompt, config, use_cache)
+    except Exception as e:
+        error_msg = f"Error generating content: {str(e)}"
+        if debug_mode:
+            print(f"DEBUG ERROR: {error_msg}")
+        raise Exception(error_msg)
+
+
+def stream_chat_with_gemini(prompt, generation_config=None, use_cache=True, model=None):
+    """
+    Stream a response from Gemini, yielding text chunks as they arrive.
+    
+    Args:
+        prompt (str): User input to send to the model
+        generation_config (dict, optional): Override default generation parameters
+        use_cache (bool): Set to False to bypass the response cache
+        model (str, optional): Use this model instead of routing
+        
+    Yields:
+        str: Successive pieces of the model's response text
+    """
+    backend, route = select_backend(prompt, model)
+    if debug_mode:
+        print(f"DEBUG: Streaming from {backend.name} model {backend.model} ({route.reason})")
+    
+    config = generation_config or get_default_generation_config()
+    
+    key = _cache_key(prompt, config, use_cache, backend)
+    cached = _cached(key)
+    if cached is not None:
+        yield cached
+        return
+    
+    # Only cacheable responses are collected; everything else streams straight through
+    parts = [] if key else None
+    start = time.perf_counter()
+    attrs = {}
+    first = True
+    
+    try:
+        # Only opening the stream is retried; chunks already shown can't be taken back
+        response = call_with_resilience(lambda: backend.stream(prompt, config), hedge=False,
+                                        circuit=breaker_for(backend.model))
+        
+        for text in response:
+            if first:
+                telemetry.observe("llm.first_token", time.perf_counter() - start)
+                first = False
+            if parts is not None:
+                parts.append(text)
+            yield text
+        
+        record_usage(attrs, response.usage)
+        account(backend.model, route, start, response.usage)
+        if parts is not None:
+            cache.put(key, "".join(parts), backend.model)
+    except Exception as e:
+        attrs["errors"] = 1
+        account(backend.model, route, start, error=e)
+        error_msg = f"Error generating content: {str(e)}"
+        if debug_mode:
+            print(f"DEBUG ERROR: {error_msg}")
+        raise Exception(error_msg)
+    finally:
+        # Recorded here rather than with span() so an abandoned generator is still timed
+        telemetry.observe("llm.stream", time.perf_counter() - start, **attrs)
+
+async def achat_with_gemini(prompt, generation_config=None, use_cache=True, model=None):
+    """
+    Async counterpart of chat_with_gemini, for driving many requests from one event loop.
+    
+    Args:
+        prompt (str): User input to send to the model
+        generation_config (dict, optional): Override default generation parameters
+        use_cache (bool): Set to False to bypass the response cache
+        model (str, optional): Use this model instead of routing
         
-        # Generate content with configuration
-        response = model.generate_content(
-            prompt,
-            generation_config=config
-        )
+    Returns:
+        str: The model's response text
+    """
+    backend, route = select_backend(prompt, model)
+    config = generation_config or get_default_generation_config()
+    
+    key = _cache_key(prompt, config, use_cache, backend)
+    cached = _cached(key)
+    if cached is not None:
+        return cached
+    
+    start = time.perf_counter()
+    try:
+        with telemetry.span("llm.generate") as attrs:
+            reply = await acall_with_resilience(lambda: backend.agenerate(prompt, config), circuit=breaker_for(backend.model))
+            record_usage(attrs, reply.usage)
+        account(backend.model, route, start, reply.usage)
         
-        return response.text
+        if key:
+            cache.put(key, reply.text, backend.model)
+        return reply.text
     except Exception as e:
+        account(backend.model, route, start, error=e)
         error_msg = f"Error generating content: {str(e)}"
         if debug_mode:
             print(f"DEBUG ERROR: {error_msg}")
         raise Exception(error_msg)
+
+session_token_budget = int(os.getenv("GEMINI_SESSION_TOKEN_BUDGET", "32000"))
+session_summarize = os.getenv("GEMINI_SESSION_SUMMARIZE", "false").lower() == "true"
+
+SUMMARY_PROMPT = (
+    "Summarize the following conversation between a user and a coding assistant in a few "
+    "sentences. Keep file names, decisions and open questions.\n\n{conversation}"
+)
+
+class ChatSession:
+    """Multi-turn conversation kept within a prompt token budget.
+    
+    Turns are held in memory with their token counts, which are computed once
+    per turn (count_tokens for prompts, usage metadata for replies). Before
+    each message the oldest turns are evicted, or folded into a running
+    summary when summarize is enabled, until history plus prompt fit the budget.
+    """
+    
+    def __init__(self, token_budget=None, summarize=None, generation_config=None):
+        self.token_budget = token_budget or session_token_budget
+        self.summarize = session_summarize if summarize is None else summarize
+        self.generation_config = generation_config
+        self.turns = []          # [{"role", "text", "tokens"}], alternating user/model
+        self.summary = None      # {"text", "tokens"} covering evicted turns
+        self.turn_stats = []     # Per-turn prompt/response token totals
+        self.evicted = 0
+    
+    def count_tokens(self, text):
+        """Token count for text; callers keep it on the turn, so nothing is counted twice."""
+        return call_with_resilience(lambda: get_backend().count_tokens(text), hedge=False)
+    
+    def history_tokens(self):
+        total = sum(turn["tokens"] for turn in self.turns)
+        if self.summary:
+            total += self.summary["tokens"]
+        return total
+    
+    def _history(self):
+        history = []
+        if self.summary:
+            history.append({"role": "user", "parts": [f"Summary of our earlier conversation:\n{self.summary['text']}"]})
+            history.append({"role": "model", "parts": ["Understood."]})
+        history.extend({"role": turn["role"], "parts": [turn["text"]]} for turn in self.turns)
+        return history
+    
+    def _fit_budget(self, prompt_tokens):
+        """Drop the oldest user/model pairs until history plus prompt fit the budget."""
+        dropped = []
+        while self.turns and self.history_tokens() + prompt_tokens > self.token_budget:
+            dropped.extend(self.turns[:2])
+            del self.turns[:2]
+        if not dropped:
+            return
+        
+        self.evicted += len(dropped) // 2
+        if self.summarize:
+            conversation = "\n".join(f"{turn['role']}: {turn['text']}" for turn in dropped)
+            if self.summary:
+                conversation = f"(earlier summary) {self.summary['text']}\n{conversation}"
+            try:
+                # Summaries are simple; with routing on they go to the fast model
+                backend = backend_for_model(fast_model) if routing_enabled else get_backend()
+                text = backend.generate(SUMMARY_PROMPT.format(conversation=conversation), None).text
+                self.summary = {"text": text, "tokens": self.count_tokens(text)}
+            except Exception as e:
+                if debug_mode:
+                    print(f"DEBUG ERROR: Could not summarize evicted turns: {str(e)}")
+            # The summary itself must fit as well
+            if self.summary and self.history_tokens() + prompt_tokens > self.token_budget:
+                self.summary = None
+    
+    def _prepare(self, prompt, generation_config):
+        prompt_tokens = self.count_tokens(prompt)
+        self._fit_budget(prompt_tokens)
+        history = self._history()
+        config = generation_config or self.generation_config or get_default_generation_config()
+        return history, config, prompt_tokens
+    
+    def _record(self, prompt, prompt_tokens, reply, usage):
+        reply_tokens = usage.response_tokens
+        if reply_tokens is None:
+            reply_tokens = self.count_tokens(reply)
+        sent_tokens = usage.prompt_tokens
+        if sent_tokens is None:
+            sent_tokens = self.history_tokens() + prompt_tokens
+        
+        self.turns.append({"role": "user", "text": prompt, "tokens": prompt_tokens})
+        self.turns.append({"role": "model", "text": reply, "tokens": reply_tokens})
+        self.turn_stats.append({"prompt_tokens": sent_tokens, "response_tokens": reply_tokens})
+    
+    def send(self, prompt, generation_config=None):
+        """Send a message with the session history and return the reply text."""
+        try:
+            with telemetry.span("llm.session") as attrs:
+                history, config, prompt_tokens = self._prepare(prompt, generation_config)
+                backend, route = select_backend(prompt)
+                start = time.perf_counter()
+                try:
+                    reply = call_with_resilience(lambda: backend.chat(history, prompt, config),
+                                                 circuit=breaker_for(backend.model))
+                except Exception as e:
+                    account(backend.model, route, start, error=e)
+                    raise
+                account(backend.model, route, start, reply.usage)
+                record_usage(attrs, reply.usage)
+        except Exception as e:
+            raise Exception(f"Error generating content: {str(e)}")
+        self._record(prompt, prompt_tokens, reply.text, reply.usage)
+        return reply.text
+    
+    def stream(self, prompt, generation_config=None):
+        """Like send, but yield the reply in chunks as they arrive."""
+        parts = []
+        start = time.perf_counter()
+        attrs = {}
+        backend = None
+        try:
+            history, config, prompt_tokens = self._prepare(prompt, generation_config)
+            backend, route = select_backend(prompt)
+            response = call_with_resilience(lambda: backend.chat(history, prompt, config, stream=True), hedge=False,
+                                            circuit=breaker_for(backend.model))
+            for text in response:
+                if not parts:
+                    telemetry.observe("llm.first_token", time.perf_counter() - start)
+                parts.append(text)
+                yield text
+            record_usage(attrs, response.usage)
+            account(backend.model, route, start, response.usage)
+        except Exception as e:
+            attrs["errors"] = 1
+            if backend is not None:
+                account(backend.model, route, start, error=e)
+            raise Exception(f"Error generating content: {str(e)}")
+        finally:
+            telemetry.observe("llm.session_stream", time.perf_counter() - start, **attrs)
+        self._record(prompt, prompt_tokens, "".join(parts), response.usage)
+    
+    def reset(self):
+        self.turns = []
+        self.summary = None
+        self.turn_stats = []
+        self.evicted = 0
+    
+    def status(self):
+        """Summary of the session's size and per-turn token usage."""
+        return {
+            "turns": len(self.turns) // 2,
+            "history_tokens": self.history_tokens(),
+            "token_budget": self.token_budget,
+            "evicted_turns": self.evicted,
+            "summarized": self.summary is not None,
+            "prompt_tokens_per_turn": [stat["prompt_tokens"] for stat in self.turn_stats]
+        }
@@ -0,0 +1,272 @@
+import os
+import hashlib
+import threading
+from datetime import datetime
+from collections import namedtuple
+from utils import write_file_if_changed
+
+# Manifest configuration
+manifest_db = os.getenv("MANIFEST_DB", os.path.join(".agent", "manifest.sqlite3"))
+blob_dir = os.getenv("MANIFEST_BLOB_DIR", os.path.join(".agent", "blobs"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS origins (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,            -- llm, create, init or import
+    description TEXT NOT NULL,     -- Prompt text or the command that wrote the files
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,         -- Normalized, relative to the working directory
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    origin_id INTEGER NOT NULL REFERENCES origins(id),
+    written_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_origin ON files(origin_id);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files(sha256);
+"""
+
+FileRecord = namedtuple("FileRecord", ["path", "sha256", "size", "origin_id", "written_at"])
+Origin = namedtuple("Origin", ["id", "kind", "description", "created_at", "files", "bytes"])
+
+def normalize(path):
+    return os.path.normpath(os.path.relpath(path)).replace(os.sep, "/")
+
+def _prefix_bounds(directory):
+    """[low, high) range of paths under directory, usable with the primary key index."""
+    prefix = normalize(directory).rstrip("/") + "/"
+    return prefix, prefix[:-1] + chr(ord("/") + 1)
+
+class Manifest:
+    """SQLite record of every file the agent writes, with a content-addressed blob store.
+
+    Each write is attributed to an origin (an LLM prompt, !create or !init).
+    File contents are stored once per distinct hash under blob_dir, so
+    identical code blocks from different runs share one blob. A blob's
+    reference count is the number of rows with its hash (an indexed lookup);
+    it is deleted, under the lock, once a rewrite or forget() takes that to 0.
+    restore() reads a blob back to undo changes made to a file since.
+    """
+
+    def __init__(self, path=None, blobs=None):
+        import sqlite3
+
+        self.path = path or manifest_db
+        self.blobs = blobs or blob_dir
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        is_new = not os.path.exists(self.path)
+        # Batch mode saves from several threads; one connection guarded by a lock
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        if is_new:
+            self.import_directory("generated")
+
+    def _blob_path(self, sha):
+        return os.path.join(self.blobs, sha[:2], sha)
+
+    def _store_blob(self, sha, data):
+        path = self._blob_path(sha)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, path)
+
+    def _collect_blobs(self, shas):
+        """Delete the blobs of shas that no row references any more; call with the lock held."""
+        for sha in shas:
+            if self._db.execute("SELECT 1 FROM files WHERE sha256 = ? LIMIT 1", (sha,)).fetchone():
+                continue
+            try:
+                os.remove(self._blob_path(sha))
+            except OSError:
+                pass
+
+    def _shas(self, paths):
+        """Hashes currently recorded for paths; call with the lock held."""
+        shas = set()
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            shas.update(row[0] for row in self._db.execute(
+                f"SELECT sha256 FROM files WHERE path IN ({','.join('?' * len(chunk))})", chunk))
+        return shas
+
+    def add_origin(self, kind, description):
+        """Register a new origin and return its id."""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT INTO origins (kind, description, created_at) VALUES (?, ?, ?)",
+                (kind, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+            return cursor.lastrowid
+
+    def record(self, origin_id, files):
+        """Record {path: content (str or bytes)} as written by origin_id."""
+        rows, blobs = [], {}
+        for path, content in files.items():
+            data = content.encode("utf-8") if isinstance(content, str) else content
+            sha = hashlib.sha256(data).hexdigest()
+            blobs[sha] = data
+            rows.append((normalize(path), sha, len(data), origin_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        with self._lock, self._db:
+            # Blobs are written and collected under the lock, so a concurrent
+            # forget() can't delete one that a row is about to reference
+            replaced = self._shas([row[0] for row in rows]) - set(blobs)
+            for sha, data in blobs.items():
+                self._store_blob(sha, data)
+            # A rewritten path moves to its newest origin
+            self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", rows)
+            self._drop_empty_origins()
+            self._collect_blobs(replaced)
+
+    def record_paths(self, origin_id, paths):
+        """Record files already on disk (e.g. from a template) by reading them back."""
+        files = {}
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    files[path] = f.read()
+            except OSError:
+                continue
+        self.record(origin_id, files)
+
+    def import_directory(self, directory):
+        """Record files under directory that predate the manifest, once."""
+        if not os.path.isdir(directory):
+            return 0
+        paths = [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names]
+        if paths:
+            self.record_paths(self.add_origin("import", f"Existing files in {directory}/"), paths)
+        return len(paths)
+
+    def files(self, origin_id=None, under=None):
+        """FileRecords for one origin and/or below a directory, by indexed lookup."""
+        query = "SELECT path, sha256, size, origin_id, written_at FROM files"
+        clauses, params = [], []
+        if origin_id is not None:
+            clauses.append("origin_id = ?")
+            params.append(origin_id)
+        if under is not None:
+            clauses.append("path >= ? AND path < ?")
+            params.extend(_prefix_bounds(under))
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        with self._lock:
+            return [FileRecord(*row) for row in self._db.execute(query + " ORDER BY path", params)]
+
+    def origins(self, under=None):
+        """Origins that still own files (optionally below a directory), newest first."""
+        query = """SELECT o.id, o.kind, o.description, o.created_at, COUNT(f.path), SUM(f.size)
+                   FROM origins o JOIN files f ON f.origin_id = o.id"""
+        params = []
+        if under is not None:
+            query += " WHERE f.path >= ? AND f.path < ?"
+            params.extend(_prefix_bounds(under))
+        query += " GROUP BY o.id ORDER BY o.id DESC"
+        with self._lock:
+            return [Origin(*row) for row in self._db.execute(query, params)]
+
+    def untracked(self, directory, visited=None):
+        """Files under directory that the manifest doesn't know, e.g. written by a shell command.
+
+        visited, if given, collects every directory scanned.
+        """
+        if not os.path.isdir(directory):
+            return []
+        known = {record.path for record in self.files(under=directory)}
+        found = []
+        for root, _, names in os.walk(directory):
+            if visited is not None:
+                visited.append(root)
+            for name in names:
+                path = normalize(os.path.join(root, name))
+                if path not in known:
+                    found.append(path)
+        return sorted(found)
+
+    def get(self, path):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, sha256, size, origin_id, written_at FROM files WHERE path = ?", (normalize(path),)
+            ).fetchone()
+        return FileRecord(*row) if row else None
+
+    def restore(self, path):
+        """Write back the contents the agent last recorded for path.
+
+        Returns:
+            tuple: (FileRecord or None, "restored", "unchanged" or an error message)
+        """
+        record = self.get(path)
+        if record is None:
+            return None, "not in the manifest"
+        try:
+            with open(self._blob_path(record.sha256), 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            return record, f"blob missing ({str(e)})"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        status = write_file_if_changed(path, data)
+        return record, "restored" if status == "written" else status
+
+    def forget(self, paths):
+        """Drop paths from the manifest and delete blobs nothing else references."""
+        paths = [normalize(p) for p in paths]
+        with self._lock, self._db:
+            shas = self._shas(paths)
+            self._db.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in paths])
+            self._drop_empty_origins()
+            self._collect_blobs(shas)
+
+    def _drop_empty_origins(self):
+        self._db.execute("DELETE FROM origins WHERE id NOT IN (SELECT DISTINCT origin_id FROM files)")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+_manifest = None
+
+def get_manifest():
+    """Open the manifest on first use (importing existing generated/ files into a new one)."""
+    global _manifest
+    if _manifest is None:
+        import atexit
+        _manifest = Manifest()
+        atexit.register(_manifest.close)
+    return _manifest
+
+def delete_files(paths, stop_at="generated"):
+    """Delete files, forget them in the manifest and prune directories left empty.
+
+    Returns:
+        tuple: (deleted paths, {path: error message})
+    """
+    deleted, errors = [], {}
+    for path in paths:
+        try:
+            os.remove(path)
+            deleted.append(path)
+        except FileNotFoundError:
+            deleted.append(path)  # Already gone; still drop it from the manifest
+        except OSError as e:
+            errors[path] = str(e)
+    get_manifest().forget(deleted)
+
+    # Remove directories emptied by the deletion, deepest first, never stop_at itself
+    stop = os.path.abspath(stop_at)
+    for directory in sorted({os.path.dirname(os.path.abspath(p)) for p in deleted}, key=len, reverse=True):
+        while directory != stop and directory.startswith(stop + os.sep):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+    return deleted, errors
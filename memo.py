@@ -0,0 +1,253 @@
+import os
+import time
+import struct
+import threading
+from collections import namedtuple, OrderedDict
+
+# Command result cache configuration
+memo_enabled = os.getenv("COMMAND_CACHE", "true").lower() == "true"
+max_entries = int(os.getenv("COMMAND_CACHE_ENTRIES", "256"))
+max_bytes = int(os.getenv("COMMAND_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+use_inotify = os.getenv("COMMAND_CACHE_INOTIFY", "true").lower() == "true"
+max_watches = int(os.getenv("COMMAND_CACHE_MAX_WATCHES", "2048"))
+# Without inotify, a directory's mtime shows entries added, removed or renamed
+# but not a file in it growing, so cached listings also expire after this long
+fallback_ttl = float(os.getenv("COMMAND_CACHE_FALLBACK_TTL", "5"))
+
+# Results whose inputs changed this recently (ns) may have raced with the change
+CHANGE_MARGIN_NS = 20_000_000
+
+# inotify(7) constants
+IN_MODIFY, IN_ATTRIB, IN_MOVED_FROM, IN_MOVED_TO = 0x2, 0x4, 0x40, 0x80
+IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF = 0x100, 0x200, 0x400, 0x800
+IN_Q_OVERFLOW, IN_IGNORED, IN_ONLYDIR = 0x4000, 0x8000, 0x01000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct("iIII")
+
+# dirs: directories whose listing the result depends on; files: files whose content it depends on
+CachedResult = namedtuple("CachedResult", ["result", "dirs", "files", "stamps", "watched", "stored", "size"])
+
+def _stamp(path):
+    """What the mtime fallback compares: (mtime_ns, size, inode), or None if path is missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+class InotifyWatcher:
+    """Directory watches on a non-blocking inotify descriptor, read through ctypes.
+
+    Events are drained synchronously before each lookup rather than by a
+    thread, so a change made just before a command is always seen by it.
+    """
+
+    def __init__(self):
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self._libc = libc
+        self._get_errno = ctypes.get_errno
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self._get_errno(), "inotify_init1 failed")
+        self.directories = {}   # watch descriptor -> directory
+        self.watches = {}       # directory -> watch descriptor
+
+    def watch(self, directory):
+        """Watch directory; False if that isn't possible (e.g. out of watches)."""
+        if directory in self.watches:
+            return True
+        if len(self.watches) >= max_watches:
+            return False
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            return False
+        self.directories[wd] = directory
+        self.watches[directory] = wd
+        return True
+
+    def read_events(self):
+        """Pending events as (directory, name, mask); directory is None after a queue overflow."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                start = offset + EVENT_HEADER.size
+                name = os.fsdecode(data[start:start + length].split(b"\0", 1)[0])
+                offset = start + length
+                directory = self.directories.get(wd)
+                if mask & IN_IGNORED and directory is not None:
+                    # The watch is gone (directory deleted or unmounted)
+                    del self.directories[wd]
+                    self.watches.pop(directory, None)
+                events.append((directory, name, mask))
+
+    def close(self):
+        os.close(self.fd)
+
+class ResultCache:
+    """In-process cache for the output of read-only commands.
+
+    A result is stored with the directories and files it was computed from.
+    With inotify, a change to any of them drops the result as soon as the
+    next lookup drains the event queue; otherwise each lookup compares the
+    inputs' mtime, size and inode with those seen when the result was stored.
+    Results without inputs (e.g. system info) stay for the process lifetime.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._by_dir = {}    # directory -> keys listing it
+        self._by_file = {}   # file -> keys reading it
+        self._bytes = 0
+        self._watcher = None
+        self._watcher_failed = not use_inotify
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0, "evictions": 0, "skipped": 0}
+        self.hits_by_command = {}
+
+    def _get_watcher(self):
+        if self._watcher is None and not self._watcher_failed:
+            try:
+                self._watcher = InotifyWatcher()
+            except OSError:
+                self._watcher_failed = True
+        return self._watcher
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        for directory in entry.dirs:
+            self._unindex(self._by_dir, directory, key)
+        for path in entry.files:
+            self._unindex(self._by_file, path, key)
+
+    @staticmethod
+    def _unindex(index, path, key):
+        keys = index.get(path)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[path]
+
+    def _invalidate(self, keys):
+        for key in list(keys):
+            if key in self._entries:
+                self._drop(key)
+                self.stats["invalidations"] += 1
+
+    def _drain(self):
+        if self._watcher is None:
+            return
+        for directory, name, mask in self._watcher.read_events():
+            if directory is None:
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost; nothing watched can be trusted
+                    self._invalidate([key for key, entry in self._entries.items() if entry.watched])
+                continue
+            self._invalidate(self._by_dir.get(directory, ()))
+            if name:
+                self._invalidate(self._by_file.get(os.path.join(directory, name), ()))
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                prefix = directory.rstrip(os.sep) + os.sep
+                self._invalidate([key for path, keys in self._by_file.items() if path.startswith(prefix) for key in keys])
+
+    def _still_valid(self, entry):
+        if entry.dirs and time.monotonic() - entry.stored > fallback_ttl:
+            return False
+        return all(_stamp(path) == stamp for path, stamp in entry.stamps.items())
+
+    def get(self, key, command=None):
+        """Return the cached result for key, or None if it's missing or out of date."""
+        if not memo_enabled:
+            return None
+        with self._lock:
+            self._drain()
+            entry = self._entries.get(key)
+            if entry is not None and not entry.watched and not self._still_valid(entry):
+                self._drop(key)
+                self.stats["invalidations"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            if command:
+                self.hits_by_command[command] = self.hits_by_command.get(command, 0) + 1
+            return entry.result
+
+    def put(self, key, result, dirs=(), files=(), started=None):
+        """Cache result, computed from dirs and files starting at time.time_ns() == started.
+
+        A result whose inputs changed while it was being computed might
+        already be stale, so it isn't cached.
+        """
+        size = len(result)
+        if not memo_enabled or size > max_bytes // 4:
+            return False
+        dirs = tuple(dict.fromkeys(os.path.abspath(d) for d in dirs))
+        files = tuple(dict.fromkeys(os.path.abspath(f) for f in files))
+        stamps = {path: _stamp(path) for path in dirs + files}
+        if started is not None and any(s is not None and s[0] >= started - CHANGE_MARGIN_NS for s in stamps.values()):
+            self.stats["skipped"] += 1
+            return False
+
+        with self._lock:
+            watched = True
+            if dirs or files:
+                watcher = self._get_watcher()
+                watched = watcher is not None and all(
+                    watcher.watch(directory) for directory in dirs + tuple(os.path.dirname(f) for f in files)
+                )
+            self._drop(key)
+            self._entries[key] = CachedResult(result, dirs, files, stamps, watched, time.monotonic(), size)
+            self._bytes += size
+            for directory in dirs:
+                self._by_dir.setdefault(directory, set()).add(key)
+            for path in files:
+                self._by_file.setdefault(path, set()).add(key)
+            self.stats["stores"] += 1
+
+            while len(self._entries) > max_entries or self._bytes > max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+        return True
+
+    def clear(self):
+        """Drop every cached result and return how many there were."""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._by_dir.clear()
+            self._by_file.clear()
+            self._bytes = 0
+            return count
+
+    def get_stats(self):
+        """Return hit/miss counters, per-command hits and how invalidation works."""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            stats = dict(self.stats)
+            stats["hit_rate"] = round(self.stats["hits"] / lookups, 3) if lookups else 0.0
+            stats["hits_by_command"] = dict(self.hits_by_command)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["invalidation"] = "inotify" if self._watcher is not None else (
+                "mtime" if self._watcher_failed else "not started")
+            stats["watches"] = len(self._watcher.watches) if self._watcher is not None else 0
+            stats["enabled"] = memo_enabled
+            return stats
+
+command_cache = ResultCache()
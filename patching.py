@@ -0,0 +1,247 @@
+import os
+import re
+import difflib
+from collections import namedtuple, Counter
+
+# Edit mode configuration
+fuzzy_threshold = float(os.getenv("EDIT_FUZZY_THRESHOLD", "0.85"))   # Minimum similarity for a fuzzy hunk match
+FUZZY_CANDIDATES = 8   # Windows compared in full per hunk, picked by matching anchor lines
+
+# One change: replace the text `search` with `replace` (empty search appends)
+Hunk = namedtuple("Hunk", ["search", "replace"])
+
+SEARCH_REPLACE_PATTERN = re.compile(
+    r"^<{5,9} ?SEARCH[^\n]*\n(.*?)^={5,9}[ \t]*\n(.*?)^>{5,9} ?REPLACE[^\n]*$",
+    re.DOTALL | re.MULTILINE
+)
+# "@@ -12,4 +12,5 @@", or a bare "@@" since the line numbers are ignored anyway
+HUNK_HEADER_PATTERN = re.compile(r"^@@(?: -\d+(?:,\d+)? \+\d+(?:,\d+)? @@|\s*$)")
+
+EDIT_PROMPT = """You are editing the file {path} ({lines} lines). Its current content is below.
+
+Change it as follows: {instruction}
+
+Reply with only the changes, as one or more search/replace blocks in this exact format:
+
+<<<<<<< SEARCH
+lines copied exactly from the current file, with enough context to be unique
+=======
+the new lines that replace them
+>>>>>>> REPLACE
+
+Keep each SEARCH section short. Leave SEARCH empty to append to the end of the file.
+Do not repeat unchanged parts of the file.
+
+Current content of {path}:
+```
+{content}
+```"""
+
+FULL_FILE_PROMPT = """Change the file {path} as follows: {instruction}
+
+Reply with the complete updated file in a single fenced code block and nothing else.
+
+Current content of {path}:
+```
+{content}
+```"""
+
+class PatchError(Exception):
+    """Raised when a hunk can't be located in the file, so nothing is written."""
+
+def build_edit_prompt(path, content, instruction):
+    return EDIT_PROMPT.format(path=path, lines=content.count("\n") + 1, instruction=instruction, content=content)
+
+def build_full_file_prompt(path, content, instruction):
+    return FULL_FILE_PROMPT.format(path=path, instruction=instruction, content=content)
+
+def _parse_unified_diff(text):
+    """Turn each @@ hunk of a unified diff into a Hunk; line numbers are ignored.
+
+    Inside a hunk "--- x" is a removed line "-- x" (an SQL or Lua comment,
+    say); it is a file header only when "+++ " and an @@ header follow.
+    """
+    hunks = []
+    search, replace = None, None
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if HUNK_HEADER_PATTERN.match(line):
+            if search is not None:
+                hunks.append(Hunk("".join(search), "".join(replace)))
+            search, replace = [], []
+        elif search is None or line.startswith("\\"):
+            continue
+        elif (line.startswith("--- ") and i + 2 < len(lines) and lines[i + 1].startswith("+++ ")
+              and HUNK_HEADER_PATTERN.match(lines[i + 2])):
+            # The next file of a multi-file diff
+            hunks.append(Hunk("".join(search), "".join(replace)))
+            search, replace = None, None
+        elif line.startswith("-"):
+            search.append(line[1:] + "\n")
+        elif line.startswith("+"):
+            replace.append(line[1:] + "\n")
+        elif line.startswith(" ") or not line:
+            search.append(line[1:] + "\n")
+            replace.append(line[1:] + "\n")
+        else:
+            # End of this diff (e.g. the closing fence or prose)
+            hunks.append(Hunk("".join(search), "".join(replace)))
+            search, replace = None, None
+    if search is not None:
+        hunks.append(Hunk("".join(search), "".join(replace)))
+    return [hunk for hunk in hunks if hunk.search != hunk.replace]
+
+def parse_hunks(text):
+    """Extract search/replace blocks, or failing that unified diff hunks, from a model reply."""
+    hunks = [Hunk(search, replace) for search, replace in SEARCH_REPLACE_PATTERN.findall(text)]
+    if hunks:
+        return hunks
+    return _parse_unified_diff(text)
+
+def full_file_from_reply(text):
+    """Content of the largest fenced code block in a reply to FULL_FILE_PROMPT, or None.
+
+    Only for replies to that prompt; anywhere else a code block may be just part of the file.
+    """
+    blocks = re.findall(r"```[\w+-]*\n(.*?)```", text, re.DOTALL)
+    return max(blocks, key=len) if blocks else None
+
+def looks_truncated(old, new, min_ratio=0.5):
+    """True if a full-file reply lost much of the file: under min_ratio of the lines, or of its lines kept."""
+    old_lines = old.splitlines()
+    if len(old_lines) < 4:
+        return False
+    new_lines = new.splitlines()
+    if len(new_lines) < len(old_lines) * min_ratio:
+        return True
+    kept = set(line.strip() for line in new_lines)
+    return sum(1 for line in old_lines if line.strip() in kept) < len(old_lines) * min_ratio
+
+def _find_exact(lines, search_lines):
+    """Every index where search_lines occur in lines."""
+    n = len(search_lines)
+    first = search_lines[0]
+    return [i for i in range(len(lines) - n + 1) if lines[i] == first and lines[i:i + n] == search_lines]
+
+def _find_fuzzy(lines, search_lines, threshold):
+    """Best (index, ratio) window for search_lines by similarity, via anchor-line voting."""
+    n = len(search_lines)
+    positions = {}
+    for i, line in enumerate(lines):
+        key = line.strip()
+        if key:
+            positions.setdefault(key, []).append(i)
+
+    # Every distinctive search line found in the file votes for where the hunk starts
+    votes = Counter()
+    for offset, line in enumerate(search_lines):
+        for i in positions.get(line.strip(), ())[:50]:
+            if 0 <= i - offset <= len(lines) - n:
+                votes[i - offset] += 1
+
+    target = "".join(search_lines)
+    best = (None, 0.0)
+    for start, _ in votes.most_common(FUZZY_CANDIDATES):
+        matcher = difflib.SequenceMatcher(None, target, "".join(lines[start:start + n]), autojunk=False)
+        if matcher.quick_ratio() < max(threshold, best[1]):
+            continue
+        ratio = matcher.ratio()
+        if ratio > best[1]:
+            best = (start, ratio)
+    return best if best[1] >= threshold else (None, best[1])
+
+def _reindent(replace_lines, search_lines, found_lines):
+    """Carry the file's indentation over to replacement lines written with different indentation.
+
+    Each indent used in the hunk's search lines is mapped to the indent of
+    the file line it matched; replacement lines are re-indented through the
+    longest mapped indent they start with.
+    """
+    def indent(line):
+        return line[:len(line) - len(line.lstrip())]
+
+    mapping = {}
+    for searched, found in zip(search_lines, found_lines):
+        if searched.strip():
+            mapping.setdefault(indent(searched), indent(found))
+    if all(key == value for key, value in mapping.items()):
+        return replace_lines
+
+    known = sorted(mapping, key=len, reverse=True)
+    result = []
+    for line in replace_lines:
+        current = indent(line)
+        prefix = next((key for key in known if current.startswith(key)), None) if line.strip() else None
+        result.append(line if prefix is None else mapping[prefix] + line[len(prefix):])
+    return result
+
+def apply_hunks(content, hunks, threshold=None):
+    """Apply hunks in order to content, entirely in memory.
+
+    Each hunk is located by an exact match, then ignoring whitespace, then
+    by similarity (at least threshold). An exact or whitespace match must be
+    unique; a SEARCH found in several places could edit the wrong one.
+    Either every hunk applies or PatchError is raised and nothing changes.
+
+    Returns:
+        tuple: (new content, list of match kinds: "exact", "whitespace", "fuzzy" or "append")
+    """
+    threshold = fuzzy_threshold if threshold is None else threshold
+    lines = content.splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+        missing_newline = True
+    else:
+        missing_newline = False
+
+    kinds = []
+    for number, hunk in enumerate(hunks, 1):
+        search_lines = hunk.search.splitlines(keepends=True)
+        replace_lines = hunk.replace.splitlines(keepends=True)
+        if replace_lines and not replace_lines[-1].endswith("\n"):
+            replace_lines[-1] += "\n"
+
+        if not any(line.strip() for line in search_lines):
+            lines.extend(replace_lines)
+            kinds.append("append")
+            continue
+        if not search_lines[-1].endswith("\n"):
+            search_lines[-1] += "\n"
+
+        matches = _find_exact(lines, search_lines)
+        kind = "exact"
+        if not matches:
+            stripped = [line.strip() for line in lines]
+            wanted = [line.strip() for line in search_lines]
+            matches = _find_exact(stripped, wanted)
+            kind = "whitespace"
+        if len(matches) > 1:
+            places = ", ".join(str(i + 1) for i in matches[:5]) + (", ..." if len(matches) > 5 else "")
+            raise PatchError(f"Hunk {number} matches {len(matches)} places (lines {places}); "
+                             f"it needs more context to be unique:\n{hunk.search[:200]}")
+        index = matches[0] if matches else None
+        if index is None:
+            index, ratio = _find_fuzzy(lines, search_lines, threshold)
+            kind = "fuzzy"
+            if index is None:
+                raise PatchError(f"Hunk {number} not found (best similarity {ratio:.0%}):\n{hunk.search[:200]}")
+
+        found = lines[index:index + len(search_lines)]
+        if kind != "exact":
+            replace_lines = _reindent(replace_lines, search_lines, found)
+        lines[index:index + len(search_lines)] = replace_lines
+        kinds.append(kind)
+
+    result = "".join(lines)
+    if missing_newline and result.endswith("\n"):
+        result = result[:-1]
+    return result, kinds
+
+def summarize_diff(old, new, path, max_lines=60):
+    """Unified diff of old -> new (cut to max_lines) and (added, removed) line counts."""
+    diff = list(difflib.unified_diff(old.splitlines(), new.splitlines(), f"a/{path}", f"b/{path}", lineterm=""))
+    added = sum(1 for line in diff if line.startswith("+") and not line.startswith("+++"))
+    removed = sum(1 for line in diff if line.startswith("-") and not line.startswith("---"))
+    if len(diff) > max_lines:
+        diff = diff[:max_lines] + [f"... ({len(diff) - max_lines} more diff lines)"]
+    return "\n".join(diff), added, removed
@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+# Profiling configuration; nothing here runs unless profiling is enabled
+enabled = os.getenv("AGENT_PROFILE", "false").lower() == "true"
+profile_mode = os.getenv("PROFILE_MODE", "cprofile").lower()      # cprofile or sample
+profile_dir = os.getenv("PROFILE_DIR", os.path.join(".agent", "profiles"))
+profile_top = int(os.getenv("PROFILE_TOP", "15"))
+sample_interval = float(os.getenv("PROFILE_INTERVAL", "0.005"))   # Seconds between samples
+
+_sequence = 0
+
+def _output_path(label, extension):
+    """Next per-turn file name, e.g. .agent/profiles/0003-20240101-120000-dir.pstats"""
+    global _sequence
+    _sequence += 1
+    slug = "".join(c if c.isalnum() else "-" for c in label.lstrip("!"))[:40].strip("-") or "turn"
+    os.makedirs(profile_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(profile_dir, f"{_sequence:04d}-{stamp}-{slug}.{extension}")
+
+def _describe(filename, line, name):
+    if filename == "~":
+        return name  # Built-in, e.g. <method 'findall' of 're.Pattern' objects>
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+def _run_cprofile(label, fn, args):
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return fn(*args)
+    finally:
+        profiler.disable()
+        path = _output_path(label, "pstats")
+        profiler.dump_stats(path)
+        stats = pstats.Stats(profiler).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:profile_top]
+        lines = [f"{'calls':>8}  {'self s':>8}  {'cum s':>8}  function"]
+        for (filename, line, name), (_, calls, self_time, cum_time, _) in rows:
+            lines.append(f"{calls:>8}  {self_time:>8.4f}  {cum_time:>8.4f}  {_describe(filename, line, name)}")
+        _report(label, path, lines)
+
+class Sampler:
+    """Samples one thread's stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+def _run_sampler(label, fn, args):
+    sampler = Sampler(threading.get_ident(), sample_interval)
+    sampler.start()
+    try:
+        return fn(*args)
+    finally:
+        sampler.stop()
+        path = _output_path(label, "folded")
+        # Collapsed-stack format, as read by flamegraph.pl and speedscope
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        total = sum(sampler.stacks.values())
+        own = Counter()
+        for stack, count in sampler.stacks.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        lines = [f"{'samples':>8}  {'self %':>7}  function"]
+        for name, count in own.most_common(profile_top):
+            lines.append(f"{count:>8}  {100 * count / total:>6.1f}%  {name}")
+        _report(label, path, lines if total else ["(finished before the first sample)"])
+
+def _report(label, path, lines):
+    print(f"\n🔬 Profile of {label} saved to {path}")
+    for line in lines:
+        print(f"   {line}")
+
+def call(label, fn, *args):
+    """Run fn(*args) under the configured profiler and print its hottest functions.
+
+    Callers check `enabled` first, so the normal path doesn't pay for a
+    wrapper call when profiling is off.
+    """
+    if profile_mode == "sample":
+        return _run_sampler(label, fn, args)
+    return _run_cprofile(label, fn, args)
+
+def status():
+    return {
+        "enabled": enabled,
+        "mode": profile_mode,
+        "directory": profile_dir,
+        "top": profile_top,
+        "profiles_written": _sequence
+    }
@@ -0,0 +1,274 @@
+import os
+import bisect
+import hashlib
+from array import array
+from collections import namedtuple
+
+# Ranged read configuration
+index_dir = os.getenv("READ_INDEX_DIR", os.path.join(".agent", "cache", "line_index"))
+max_output_bytes = int(os.getenv("READ_MAX_BYTES", str(256 * 1024)))   # Cap on text returned by one read
+default_lines = int(os.getenv("READ_DEFAULT_LINES", "200"))             # Shown by a plain !read of a large file
+INDEX_BLOCK = 64 * 1024      # One index entry per block read while scanning
+READ_CHUNK = 1024 * 1024
+BINARY_SNIFF_BYTES = 8192
+INDEX_MAGIC = 0x4C494458     # "LIDX"
+
+ReadResult = namedtuple("ReadResult", [
+    "text",         # Decoded text of the range (possibly cut at max_output_bytes)
+    "first_line",   # 1-based number of the first line shown, or None if unknown
+    "last_line",    # Number of the last line shown, or None
+    "total_lines",  # Lines in the file if known, else None
+    "start",        # Byte offset of the range
+    "end",          # Byte offset just past the range
+    "size",         # File size in bytes
+    "truncated"     # True if the range was cut to max_output_bytes
+])
+
+class BinaryFileError(Exception):
+    """Raised instead of dumping a file that looks binary."""
+
+def is_binary(path):
+    """True if the file's first bytes contain NUL or are mostly control characters."""
+    with open(path, 'rb') as f:
+        sample = f.read(BINARY_SNIFF_BYTES)
+    if b"\0" in sample:
+        return True
+    try:
+        sample.decode("utf-8")
+        return False
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off at the end of the sample is still text
+        if e.start >= len(sample) - 3:
+            return False
+    control = sum(1 for b in sample if b < 32 and b not in (9, 10, 12, 13, 27))
+    return control > len(sample) * 0.1
+
+class LineIndex:
+    """Sparse line-offset index: (line number, byte offset) of one line start per 64 KB block.
+
+    Building it is one sequential pass with a find() and count() per block,
+    both in C, so a multi-GB log is indexed at disk speed. Seeking to any line
+    is then a bisect plus reading at most one block's worth of lines.
+    """
+
+    def __init__(self, line_numbers, offsets, total_lines, mtime_ns, size):
+        self.line_numbers = line_numbers  # 0-based line number starting at offsets[i]
+        self.offsets = offsets
+        self.total_lines = total_lines
+        self.mtime_ns = mtime_ns
+        self.size = size
+
+    @classmethod
+    def build(cls, path, st):
+        line_numbers = array("Q", [0])
+        offsets = array("Q", [0])
+        newlines = 0
+        position = 0
+        last = b""
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(INDEX_BLOCK)
+                if not block:
+                    break
+                first = block.find(b"\n")
+                if first >= 0:
+                    line_numbers.append(newlines + 1)
+                    offsets.append(position + first + 1)
+                    newlines += block.count(b"\n")
+                position += len(block)
+                last = block[-1:]
+        # A last line without a trailing newline still counts
+        total = newlines + (1 if last not in (b"", b"\n") else 0)
+        return cls(line_numbers, offsets, total, st.st_mtime_ns, st.st_size)
+
+    def line_offset(self, f, line):
+        """Byte offset where 0-based line starts (the file size past the end)."""
+        if line >= self.total_lines:
+            return self.size
+        i = bisect.bisect_right(self.line_numbers, line) - 1
+        position = self.offsets[i]
+        f.seek(position)
+        for _ in range(line - self.line_numbers[i]):
+            position += len(f.readline())
+        return position
+
+    def save(self, path):
+        os.makedirs(index_dir, exist_ok=True)
+        target = _index_path(path)
+        tmp = f"{target}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            array("Q", [INDEX_MAGIC, self.mtime_ns, self.size, self.total_lines, len(self.offsets)]).tofile(f)
+            self.line_numbers.tofile(f)
+            self.offsets.tofile(f)
+        os.replace(tmp, target)
+
+    @classmethod
+    def load(cls, path, st):
+        """Load the on-disk index for path, or None if missing or stale."""
+        try:
+            with open(_index_path(path), 'rb') as f:
+                header = array("Q")
+                header.fromfile(f, 5)
+                magic, mtime_ns, size, total_lines, count = header
+                if magic != INDEX_MAGIC or mtime_ns != st.st_mtime_ns or size != st.st_size:
+                    return None
+                line_numbers = array("Q")
+                line_numbers.fromfile(f, count)
+                offsets = array("Q")
+                offsets.fromfile(f, count)
+        except (OSError, EOFError, ValueError):
+            return None
+        return cls(line_numbers, offsets, total_lines, mtime_ns, size)
+
+def _index_path(path):
+    digest = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:32]
+    return os.path.join(index_dir, digest + ".idx")
+
+_indexes = {}
+
+def get_line_index(path):
+    """Return an up-to-date LineIndex for path, from memory, disk or a fresh scan."""
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    index = _indexes.get(key)
+    if index is None or index.mtime_ns != st.st_mtime_ns or index.size != st.st_size:
+        index = LineIndex.load(path, st)
+        if index is None:
+            index = LineIndex.build(path, st)
+            try:
+                index.save(path)
+            except OSError:
+                pass  # The in-memory index still works
+        _indexes[key] = index
+    return index
+
+def _cached_total(path, size):
+    """Line count from an index built earlier, without scanning the file."""
+    index = _indexes.get(os.path.abspath(path))
+    return index.total_lines if index and index.size == size else None
+
+def _count_lines(data):
+    return data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0)
+
+def _read_forward(f, start, end):
+    """Read [start, end), cut at max_output_bytes on a line boundary; returns (data, truncated)."""
+    f.seek(start)
+    if end - start <= max_output_bytes:
+        return f.read(end - start), False
+    data = f.read(max_output_bytes)
+    cut = data.rfind(b"\n")
+    return (data[:cut + 1] if cut >= 0 else data), True
+
+def read_head(path, count):
+    """First count lines, reading only as far as needed."""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        end = 0
+        for _ in range(count):
+            line = f.readline(max_output_bytes + 1)
+            if not line:
+                break
+            end += len(line)
+            if end > max_output_bytes:
+                break
+        data, truncated = _read_forward(f, 0, end)
+    shown = _count_lines(data)
+    return ReadResult(data.decode("utf-8", errors="replace"), 1 if shown else None, shown or None,
+                      _cached_total(path, size), 0, len(data), size, truncated)
+
+def read_tail(path, count):
+    """Last count lines, scanning backwards from the end of the file."""
+    size = os.path.getsize(path)
+    start = 0
+    with open(path, 'rb') as f:
+        # The newline ending the last line doesn't start another one
+        search_end = size
+        if size:
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                search_end -= 1
+        needed = count
+        while search_end > 0 and size - search_end <= max_output_bytes:
+            step = min(READ_CHUNK, search_end)
+            f.seek(search_end - step)
+            chunk = f.read(step)
+            found = chunk.count(b"\n")
+            if found >= needed:
+                pos = len(chunk)
+                for _ in range(needed):
+                    pos = chunk.rindex(b"\n", 0, pos)
+                start = search_end - step + pos + 1
+                break
+            needed -= found
+            search_end -= step
+
+        truncated = size - start > max_output_bytes
+        if truncated:
+            # Keep the end of the file, starting at a line boundary
+            f.seek(size - max_output_bytes)
+            data = f.read(max_output_bytes)
+            cut = data.find(b"\n")
+            data = data[cut + 1:] if 0 <= cut < len(data) - 1 else data
+            start = size - len(data)
+        else:
+            f.seek(start)
+            data = f.read(size - start)
+
+    total = _cached_total(path, size)
+    shown = _count_lines(data)
+    first = total - shown + 1 if total is not None and shown else None
+    return ReadResult(data.decode("utf-8", errors="replace"), first, total if shown else None,
+                      total, start, size, size, truncated)
+
+def read_lines(path, first, last=None):
+    """Lines first..last (1-based, inclusive; None means to the end), via the line index."""
+    index = get_line_index(path)
+    first = max(1, first)
+    last = index.total_lines if last is None else min(last, index.total_lines)
+    if first > last:
+        return ReadResult("", None, None, index.total_lines, index.size, index.size, index.size, False)
+    with open(path, 'rb') as f:
+        start = index.line_offset(f, first - 1)
+        end = index.line_offset(f, last)
+        data, truncated = _read_forward(f, start, end)
+    if truncated:
+        last = first + _count_lines(data) - 1
+    return ReadResult(data.decode("utf-8", errors="replace"), first, last, index.total_lines,
+                      start, start + len(data), index.size, truncated)
+
+def read_bytes(path, start, end=None):
+    """Bytes [start, end) decoded as UTF-8, with invalid sequences replaced."""
+    size = os.path.getsize(path)
+    end = size if end is None else min(end, size)
+    start = min(max(0, start), end)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        truncated = end - start > max_output_bytes
+        data = f.read(min(end - start, max_output_bytes))
+    return ReadResult(data.decode("utf-8", errors="replace"), None, None, _cached_total(path, size),
+                      start, start + len(data), size, truncated)
+
+def read_range(path, head=None, tail=None, lines=None, byte_range=None):
+    """Read part of a file; with no range, the whole file if small, else its first lines.
+
+    Args:
+        head / tail: Number of lines from the start / end
+        lines: (first, last) 1-based inclusive; last may be None
+        byte_range: (start, end) byte offsets; end may be None
+
+    Raises:
+        BinaryFileError: if the file looks binary
+    """
+    if is_binary(path):
+        raise BinaryFileError(f"{path} looks like a binary file ({os.path.getsize(path)} bytes); not showing it")
+    if head is not None:
+        return read_head(path, head)
+    if tail is not None:
+        return read_tail(path, tail)
+    if lines is not None:
+        return read_lines(path, *lines)
+    if byte_range is not None:
+        return read_bytes(path, *byte_range)
+    if os.path.getsize(path) <= max_output_bytes:
+        return read_bytes(path, 0)
+    return read_head(path, default_lines)
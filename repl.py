@@ -0,0 +1,389 @@
+"""Interactive loop for agent.py, built on asyncio.
+
+LLM turns and !run commands run as tasks while the loop keeps reading the
+terminal. Ctrl-C cancels the current task instead of the agent, read-only
+commands (!dir, !read, !history, ...) are answered while a turn is still
+generating, and !bg queues a prompt as a background task whose output is
+kept until !collect.
+"""
+import sys
+import time
+import queue
+import signal
+import asyncio
+import threading
+from collections import deque
+
+import agent
+import console
+
+# Commands that only read state, safe to run next to an in-flight turn
+LOCAL_COMMANDS = {"!dir", "!read", "!list", "!history", "!info", "!stats", "!cache", "!jobs", "!tail", "!help", "!h"}
+TASK_COMMANDS = {"!bg", "!tasks", "!collect", "!cancel"}
+PROMPT = "👤 > "
+
+class StdinBroker:
+    """The only reader of the terminal, shared by the loop and tasks calling input().
+
+    Requests are served by priority, so a task's question (e.g. where to save
+    files) gets the next line typed even while the loop is waiting for a
+    command. Everyone prints their own prompt.
+    """
+
+    TASK, LOOP = 0, 1
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._requests = []   # [priority, sequence, deliver]
+        self._sequence = 0
+        self._eof = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._requests:
+                    self._cond.wait()
+            try:
+                line = console.real_input("")
+            except EOFError:
+                line = None
+            with self._cond:
+                self._requests.sort()
+                deliver = self._requests.pop(0)[2]
+                if line is None:
+                    self._eof = True
+                    waiting, self._requests = self._requests, []
+            deliver(line)
+            if line is None:
+                for _, _, other in waiting:
+                    other(None)
+                return
+
+    def request(self, priority, deliver):
+        """Call deliver(line) with the next line typed, or None at end of input."""
+        with self._cond:
+            if self._eof:
+                entry = None
+            else:
+                entry = [priority, self._sequence, deliver]
+                self._sequence += 1
+                self._requests.append(entry)
+                self._cond.notify()
+        if entry is None:
+            deliver(None)
+        return entry
+
+    def withdraw(self, entry):
+        with self._cond:
+            if entry in self._requests:
+                self._requests.remove(entry)
+
+    def ask(self, cancel_event=None):
+        """Blocking read for a task thread; raises TurnCancelled if its task is cancelled."""
+        answers = queue.Queue()
+        entry = self.request(self.TASK, answers.put)
+        while True:
+            try:
+                line = answers.get(timeout=0.1)
+            except queue.Empty:
+                if cancel_event is not None and cancel_event.is_set():
+                    self.withdraw(entry)
+                    raise console.TurnCancelled("Cancelled")
+                continue
+            if line is None:
+                raise EOFError
+            return line
+
+class TerminalSink:
+    """Foreground output: straight to the terminal until the task is cancelled."""
+
+    def __init__(self, broker, cancel_event):
+        self.broker = broker
+        self.cancel_event = cancel_event
+
+    def write(self, text):
+        if not self.cancel_event.is_set():
+            console.real_stdout.write(text)
+
+    def flush(self):
+        console.real_stdout.flush()
+
+    def input(self, prompt=""):
+        self.write(prompt)
+        self.flush()
+        return self.broker.ask(self.cancel_event)
+
+class CaptureSink:
+    """Background output, kept for !collect. Questions get their default answer."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def input(self, prompt=""):
+        self.parts.append(f"{prompt}(default)\n")
+        return ""
+
+    def text(self):
+        return "".join(self.parts)
+
+class BackgroundTask:
+    def __init__(self, task_id, prompt):
+        self.id = task_id
+        self.prompt = prompt
+        self.sink = CaptureSink()
+        self.cancel_event = threading.Event()
+        self.state = "queued"    # queued, running, done, failed or cancelled
+        self.result = None
+        self.files = []
+        self.started = None
+        self.finished = None
+        self.task = None
+
+    def describe(self):
+        icon = {"queued": "🕓", "running": "⏳", "done": "✅", "failed": "❌", "cancelled": "⛔"}[self.state]
+        elapsed = ""
+        if self.started:
+            elapsed = f" {(self.finished or time.monotonic()) - self.started:.1f}s"
+        return f"{icon} #{self.id} {self.state}{elapsed}  {self.prompt}"
+
+async def execute(prompt, sink, cancel_event):
+    """Run one command or LLM turn with its output routed to sink.
+
+    !run is awaited on the loop so cancelling it stops the process group;
+    everything else runs in a worker thread through agent.handle_prompt().
+    """
+    with console.routed(sink, cancel_event):
+        command = agent.expand_alias(prompt)
+        if agent.command_name(command) == "!run" and command[5:].strip():
+            return await agent.arun_shell_command(command[5:].strip()), []
+        return await console.in_thread(agent.handle_prompt, prompt)
+
+class Repl:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.broker = StdinBroker()
+        # Piped input is read strictly in order, as the old blocking loop did;
+        # a terminal is read ahead so the user can type while a turn runs
+        self.read_ahead = sys.stdin.isatty()
+        self.foreground = None
+        self.cancel_event = None
+        self.typed_ahead = deque()
+        self.side_tasks = set()
+        self.background = {}
+        self.background_queue = asyncio.Queue()
+        self.next_id = 1
+        self.exiting = False
+
+    # Foreground tasks
+
+    def start(self, prompt):
+        self.cancel_event = threading.Event()
+        sink = TerminalSink(self.broker, self.cancel_event)
+        self.foreground = asyncio.ensure_future(execute(prompt, sink, self.cancel_event))
+
+    def finish(self, task):
+        try:
+            result, _ = task.result()
+        except (asyncio.CancelledError, console.TurnCancelled):
+            print("\n⛔ Cancelled")
+        except EOFError:
+            print("\n⛔ Input closed")
+        except Exception as e:
+            print(f"\n❌ {str(e)}")
+        else:
+            if result:
+                print(f"\n🤖 > {result}")
+
+    def interrupt(self):
+        """Ctrl-C: cancel the foreground task (and anything typed ahead), never the agent."""
+        if self.foreground is None:
+            print("\n(Ctrl-C cancels a running request; type 'exit' to quit)")
+            print(PROMPT, end="", flush=True)
+            return
+        self.cancel_event.set()
+        self.foreground.cancel()
+        if self.typed_ahead:
+            print(f"\n⛔ Dropped {len(self.typed_ahead)} prompt(s) typed ahead")
+            self.typed_ahead.clear()
+
+    async def run_side(self, prompt):
+        """A read-only command answered while the foreground task keeps running."""
+        sink = TerminalSink(self.broker, threading.Event())
+        try:
+            result, _ = await execute(prompt, sink, None)
+        except Exception as e:
+            result = f"❌ {str(e)}"
+        if result:
+            print(f"\n🤖 > {result}")
+        print(PROMPT, end="", flush=True)
+
+    # Background tasks
+
+    async def background_worker(self):
+        """Run queued background tasks one at a time, in the order they were queued."""
+        while True:
+            job = await self.background_queue.get()
+            if job.state != "queued":
+                continue
+            job.state = "running"
+            job.started = time.monotonic()
+            job.task = asyncio.ensure_future(execute(job.prompt, job.sink, job.cancel_event))
+            # wait() rather than await, so !cancel of the job isn't mistaken for cancelling the worker
+            await asyncio.wait({job.task})
+            try:
+                job.result, job.files = job.task.result()
+                job.state = "done"
+            except (asyncio.CancelledError, console.TurnCancelled):
+                job.state = "cancelled"
+            except Exception as e:
+                job.result = f"❌ {str(e)}"
+                job.state = "failed"
+            job.finished = time.monotonic()
+            print(f"\n🔔 Background task #{job.id} {job.state} (!collect {job.id} to see it)")
+            if not self.exiting:
+                print(PROMPT, end="", flush=True)
+
+    def task_command(self, name, args):
+        if name == "!bg":
+            if not args:
+                return "❌ Usage: !bg <prompt or !command>"
+            job = BackgroundTask(self.next_id, args)
+            self.next_id += 1
+            self.background[job.id] = job
+            self.background_queue.put_nowait(job)
+            return f"🕓 Queued background task #{job.id}. See !tasks; !collect {job.id} shows its output."
+
+        if name == "!tasks":
+            if not self.background:
+                return "No background tasks. Queue one with: !bg <prompt>"
+            return "\n".join(job.describe() for job in self.background.values())
+
+        if name == "!cancel":
+            job = self.find(args)
+            if isinstance(job, str):
+                return job
+            if job.state not in ("queued", "running"):
+                return f"Task #{job.id} already {job.state}."
+            job.cancel_event.set()
+            if job.task:
+                job.task.cancel()
+            else:
+                job.state = "cancelled"
+            return f"⛔ Cancelling task #{job.id}."
+
+        # !collect: show and forget finished tasks
+        if args:
+            job = self.find(args)
+            if isinstance(job, str):
+                return job
+            jobs = [job]
+        else:
+            jobs = [job for job in self.background.values() if job.state in ("done", "failed", "cancelled")]
+        if not jobs:
+            return "No finished background tasks."
+        sections = []
+        for job in jobs:
+            if job.state in ("queued", "running"):
+                sections.append(f"{job.describe()}\n(still {job.state}; output so far)\n{job.sink.text()}")
+                continue
+            output = job.sink.text().strip()
+            result = f"\n🤖 > {job.result}" if job.result else ""
+            files = f"\n📄 Files: {', '.join(job.files)}" if job.files else ""
+            sections.append(f"{job.describe()}\n{output}{result}{files}")
+            del self.background[job.id]
+        return "\n\n".join(sections)
+
+    def find(self, args):
+        try:
+            job = self.background.get(int(args.strip().lstrip("#")))
+        except ValueError:
+            return "❌ Give a task id from !tasks"
+        return job or f"❌ No background task #{args.strip()}"
+
+    # Input
+
+    def request_line(self):
+        future = self.loop.create_future()
+
+        def deliver(line):
+            self.loop.call_soon_threadsafe(lambda: future.done() or future.set_result(line))
+
+        self.broker.request(StdinBroker.LOOP, deliver)
+        print(PROMPT, end="", flush=True)
+        return future
+
+    @staticmethod
+    def follows(name, prompt):
+        """!tail -f runs until its job ends; as a side task Ctrl-C couldn't stop it, so it waits its turn."""
+        return name == "!tail" and "-f" in prompt.split()[1:]
+
+    def dispatch(self, prompt):
+        """Handle one line from the terminal."""
+        name = agent.command_name(prompt)
+        if name in TASK_COMMANDS:
+            words = agent.expand_alias(prompt).split(None, 1)
+            print(f"\n🤖 > {self.task_command(name, words[1].strip() if len(words) > 1 else '')}")
+        elif self.foreground is None:
+            self.start(prompt)
+        elif name in LOCAL_COMMANDS and not self.follows(name, prompt):
+            task = asyncio.ensure_future(self.run_side(prompt))
+            self.side_tasks.add(task)
+            task.add_done_callback(self.side_tasks.discard)
+        else:
+            self.typed_ahead.append(prompt)
+            print(f"🕓 Runs after the current request ({len(self.typed_ahead)} waiting). Ctrl-C cancels the current one.")
+
+    async def run(self):
+        try:
+            self.loop.add_signal_handler(signal.SIGINT, self.interrupt)
+        except (NotImplementedError, RuntimeError):
+            signal.signal(signal.SIGINT, lambda *_: self.loop.call_soon_threadsafe(self.interrupt))
+        worker = asyncio.ensure_future(self.background_worker())
+        line = None
+        try:
+            while True:
+                if self.foreground is None and self.typed_ahead:
+                    self.start(self.typed_ahead.popleft())
+                if self.foreground is None and self.exiting:
+                    break
+                if line is None and not self.exiting and (self.foreground is None or self.read_ahead):
+                    line = self.request_line()
+
+                waiting = {f for f in (line, self.foreground) if f is not None}
+                await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+                if self.foreground is not None and self.foreground.done():
+                    self.finish(self.foreground)
+                    self.foreground = None
+                    if line is not None and not line.done():
+                        print(PROMPT, end="", flush=True)
+                    continue
+
+                prompt = line.result()
+                line = None
+                if prompt is None or prompt.strip().lower() == "exit":
+                    # Let the running request finish; Ctrl-C still cancels it
+                    self.exiting = True
+                    continue
+                if prompt.strip():
+                    self.dispatch(prompt)
+        finally:
+            worker.cancel()
+            for job in self.background.values():
+                job.cancel_event.set()
+            pending = sum(1 for job in self.background.values() if job.state in ("queued", "running"))
+            if pending:
+                print(f"⛔ Dropped {pending} unfinished background task(s)")
+        print("Goodbye! 👋")
+
+async def run():
+    """Run the interactive loop until 'exit' or end of input."""
+    console.install()
+    try:
+        await Repl().run()
+    finally:
+        console.uninstall()
@@ -0,0 +1,311 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+
+# Resilience configuration for calls to the model
+request_timeout = float(os.getenv("GEMINI_TIMEOUT", "120"))           # Seconds per attempt, 0 disables
+max_retries = int(os.getenv("GEMINI_RETRIES", "3"))
+backoff_base = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))          # Seconds before the first retry
+backoff_max = float(os.getenv("GEMINI_BACKOFF_MAX", "16"))
+hedge_enabled = os.getenv("GEMINI_HEDGE", "false").lower() == "true"
+hedge_percentile = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95"))
+hedge_min_samples = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+breaker_threshold = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))    # Consecutive failures to open
+breaker_reset = float(os.getenv("GEMINI_BREAKER_RESET", "30"))         # Seconds before a trial call
+
+# HTTP statuses and gRPC/api_core error names worth retrying
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {
+    "TooManyRequests", "ResourceExhausted", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway", "Aborted"
+}
+
+resilience_stats = {
+    "calls": 0,
+    "retries": 0,
+    "timeouts": 0,
+    "hedges": 0,
+    "hedge_wins": 0,
+    "rejected": 0
+}
+
+class CircuitOpenError(Exception):
+    """Raised without calling the backend while the circuit breaker is open."""
+
+class CircuitBreaker:
+    """Fail fast after repeated failures, then let a single trial call through.
+
+    closed: calls go through; breaker_threshold consecutive failures open it.
+    open: calls are rejected until reset_timeout has passed.
+    half-open: one trial call; success closes the breaker, failure reopens it.
+    """
+
+    def __init__(self, threshold=None, reset_timeout=None, clock=time.monotonic, name="Gemini"):
+        self.name = name
+        self.threshold = threshold or breaker_threshold
+        self.reset_timeout = breaker_reset if reset_timeout is None else reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may be made now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = "half-open"
+                self._trial_running = False
+            if self.state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.threshold:
+                self.state = "open"
+                self.opened_at = self.clock()
+            self._trial_running = False
+
+    def status(self):
+        with self._lock:
+            status = {"state": self.state, "consecutive_failures": self.failures}
+            if self.state == "open":
+                status["retry_in"] = round(max(0.0, self.reset_timeout - (self.clock() - self.opened_at)), 1)
+            return status
+
+class LatencyTracker:
+    """Sliding window of recent successful call latencies."""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct):
+        """Latency at pct (0-100), or None until enough samples were seen."""
+        with self._lock:
+            if len(self._samples) < hedge_min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
+
+breaker = CircuitBreaker()   # For calls not made on behalf of one model, e.g. token counting
+breakers = {}                # model -> CircuitBreaker
+_breakers_lock = threading.Lock()
+latencies = LatencyTracker()
+
+def breaker_for(model):
+    """The model's own circuit breaker, so one failing model doesn't block calls to the others."""
+    with _breakers_lock:
+        circuit = breakers.get(model)
+        if circuit is None:
+            circuit = breakers[model] = CircuitBreaker(name=model)
+        return circuit
+
+def is_retryable(error):
+    """True for timeouts, rate limits and transient server errors."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in RETRYABLE_NAMES:
+        return True
+    code = getattr(error, "code", None)
+    if callable(code):
+        # grpc errors expose code() as a method
+        try:
+            code = code()
+        except Exception:
+            code = None
+    if isinstance(code, int) and code in RETRYABLE_CODES:
+        return True
+    # api_core errors without a usable code still start with the HTTP status
+    return str(error).startswith(tuple(f"{status} " for status in RETRYABLE_CODES))
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for the given retry number (1-based)."""
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** (attempt - 1)))
+
+# Signalled by worker threads whenever an attempt finishes
+done = threading.Condition()
+
+def _start(fn, results):
+    """Run fn in a daemon thread and put (thread, result, error, latency) on results.
+
+    Daemon threads rather than a pool: a hung request cannot be cancelled, and
+    it must neither block interpreter exit nor starve later calls of workers.
+    """
+    def target():
+        start = time.monotonic()
+        try:
+            results.append((thread, fn(), None, time.monotonic() - start))
+        except BaseException as e:
+            results.append((thread, None, e, time.monotonic() - start))
+        with done:
+            done.notify_all()
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+def _attempt(fn, timeout, hedge):
+    """One attempt at fn, with an optional hedged duplicate; returns the first success."""
+    results = []
+    started = time.monotonic()
+    deadline = started + timeout if timeout else None
+    hedge_after = latencies.percentile(hedge_percentile) if hedge else None
+    primary = _start(fn, results)
+    running = {primary}
+    hedge_thread = None
+    error = None
+
+    with done:
+        while True:
+            while results:
+                thread, value, exc, latency = results.pop(0)
+                running.discard(thread)
+                if exc is None:
+                    latencies.add(latency)
+                    if thread is hedge_thread:
+                        resilience_stats["hedge_wins"] += 1
+                    return value
+                error = exc
+            if not running:
+                # A failed attempt is retried with backoff by the caller, not hedged
+                raise error
+
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                resilience_stats["timeouts"] += 1
+                raise TimeoutError(f"No response within {timeout:g}s")
+
+            if hedge_after is not None and hedge_thread is None:
+                hedge_at = started + hedge_after
+                if now >= hedge_at:
+                    # Slow primary: race a second request against it
+                    resilience_stats["hedges"] += 1
+                    hedge_thread = _start(fn, results)
+                    running.add(hedge_thread)
+                    continue
+                wait_until = hedge_at if deadline is None else min(hedge_at, deadline)
+            else:
+                wait_until = deadline
+            done.wait(None if wait_until is None else max(0.0, wait_until - now))
+
+def call_with_resilience(fn, timeout=None, retries=None, hedge=None, circuit=None, sleep=time.sleep):
+    """Call fn() with a per-attempt deadline, retries, optional hedging and a circuit breaker.
+
+    Args:
+        fn: Zero-argument callable making one request
+        timeout: Seconds per attempt (defaults to GEMINI_TIMEOUT, 0 disables)
+        retries: Retries after the first attempt for retryable errors (GEMINI_RETRIES)
+        hedge: Fire a duplicate request once an attempt is slower than the
+            GEMINI_HEDGE_PERCENTILE latency (defaults to GEMINI_HEDGE)
+        circuit: CircuitBreaker to consult (defaults to the shared breaker)
+        sleep: Used for backoff waits; replaceable in tests
+
+    Returns:
+        Whatever fn returns
+
+    Raises:
+        CircuitOpenError: if the breaker is open
+        The last error from fn once retries are exhausted or it is not retryable
+    """
+    timeout = request_timeout if timeout is None else timeout
+    retries = max_retries if retries is None else retries
+    hedge = hedge_enabled if hedge is None else hedge
+    circuit = circuit or breaker
+    resilience_stats["calls"] += 1
+
+    attempt = 0
+    while True:
+        if not circuit.allow():
+            resilience_stats["rejected"] += 1
+            status = circuit.status()
+            raise CircuitOpenError(
+                f"{circuit.name} is failing ({status['consecutive_failures']} errors in a row); "
+                f"not retrying for {status.get('retry_in', 0)}s"
+            )
+        try:
+            result = _attempt(fn, timeout, hedge)
+        except Exception as e:
+            retryable = is_retryable(e)
+            # Client errors (bad request, auth) say nothing about backend health
+            if retryable:
+                circuit.record_failure()
+            else:
+                circuit.record_success()
+            if not retryable or attempt >= retries:
+                raise
+            attempt += 1
+            resilience_stats["retries"] += 1
+            sleep(backoff_delay(attempt))
+            continue
+        circuit.record_success()
+        return result
+
+async def acall_with_resilience(coro_fn, timeout=None, retries=None, circuit=None):
+    """Async counterpart of call_with_resilience for coroutine functions.
+
+    Same deadline, retry, backoff and circuit-breaker rules; no hedging, since
+    an event loop can run more requests concurrently instead.
+    """
+    import asyncio
+
+    timeout = request_timeout if timeout is None else timeout
+    retries = max_retries if retries is None else retries
+    circuit = circuit or breaker
+    resilience_stats["calls"] += 1
+
+    attempt = 0
+    while True:
+        if not circuit.allow():
+            resilience_stats["rejected"] += 1
+            raise CircuitOpenError(f"{circuit.name} is failing; circuit breaker is {circuit.status()['state']}")
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(coro_fn(), timeout or None)
+        except asyncio.TimeoutError:
+            resilience_stats["timeouts"] += 1
+            error = TimeoutError(f"No response within {timeout:g}s")
+        except Exception as e:
+            error = e
+        else:
+            latencies.add(time.monotonic() - start)
+            circuit.record_success()
+            return result
+
+        retryable = is_retryable(error)
+        if retryable:
+            circuit.record_failure()
+        else:
+            circuit.record_success()
+        if not retryable or attempt >= retries:
+            raise error
+        attempt += 1
+        resilience_stats["retries"] += 1
+        await asyncio.sleep(backoff_delay(attempt))
+
+def get_stats():
+    """Counters for retries, timeouts and hedges plus the breaker states."""
+    stats = dict(resilience_stats)
+    stats["breaker"] = breaker.status()
+    with _breakers_lock:
+        stats["breakers"] = {model: circuit.status() for model, circuit in breakers.items()}
+    return stats
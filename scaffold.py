@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+from collections import namedtuple
+from utils import ensure_dir, write_file_if_changed
+
+# Built-in templates ship next to this module; extra directories come from AGENT_TEMPLATE_PATH
+BUILTIN_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+template_path = [p for p in os.getenv("AGENT_TEMPLATE_PATH", "").split(os.pathsep) if p]
+template_cache_dir = os.getenv("TEMPLATE_CACHE_DIR", os.path.join(".agent", "cache", "templates"))
+link_mode = os.getenv("TEMPLATE_LINK_MODE", "reflink").lower()  # reflink, hardlink or copy
+scaffold_workers = int(os.getenv("SCAFFOLD_WORKERS", "8"))
+
+MANIFEST_FILE = "template.json"
+FILES_DIR = "files"
+VARIABLE_PATTERN = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+FICLONE = 0x40049409  # Linux ioctl for copy-on-write clones (btrfs, xfs, ...)
+
+Template = namedtuple("Template", ["name", "title", "description", "root", "variables", "dirs", "next_steps"])
+
+_registry = None
+
+def discover_templates():
+    """Scan the template directories and return {name: Template}.
+
+    A template is any directory containing a template.json manifest and a
+    files/ tree. Later directories in AGENT_TEMPLATE_PATH override built-ins
+    of the same name.
+    """
+    templates = {}
+    for base in [BUILTIN_TEMPLATE_DIR] + template_path:
+        if not os.path.isdir(base):
+            continue
+        for entry in os.scandir(base):
+            manifest_path = os.path.join(entry.path, MANIFEST_FILE)
+            if not entry.is_dir() or not os.path.isfile(manifest_path):
+                continue
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Skipping template {entry.name}: {str(e)}")
+                continue
+            templates[entry.name.lower()] = Template(
+                name=entry.name.lower(),
+                title=manifest.get("title", entry.name),
+                description=manifest.get("description", ""),
+                root=entry.path,
+                variables=manifest.get("variables", {}),
+                dirs=manifest.get("dirs", []),
+                next_steps=manifest.get("next_steps", [])
+            )
+    return templates
+
+def get_templates():
+    """Return the template registry, discovering it on first use."""
+    global _registry
+    if _registry is None:
+        _registry = discover_templates()
+    return _registry
+
+def get_template(name):
+    """Look up a template by name (case-insensitive), or None."""
+    return get_templates().get(name.lower())
+
+def _signature(template, files_root):
+    """Cheap fingerprint of a template: its variables and dirs, plus its files' paths, sizes and mtimes.
+
+    The variables decide which files need rendering, so editing template.json
+    must rebuild the manifest as surely as editing a file does.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([sorted(template.variables), template.dirs]).encode("utf-8") + b"\n")
+    for dirpath, dirnames, filenames in os.walk(files_root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            st = os.stat(path)
+            digest.update(f"{os.path.relpath(path, files_root)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def compile_template(template):
+    """Return the template's precompiled manifest, rebuilding it if the template changed.
+
+    The manifest lists every file with its hash, mode and whether it uses
+    template variables. Static files are copied into a content-addressed blob
+    cache, from which they can later be reflinked or hardlinked.
+    """
+    files_root = os.path.join(template.root, FILES_DIR)
+    signature = _signature(template, files_root)
+    manifest_path = os.path.join(template_cache_dir, f"{template.name}.json")
+
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            compiled = json.load(f)
+        if compiled.get("signature") == signature and compiled.get("root") == template.root:
+            return compiled
+    except (OSError, ValueError):
+        pass
+
+    blob_dir = os.path.join(template_cache_dir, "blobs")
+    ensure_dir(blob_dir)
+    files = []
+    for dirpath, dirnames, filenames in os.walk(files_root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            sha = hashlib.sha256(data).hexdigest()
+            used = {m.group(1) for m in VARIABLE_PATTERN.finditer(data.decode("utf-8", errors="replace"))}
+            render = bool(used & set(template.variables))
+            if not render:
+                blob = os.path.join(blob_dir, sha)
+                if not os.path.exists(blob):
+                    shutil.copyfile(path, blob)
+                    # Blobs may be hardlinked into projects; keep them read-only
+                    os.chmod(blob, 0o444)
+            files.append({
+                "path": os.path.relpath(path, files_root).replace(os.sep, "/"),
+                "size": len(data),
+                "sha256": sha,
+                "mode": os.stat(path).st_mode & 0o777,
+                "render": render
+            })
+
+    compiled = {"signature": signature, "root": template.root, "dirs": template.dirs, "files": files}
+    ensure_dir(template_cache_dir)
+    write_file_if_changed(manifest_path, json.dumps(compiled, indent=2))
+    return compiled
+
+def render(text, variables):
+    """Substitute {{name}} placeholders for known variables; others are left alone."""
+    return VARIABLE_PATTERN.sub(lambda m: str(variables.get(m.group(1), m.group(0))), text)
+
+def _same_file(path, size, sha):
+    """True if path already holds exactly these bytes."""
+    try:
+        if os.path.getsize(path) != size:
+            return False
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest() == sha
+    except OSError:
+        return False
+
+def _clone(src, dst):
+    """Copy src to dst, sharing blocks via reflink when the filesystem supports it."""
+    if link_mode == "reflink":
+        try:
+            import fcntl
+            with open(src, 'rb') as s, open(dst, 'wb') as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return
+        except (ImportError, OSError):
+            pass
+    shutil.copyfile(src, dst)
+
+def _place_blob(blob, dst, mode, link=True):
+    """Atomically put a cached blob at dst by hardlink, reflink or copy.
+
+    A hardlink shares the blob's inode and so its read-only mode; it is only
+    used when that is the mode the file should have anyway (and link is set),
+    otherwise dst gets a private copy with the given mode.
+    """
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    try:
+        if link_mode == "hardlink" and link and os.stat(blob).st_mode & 0o777 == mode:
+            try:
+                os.link(blob, tmp)
+                os.replace(tmp, dst)
+                return
+            except OSError:
+                pass
+        _clone(blob, tmp)
+        os.chmod(tmp, mode)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def materialize(template, target_dir, variables=None, max_workers=None):
+    """Create a project from a template in target_dir.
+
+    Args:
+        template: Template from the registry
+        target_dir: Directory to create the project in
+        variables: Overrides for the template's default variables
+        max_workers: Thread pool size (defaults to SCAFFOLD_WORKERS)
+
+    Returns:
+        dict with "dirs" (created directories), "files" (path -> status) and
+        "timings" (seconds spent compiling, writing and in total)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    start = time.perf_counter()
+    values = dict(template.variables)
+    values.update(variables or {})
+
+    compiled = compile_template(template)
+    compiled_at = time.perf_counter()
+
+    # Create every directory once, before any file is written
+    dirs = sorted(set(compiled["dirs"]) | {os.path.dirname(f["path"]) for f in compiled["files"]} - {""})
+    ensure_dir(target_dir)
+    for directory in dirs:
+        ensure_dir(os.path.join(target_dir, directory))
+
+    blob_dir = os.path.join(template_cache_dir, "blobs")
+    files_root = os.path.join(template.root, FILES_DIR)
+
+    def place(entry):
+        dst = os.path.join(target_dir, entry["path"])
+        try:
+            if entry["render"]:
+                with open(os.path.join(files_root, entry["path"]), 'r', encoding='utf-8') as f:
+                    return entry["path"], write_file_if_changed(dst, render(f.read(), values))
+            if _same_file(dst, entry["size"], entry["sha256"]):
+                return entry["path"], "unchanged"
+            blob = os.path.join(blob_dir, entry["sha256"])
+            if os.path.exists(blob):
+                _place_blob(blob, dst, entry["mode"])
+            else:
+                # Blob cache was cleared; copy straight from the template, never link to it
+                _place_blob(os.path.join(files_root, entry["path"]), dst, entry["mode"], link=False)
+            return entry["path"], "written"
+        except Exception as e:
+            return entry["path"], f"error: {str(e)}"
+
+    workers = max(1, min(max_workers or scaffold_workers, len(compiled["files"])))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = dict(pool.map(place, compiled["files"]))
+
+    end = time.perf_counter()
+    return {
+        "dirs": dirs,
+        "files": results,
+        "timings": {
+            "compile": compiled_at - start,
+            "write": end - compiled_at,
+            "total": end - start
+        }
+    }
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# Telemetry configuration
+telemetry_enabled = os.getenv("TELEMETRY", "true").lower() == "true"
+export_format = os.getenv("TELEMETRY_EXPORT", "").lower()   # "", "jsonl" or "prometheus"
+export_file = os.getenv("TELEMETRY_FILE", "")
+
+DEFAULT_EXPORT_FILES = {
+    "jsonl": os.path.join(".agent", "metrics", "spans.jsonl"),
+    "prometheus": os.path.join(".agent", "metrics", "agent.prom")
+}
+
+# Histogram bucket upper bounds in seconds, roughly x2.5 apart (Prometheus style)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0, 120.0, 300.0)
+
+class Histogram:
+    """Fixed-bucket latency histogram plus sums of numeric span attributes."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # Last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.attrs = {}
+
+    def observe(self, seconds, attrs):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        for name, value in attrs.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.attrs[name] = self.attrs.get(name, 0) + value
+
+    def percentile(self, pct):
+        """Estimate the pct (0-100) latency by interpolating within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = self.count * pct / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / n
+                return min(self.max, max(self.min, estimate))
+            seen += n
+        return self.max
+
+_histograms = {}
+_lock = threading.Lock()
+_sink = None
+
+def _export_path():
+    return export_file or DEFAULT_EXPORT_FILES.get(export_format, "")
+
+def _write_span(name, seconds, attrs):
+    """Append one span to the JSONL sink, opening it on first use."""
+    global _sink
+    if _sink is None:
+        path = _export_path()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        _sink = open(path, 'a', encoding='utf-8', buffering=1)
+        atexit.register(_sink.close)
+    record = {"ts": datetime.now().isoformat(), "pid": os.getpid(), "stage": name, "seconds": round(seconds, 6)}
+    record.update(attrs)
+    _sink.write(json.dumps(record, default=str) + "\n")
+
+def observe(name, seconds, **attrs):
+    """Record one completed span of `seconds` for stage `name`."""
+    if not telemetry_enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds, attrs)
+        if export_format == "jsonl":
+            _write_span(name, seconds, attrs)
+
+@contextmanager
+def span(name, **attrs):
+    """Time the enclosed block as stage `name`.
+
+    Yields a dict; keys set on it (token counts, file counts, ...) are
+    recorded with the span. Spans that raise are recorded with errors=1.
+    """
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException:
+        attrs["errors"] = 1
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, **attrs)
+
+def get_stats():
+    """Return {stage: {count, p50, p95, p99, max, total, <attribute sums>}} in seconds."""
+    with _lock:
+        stats = {}
+        for name, h in sorted(_histograms.items()):
+            stats[name] = {
+                "count": h.count,
+                "p50": h.percentile(50),
+                "p95": h.percentile(95),
+                "p99": h.percentile(99),
+                "max": h.max,
+                "total": h.total
+            }
+            stats[name].update(h.attrs)
+        return stats
+
+def format_stats():
+    """Per-stage latency percentiles as a table, with attribute totals below."""
+    stats = get_stats()
+    if not stats:
+        return "No spans recorded yet."
+    width = max(len(name) for name in stats)
+    lines = [f"{'stage':<{width}}  {'count':>6}  {'p50':>9}  {'p95':>9}  {'p99':>9}  {'max':>9}"]
+    totals = []
+    for name, s in stats.items():
+        lines.append(
+            f"{name:<{width}}  {s['count']:>6}  {_ms(s['p50'])}  {_ms(s['p95'])}  {_ms(s['p99'])}  {_ms(s['max'])}"
+        )
+        extra = {k: v for k, v in s.items() if k not in ("count", "p50", "p95", "p99", "max", "total")}
+        if extra:
+            totals.append(f"  {name}: " + ", ".join(f"{k}={v:g}" for k, v in sorted(extra.items())))
+    if totals:
+        lines.append("")
+        lines.append("Totals:")
+        lines.extend(totals)
+    return "\n".join(lines)
+
+def _ms(seconds):
+    return f"{seconds * 1000:>7.1f}ms"
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+def prometheus_text():
+    """Render the histograms in the Prometheus text exposition format."""
+    with _lock:
+        items = sorted(_histograms.items())
+        lines = [
+            "# HELP agent_stage_seconds Time spent per agent stage.",
+            "# TYPE agent_stage_seconds histogram"
+        ]
+        for name, h in items:
+            stage = _label(name)
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), h.counts):
+                cumulative += n
+                lines.append(f'agent_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'agent_stage_seconds_sum{{stage="{stage}"}} {h.total:.6f}')
+            lines.append(f'agent_stage_seconds_count{{stage="{stage}"}} {h.count}')
+        lines.append("# HELP agent_stage_attribute_total Sum of numeric span attributes (tokens, files, ...).")
+        lines.append("# TYPE agent_stage_attribute_total counter")
+        for name, h in items:
+            for attr, value in sorted(h.attrs.items()):
+                lines.append(f'agent_stage_attribute_total{{stage="{_label(name)}",attribute="{_label(attr)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+def export():
+    """Write the Prometheus textfile atomically, if that export is configured."""
+    if export_format != "prometheus":
+        return None
+    path = _export_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+    return path
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+if export_format == "prometheus":
+    atexit.register(export)
@@ -0,0 +1,3 @@
+export default function Home() {
+  return <div>Hello Next.js</div>;
+}
\ No newline at end of file
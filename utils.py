@@ -1,17 +1,98 @@
 import os
 import shutil
+import hashlib
+import tempfile
+
+# Threads used to write the files of one response in parallel
+write_workers = int(os.getenv("WRITE_WORKERS", "8"))
+
+# Permissions for newly created files, as open() would give them
+_umask = os.umask(0)
+os.umask(_umask)
+NEW_FILE_MODE = 0o666 & ~_umask
 
 def write_file(path, content):
     """Create a file with the given content at the specified path."""
     try:
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        write_file_if_changed(path, content)
         return True
     except Exception as e:
         print(f"Error writing file {path}: {str(e)}")
         return False
 
+def write_file_if_changed(path, content):
+    """Atomically replace path with content unless it already holds the same bytes.
+    
+    The file is written to a temporary file in the same directory and renamed
+    over the target, so readers never see a partial file. Identical content is
+    left untouched (mtime included), which keeps file watchers quiet.
+    
+    Returns:
+        "unchanged" or "written"
+    """
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    
+    mode = NEW_FILE_MODE
+    try:
+        st = os.stat(path)
+        mode = st.st_mode & 0o7777
+        # Only hash the existing file when the sizes already agree
+        if st.st_size == len(data):
+            with open(path, 'rb') as f:
+                if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                    return "unchanged"
+    except FileNotFoundError:
+        pass
+    
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return "written"
+
+def write_files(files, max_workers=None):
+    """Write many files at once, skipping unchanged ones.
+    
+    Parent directories are created once up front, then the files are written
+    atomically on a thread pool.
+    
+    Args:
+        files: Mapping of path -> content
+        max_workers: Thread pool size (defaults to WRITE_WORKERS)
+    
+    Returns:
+        dict: path -> "written", "unchanged" or an "error: ..." message
+    """
+    for directory in sorted({os.path.dirname(path) for path in files}):
+        if directory:
+            ensure_dir(directory)
+    
+    def write(item):
+        path, content = item
+        try:
+            return path, write_file_if_changed(path, content)
+        except Exception as e:
+            return path, f"error: {str(e)}"
+    
+    if len(files) <= 1:
+        return dict(map(write, files.items()))
+    
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(max_workers or write_workers, len(files))) as pool:
+        return dict(pool.map(write, files.items()))
+
 def read_file(path):
     """Read and return the contents of a file."""
     try:
@@ -0,0 +1,215 @@
+import os
+import re
+import math
+import time
+import pickle
+import threading
+from collections import Counter
+from executor import iter_directory
+
+# Workspace index configuration
+index_file = os.getenv("WORKSPACE_INDEX_FILE", os.path.join(".agent", "cache", "workspace_index.pickle"))
+context_enabled = os.getenv("WORKSPACE_CONTEXT", "false").lower() == "true"
+context_top_k = int(os.getenv("WORKSPACE_CONTEXT_TOP_K", "5"))
+context_byte_budget = int(os.getenv("WORKSPACE_CONTEXT_BYTES", "8000"))
+max_file_bytes = int(os.getenv("WORKSPACE_MAX_FILE_BYTES", str(512 * 1024)))
+index_dotfiles = os.getenv("WORKSPACE_INDEX_DOTFILES", "false").lower() == "true"
+daemon_token_file = os.getenv("AGENT_DAEMON_TOKEN_FILE", os.path.join(".agent", "daemon.token"))
+CHUNK_LINES = 40
+INDEX_VERSION = 2  # 1 could hold chunks of .env files
+
+# Directories that are never worth indexing, on top of .gitignore
+SKIP_PATTERNS = [".agent", "generated", "node_modules", "__pycache__", "*.pyc", "venv", ".venv"]
+# Files holding secrets; indexed chunks end up in the prompt, the response cache and the session
+SECRET_PATTERNS = [".env", ".env.*", "*.pem", "*.key", os.path.basename(daemon_token_file)]
+if not index_dotfiles:
+    SECRET_PATTERNS.append(".*")
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+CAMEL_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+def tokenize(text):
+    """Lower-cased terms, with identifiers also split on camelCase and snake_case."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text):
+        lowered = token.lower()
+        terms.append(lowered)
+        parts = [p.lower() for piece in token.split("_") for p in CAMEL_PATTERN.findall(piece)]
+        if len(parts) > 1:
+            terms.extend(p for p in parts if len(p) > 1)
+    return terms
+
+class WorkspaceIndex:
+    """Chunked BM25 index of the working tree, updated incrementally.
+
+    Files are re-read only when their mtime or size changes; the postings of
+    their old chunks are removed and the new chunks added. The index is
+    pickled between runs.
+    """
+
+    def __init__(self, root="."):
+        self.root = root
+        self.files = {}      # rel path -> (mtime_ns, size, [chunk ids])
+        self.chunks = {}     # chunk id -> (rel path, first line, text, term counts, length)
+        self.postings = {}   # term -> {chunk id: term frequency}
+        self.total_terms = 0
+        self.next_id = 0
+        self.version = INDEX_VERSION
+        self.dirty = False
+
+    @classmethod
+    def load(cls, root="."):
+        """Load the persisted index, or start an empty one."""
+        try:
+            with open(index_file, 'rb') as f:
+                index = pickle.load(f)
+            if getattr(index, "version", None) == INDEX_VERSION and index.root == root:
+                index.dirty = False
+                return index
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass
+        return cls(root)
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        tmp = f"{index_file}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, index_file)
+        self.dirty = False
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop("dirty", None)
+        return state
+
+    def _remove_file(self, rel):
+        _, _, chunk_ids = self.files.pop(rel)
+        for chunk_id in chunk_ids:
+            _, _, _, counts, length = self.chunks.pop(chunk_id)
+            self.total_terms -= length
+            for term in counts:
+                postings = self.postings[term]
+                del postings[chunk_id]
+                if not postings:
+                    del self.postings[term]
+
+    def _add_file(self, rel, mtime_ns, size):
+        chunk_ids = []
+        try:
+            with open(os.path.join(self.root, rel), 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = b""
+        # Binary files are recorded (so they aren't re-checked) but not indexed
+        if b"\0" not in data[:8192]:
+            lines = data.decode("utf-8", errors="replace").splitlines()
+            for start in range(0, len(lines), CHUNK_LINES):
+                text = "\n".join(lines[start:start + CHUNK_LINES])
+                counts = Counter(tokenize(text))
+                if not counts:
+                    continue
+                chunk_id = self.next_id
+                self.next_id += 1
+                length = sum(counts.values())
+                self.chunks[chunk_id] = (rel, start + 1, text, counts, length)
+                self.total_terms += length
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[chunk_id] = tf
+                chunk_ids.append(chunk_id)
+        self.files[rel] = (mtime_ns, size, chunk_ids)
+
+    def update(self):
+        """Bring the index up to date with the tree; returns counts of changes."""
+        start = time.perf_counter()
+        seen = set()
+        changed = 0
+        for entry in iter_directory(self.root, depth=None, ignore=SKIP_PATTERNS + SECRET_PATTERNS):
+            if entry.is_dir or entry.size > max_file_bytes:
+                continue
+            rel = entry.path
+            seen.add(rel)
+            mtime_ns = int(entry.mtime * 1e9)
+            known = self.files.get(rel)
+            if known and known[0] == mtime_ns and known[1] == entry.size:
+                continue
+            if known:
+                self._remove_file(rel)
+            self._add_file(rel, mtime_ns, entry.size)
+            changed += 1
+
+        removed = [rel for rel in self.files if rel not in seen]
+        for rel in removed:
+            self._remove_file(rel)
+
+        if changed or removed:
+            self.dirty = True
+        return {
+            "files": len(self.files),
+            "chunks": len(self.chunks),
+            "changed": changed,
+            "removed": len(removed),
+            "seconds": round(time.perf_counter() - start, 3)
+        }
+
+    def search(self, query, top_k=5):
+        """Return the top_k (score, rel path, first line, text) chunks for query by BM25."""
+        if not self.chunks:
+            return []
+        n = len(self.chunks)
+        avg_len = self.total_terms / n
+        scores = Counter()
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                length = self.chunks[chunk_id][4]
+                scores[chunk_id] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_len))
+        results = []
+        for chunk_id, score in scores.most_common(top_k):
+            rel, line, text, _, _ = self.chunks[chunk_id]
+            results.append((score, rel, line, text))
+        return results
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """Return the workspace index, loading it and applying changes since the last run."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = WorkspaceIndex.load(".")
+        _index.update()
+        _index.save()
+        return _index
+
+def build_context(prompt, top_k=None, byte_budget=None):
+    """Return the most relevant workspace chunks for prompt, within a byte budget."""
+    top_k = top_k or context_top_k
+    budget = byte_budget or context_byte_budget
+    sections = []
+    used = 0
+    for _, rel, line, text in get_index().search(prompt, top_k):
+        section = f"--- {rel} (from line {line}) ---\n{text}\n"
+        size = len(section.encode("utf-8"))
+        if used + size > budget:
+            continue
+        sections.append(section)
+        used += size
+    return "".join(sections)
+
+def add_context(prompt):
+    """Prefix prompt with relevant workspace excerpts if any are found."""
+    context = build_context(prompt)
+    if not context:
+        return prompt
+    return f"Relevant excerpts from the user's workspace:\n\n{context}\nRequest:\n{prompt}"